@@ -5,3 +5,7 @@ class ChatConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'chat'
     verbose_name = 'Chat'
+
+    def ready(self):
+        # Register signal handlers
+        from . import signals  # noqa: F401
@@ -0,0 +1,168 @@
+"""
+Async versions of the chat hot-path views, used when the site runs under ASGI.
+
+They mirror ``chat.views`` but use the async ORM, so a waiting or in-flight
+chat request doesn't hold a worker thread. ``chat.urls`` routes to these views
+when ``settings.CHAT_ASYNC_VIEWS`` is on (home/asgi.py turns it on).
+"""
+
+import asyncio
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth.decorators import login_required
+from django.http import Http404, JsonResponse
+from django.shortcuts import aget_object_or_404, redirect, render
+from django.utils.cache import get_conditional_response
+from django.utils import timezone
+from django.views.decorators.http import require_POST
+
+from webapp.notifications import notify_many
+from .membership import amember_ids, ais_member
+from .models import Conversation, Message, ReadReceipt
+from .pubsub import get_broker
+from .user_directory import directory
+from .views import (_after_id, _bad_read_upto, _marker_validators, _read_upto, _serialize_messages,
+                    _with_validators)
+
+
+async def _messages_after(convo_id, last_id):
+    """Serialize messages newer than ``last_id`` with their sender usernames."""
+    msgs = [m async for m in Message.objects.filter(conversation_id=convo_id, id__gt=last_id).order_by('id')]
+    return _serialize_messages(msgs, await directory.aget_many({m.sender_id for m in msgs}))
+
+
+async def _post_message(convo, user, text):
+    msg = await Message.objects.using('chat_db').acreate(
+        conversation_id=convo.id,
+        sender_id=user.id,
+        text=text,
+        created_at=timezone.now()
+    )
+    await Conversation.arecord_message(msg)
+    get_broker().publish(convo.id, msg.id)
+    # Notify other participants - avoid cross-db joins
+    participant_ids = [pid for pid in await amember_ids(convo.id) if pid != user.id]
+    recipients = (await directory.aget_many(participant_ids)).keys()
+    await sync_to_async(notify_many)(
+        recipients,
+        verb='New message',
+        message=f'New message from {user.username}: {text[:200]}',
+        url=f'/chat/conversation/{convo.id}/',
+        actor=user,
+    )
+    return msg
+
+
+@login_required
+async def conversation_view(request, convo_id):
+    user = await request.auser()
+    convo = await aget_object_or_404(Conversation, id=convo_id)
+    if not await ais_member(convo.id, user.id):
+        raise Http404()
+    if request.method == 'POST':
+        text = request.POST.get('text', '').strip()
+        if text:
+            # The check above may have used a cached member list
+            if not await ais_member(convo.id, user.id, fresh=True):
+                raise Http404()
+            await _post_message(convo, user, text)
+            return redirect('chat:conversation', convo_id=convo.id)
+    msgs, has_more = await Message.ahistory(convo.id)
+    if convo.last_message_id:
+        await ReadReceipt.amark_read(convo.id, user.id, convo.last_message_id)
+    participant_ids = sorted(await amember_ids(convo.id))
+    users_map = await directory.aget_many({m.sender_id for m in msgs} | set(participant_ids))
+    for m in msgs:
+        setattr(m, 'sender_user', users_map.get(m.sender_id))
+    setattr(convo, 'participants_safe', [users_map[uid] for uid in participant_ids if uid in users_map])
+    setattr(convo, 'participant_ids', participant_ids)
+    # Template rendering runs context processors that use the sync ORM
+    return await sync_to_async(render)(request, 'chat/conversation.html', {'conversation': convo, 'messages': msgs,
+                                                                           'has_more': has_more, 'long_poll': True})
+
+
+@login_required
+@require_POST
+async def send_message_ajax(request, convo_id):
+    user = await request.auser()
+    convo = await aget_object_or_404(Conversation, id=convo_id)
+    if not await ais_member(convo.id, user.id, fresh=True):
+        return JsonResponse({'success': False, 'error': 'Not a participant'})
+    text = request.POST.get('text', '').strip()
+    if not text:
+        return JsonResponse({'success': False, 'error': 'Empty message'})
+    msg = await _post_message(convo, user, text)
+    return JsonResponse({'success': True, 'id': msg.id, 'text': msg.text, 'sender': user.username, 'created_at': msg.created_at.isoformat()})
+
+
+@login_required
+async def fetch_messages(request, convo_id):
+    user = await request.auser()
+    convo = await aget_object_or_404(Conversation, id=convo_id)
+    if not await ais_member(convo.id, user.id):
+        return JsonResponse({'messages': []})
+    last_id = _after_id(request)
+    etag, last_modified = _marker_validators(convo)
+    not_modified = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if not_modified is not None:
+        return not_modified
+    if (convo.last_message_id or 0) > last_id:
+        data = await _messages_after(convo.id, last_id)
+    else:
+        data = []
+    return _with_validators(JsonResponse({'messages': data}), etag, last_modified)
+
+
+@login_required
+async def wait_messages(request, convo_id):
+    """Long-poll without holding a thread: waits on the broker's event loop hook.
+
+    Messages published in this process wake the request at once; those sent
+    through other processes are noticed within ``CHAT_LONG_POLL_RECHECK``.
+    """
+    user = await request.auser()
+    convo = await aget_object_or_404(Conversation, id=convo_id)
+    if not await ais_member(convo.id, user.id):
+        return JsonResponse({'messages': []})
+    last_id = _after_id(request)
+    broker = get_broker()
+
+    known_id = broker.last_id(convo.id)
+    if known_id is None:
+        known_id = convo.last_message_id or 0
+        broker.publish(convo.id, known_id)
+    if known_id > last_id:
+        data = await _messages_after(convo.id, last_id)
+        if data:
+            return JsonResponse({'messages': data})
+    # Newer ids may belong to deleted messages; only wake for ids past them
+    wait_after = max(last_id, known_id)
+
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + getattr(settings, 'CHAT_LONG_POLL_TIMEOUT', 25)
+    recheck = getattr(settings, 'CHAT_LONG_POLL_RECHECK', 3)
+    while not await broker.await_message(convo.id, wait_after, min(recheck, deadline - loop.time())):
+        # Another worker process may have stored a message this process's
+        # broker never heard of; the marker on the conversation tells us.
+        marker = await Conversation.objects.filter(id=convo.id).values_list('last_message_id', flat=True).afirst()
+        if (marker or 0) > wait_after:
+            break
+        if loop.time() >= deadline:
+            return JsonResponse({'messages': []})
+    return JsonResponse({'messages': await _messages_after(convo.id, last_id)})
+
+
+@login_required
+@require_POST
+async def mark_read(request, convo_id):
+    user = await request.auser()
+    convo = await aget_object_or_404(Conversation, id=convo_id)
+    if not await ais_member(convo.id, user.id, fresh=True):
+        return JsonResponse({'success': False, 'error': 'Not a participant'})
+    up_to = _read_upto(request, convo)
+    if up_to is None:
+        return _bad_read_upto()
+    if up_to:
+        await ReadReceipt.amark_read(convo.id, user.id, up_to)
+    return JsonResponse({'success': True, 'last_read_id': up_to})
@@ -0,0 +1,79 @@
+"""
+Cached conversation membership.
+
+Chat views check membership and resolve notification recipients on every
+request, including every poll. The member ids of a conversation are cached
+here and invalidated whenever ChatMember rows are created or deleted (see
+chat.signals), added in bulk (add_members) or removed with raw SQL
+(delete_conversation).
+
+With the default per-process cache, other worker processes only see an
+invalidation once their entry expires, so entries are kept short-lived
+(``CHAT_MEMBERSHIP_CACHE_TTL``); a shared cache backend removes that window.
+Reads (page loads, polls) accept that window. Writes (sending a message,
+moving the read watermark) pass ``fresh=True``, which reads the members from
+the database and stores them back in the cache.
+"""
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+from .models import ChatMember
+
+
+def _key(convo_id):
+    return f'chat:members:{convo_id}'
+
+
+def _ttl():
+    return getattr(settings, 'CHAT_MEMBERSHIP_CACHE_TTL', 60)
+
+
+def member_ids(convo_id, fresh=False):
+    """Return the frozenset of user ids that belong to a conversation.
+
+    ``fresh`` skips the cached set, for checks that must see every change.
+    """
+    members = None if fresh else cache.get(_key(convo_id))
+    if members is None:
+        members = frozenset(ChatMember.objects.filter(conversation_id=convo_id).values_list('user_id', flat=True))
+        cache.set(_key(convo_id), members, _ttl())
+    return members
+
+
+async def amember_ids(convo_id, fresh=False):
+    members = None if fresh else await cache.aget(_key(convo_id))
+    if members is None:
+        members = frozenset([
+            uid async for uid in ChatMember.objects.filter(conversation_id=convo_id).values_list('user_id', flat=True)
+        ])
+        await cache.aset(_key(convo_id), members, _ttl())
+    return members
+
+
+def is_member(convo_id, user_id, fresh=False):
+    return user_id in member_ids(convo_id, fresh)
+
+
+async def ais_member(convo_id, user_id, fresh=False):
+    return user_id in await amember_ids(convo_id, fresh)
+
+
+def invalidate(convo_id):
+    """Forget the cached members of a conversation."""
+    cache.delete(_key(convo_id))
+
+
+def add_members(convo_id, user_ids):
+    """Make ``user_ids`` members of a conversation in one INSERT.
+
+    Existing memberships are left alone. bulk_create doesn't send post_save,
+    so the cached member set is invalidated here.
+    """
+    with transaction.atomic(using='chat_db'):
+        ChatMember.objects.using('chat_db').bulk_create(
+            [ChatMember(conversation_id=convo_id, user_id=uid) for uid in set(user_ids)],
+            ignore_conflicts=True,
+        )
+    invalidate(convo_id)
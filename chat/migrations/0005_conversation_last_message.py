@@ -0,0 +1,36 @@
+# Generated by Django 5.2.6 on 2026-10-18 04:05
+
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+
+
+def backfill_last_message(apps, schema_editor):
+    Conversation = apps.get_model('chat', 'Conversation')
+    Message = apps.get_model('chat', 'Message')
+    db = schema_editor.connection.alias
+    newest = Message.objects.using(db).filter(conversation_id=OuterRef('pk')).order_by('-id')
+    Conversation.objects.using(db).update(
+        last_message_id=Subquery(newest.values('id')[:1]),
+        last_message_at=Subquery(newest.values('created_at')[:1]),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0004_chatparticipant_remove_conversation_participants_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='conversation',
+            name='last_message_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='conversation',
+            name='last_message_id',
+            field=models.BigIntegerField(blank=True, null=True),
+        ),
+        migrations.RunPython(backfill_last_message, migrations.RunPython.noop),
+    ]
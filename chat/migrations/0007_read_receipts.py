@@ -0,0 +1,46 @@
+# Generated by Django 5.2.6 on 2026-10-18 04:11
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def seed_read_receipts(apps, schema_editor):
+    # Message.read was never set, so it carries no history; start every member
+    # at the current newest message rather than showing all history as unread.
+    ChatMember = apps.get_model('chat', 'ChatMember')
+    ReadReceipt = apps.get_model('chat', 'ReadReceipt')
+    db = schema_editor.connection.alias
+    members = (ChatMember.objects.using(db)
+               .filter(conversation__last_message_id__isnull=False)
+               .values_list('conversation_id', 'user_id', 'conversation__last_message_id'))
+    ReadReceipt.objects.using(db).bulk_create(
+        [ReadReceipt(conversation_id=cid, user_id=uid, last_read_id=last_id) for cid, uid, last_id in members.iterator()],
+        batch_size=500,
+    )
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0006_message_convo_id_index'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='message',
+            name='read',
+        ),
+        migrations.CreateModel(
+            name='ReadReceipt',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('user_id', models.BigIntegerField()),
+                ('last_read_id', models.BigIntegerField(default=0)),
+                ('conversation', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='read_receipts', to='chat.conversation')),
+            ],
+            options={
+                'db_table': 'chat_read_receipts',
+                'unique_together': {('conversation', 'user_id')},
+            },
+        ),
+        migrations.RunPython(seed_read_receipts, migrations.RunPython.noop),
+    ]
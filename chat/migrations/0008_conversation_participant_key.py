@@ -0,0 +1,44 @@
+# Generated by Django 5.2.6 on 2026-10-18 04:12
+
+import hashlib
+from collections import defaultdict
+
+from django.db import migrations, models
+
+
+def key_support_conversations(apps, schema_editor):
+    # "Chat with admins" conversations are identified by their exact member
+    # set, so their key can be derived from chat_db alone (same digest as
+    # Conversation.participant_key_for). The oldest conversation wins when
+    # several share a set. Pet conversations also contain the admins, which
+    # chat_db doesn't know about; the key_pet_conversations command keys those.
+    Conversation = apps.get_model('chat', 'Conversation')
+    ChatMember = apps.get_model('chat', 'ChatMember')
+    db = schema_editor.connection.alias
+    support_ids = Conversation.objects.using(db).filter(subject='Support / Admins').values_list('id', flat=True)
+    members = defaultdict(set)
+    for cid, uid in ChatMember.objects.using(db).filter(conversation_id__in=support_ids).values_list('conversation_id', 'user_id'):
+        members[cid].add(uid)
+    seen = set()
+    for cid in sorted(members):
+        canonical = ','.join(str(uid) for uid in sorted(members[cid]))
+        key = hashlib.sha256(f'|{canonical}'.encode()).hexdigest()
+        if key not in seen:
+            seen.add(key)
+            Conversation.objects.using(db).filter(id=cid).update(participant_key=key)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0007_read_receipts'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='conversation',
+            name='participant_key',
+            field=models.CharField(blank=True, max_length=64, null=True, unique=True),
+        ),
+        migrations.RunPython(key_support_conversations, migrations.RunPython.noop),
+    ]
@@ -1,4 +1,9 @@
-from django.db import models
+import hashlib
+
+from asgiref.sync import sync_to_async
+from django.db import IntegrityError, models, transaction
+from django.db.models import OuterRef, Subquery
+from django.db.models.functions import Coalesce
 from django.conf import settings
 
 
@@ -6,10 +11,89 @@ class Conversation(models.Model):
     """A conversation between two or more users."""
     subject = models.CharField(max_length=255, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
+    # Denormalized marker of the newest message, so pollers can tell whether
+    # anything changed without querying the message table.
+    last_message_id = models.BigIntegerField(null=True, blank=True)
+    last_message_at = models.DateTimeField(null=True, blank=True)
+    # Digest of the participant set (plus an optional tag such as the pet) for
+    # conversations that must be unique per set; see find_or_create_for.
+    participant_key = models.CharField(max_length=64, null=True, blank=True, unique=True)
 
     def __str__(self):
         return self.subject or f"Conversation {self.id}"
 
+    @staticmethod
+    def participant_key_for(user_ids, tag=''):
+        """Canonical key for a set of user ids: order and duplicates don't matter."""
+        canonical = ','.join(str(uid) for uid in sorted(set(user_ids)))
+        return hashlib.sha256(f'{tag}|{canonical}'.encode()).hexdigest()
+
+    @classmethod
+    def find_or_create_for(cls, user_ids, tag='', subject=''):
+        """Return ``(conversation, created)`` for exactly this participant set.
+
+        A single lookup on the unique ``participant_key`` index; concurrent
+        callers racing to create the same conversation all end up with the
+        row that won the insert.
+        """
+        key = cls.participant_key_for(user_ids, tag)
+        convo = cls.objects.filter(participant_key=key).first()
+        if convo is not None:
+            return convo, False
+        try:
+            with transaction.atomic(using='chat_db'):
+                return cls.objects.create(participant_key=key, subject=subject), True
+        except IntegrityError:
+            return cls.objects.get(participant_key=key), False
+
+    @classmethod
+    def inbox_for(cls, user_id):
+        """Conversations of ``user_id``, most recently active first.
+
+        Each row is annotated with ``last_text``/``last_sender_id`` for the
+        newest message and ``unread_count`` (messages from others past the
+        user's read watermark), all computed by correlated subqueries in the
+        same SELECT.
+        """
+        newest = Message.objects.filter(id=OuterRef('last_message_id'))
+        read_upto = ReadReceipt.objects.filter(conversation_id=OuterRef('pk'), user_id=user_id).values('last_read_id')[:1]
+        # Range count over the (conversation_id, id) index
+        unread = (Message.objects
+                  .filter(conversation_id=OuterRef('pk'), id__gt=OuterRef('read_upto'))
+                  .exclude(sender_id=user_id)
+                  .order_by()
+                  .values('conversation_id')
+                  .annotate(n=models.Count('id'))
+                  .values('n'))
+        member_of = ChatMember.objects.filter(user_id=user_id).values('conversation_id')
+        return (cls.objects
+                .filter(id__in=member_of)
+                .annotate(read_upto=Coalesce(Subquery(read_upto), 0))
+                .annotate(
+                    last_activity=Coalesce('last_message_at', 'created_at'),
+                    last_text=Subquery(newest.values('text')[:1]),
+                    last_sender_id=Subquery(newest.values('sender_id')[:1]),
+                    unread_count=Coalesce(Subquery(unread), 0),
+                )
+                .order_by('-last_activity', '-id'))
+
+    @staticmethod
+    def _marker_update(message):
+        newer = models.Q(last_message_id__isnull=True) | models.Q(last_message_id__lt=message.id)
+        queryset = Conversation.objects.using('chat_db').filter(newer, id=message.conversation_id)
+        return queryset, {'last_message_id': message.id, 'last_message_at': message.created_at}
+
+    @classmethod
+    def record_message(cls, message):
+        """Advance the conversation's last-message marker to ``message``."""
+        queryset, values = cls._marker_update(message)
+        queryset.update(**values)
+
+    @classmethod
+    async def arecord_message(cls, message):
+        queryset, values = cls._marker_update(message)
+        await queryset.aupdate(**values)
+
 
 class ChatParticipant(models.Model):
     """Represents a participant in a conversation.
@@ -52,10 +136,80 @@ class Message(models.Model):
     sender_id = models.BigIntegerField(null=True, blank=True)
     text = models.TextField()
     created_at = models.DateTimeField(auto_now_add=True)
-    read = models.BooleanField(default=False)
 
     class Meta:
         ordering = ['created_at']
+        indexes = [
+            # History pages and "newer than" polls are id range scans per conversation
+            models.Index(fields=['conversation', 'id'], name='chat_msg_convo_id_idx'),
+        ]
 
     def __str__(self):
         return f"Message {self.id} in {self.conversation_id}"
+
+    @classmethod
+    def _history(cls, conversation_id, before=None, limit=None):
+        if limit is None:
+            limit = getattr(settings, 'CHAT_HISTORY_PAGE_SIZE', 50)
+        queryset = cls.objects.filter(conversation_id=conversation_id)
+        if before is not None:
+            queryset = queryset.filter(id__lt=before)
+        # Fetch one extra row to learn whether an older page exists
+        return queryset.order_by('-id')[:limit + 1], limit
+
+    @staticmethod
+    def _history_page(rows, limit):
+        return rows[:limit][::-1], len(rows) > limit
+
+    @classmethod
+    def history(cls, conversation_id, before=None, limit=None):
+        """Return ``(messages, has_more)`` for the newest ``limit`` messages
+        older than ``before`` (or the newest overall), oldest first."""
+        queryset, limit = cls._history(conversation_id, before, limit)
+        return cls._history_page(list(queryset), limit)
+
+    @classmethod
+    async def ahistory(cls, conversation_id, before=None, limit=None):
+        queryset, limit = cls._history(conversation_id, before, limit)
+        return cls._history_page([m async for m in queryset], limit)
+
+
+class ReadReceipt(models.Model):
+    """How far a user has read a conversation.
+
+    One row per (conversation, user) holding the id of the newest message the
+    user has seen; everything after it from other senders is unread.
+    """
+    conversation = models.ForeignKey(Conversation, on_delete=models.CASCADE, related_name='read_receipts')
+    user_id = models.BigIntegerField()
+    last_read_id = models.BigIntegerField(default=0)
+
+    class Meta:
+        db_table = 'chat_read_receipts'
+        unique_together = (('conversation', 'user_id'),)
+
+    def __str__(self):
+        return f"User {self.user_id} read {self.conversation_id} up to {self.last_read_id}"
+
+    @classmethod
+    def mark_read(cls, conversation_id, user_id, message_id):
+        """Advance the user's watermark to ``message_id``; it never moves back.
+
+        Returns True if the watermark changed.
+        """
+        receipts = cls.objects.filter(conversation_id=conversation_id, user_id=user_id)
+        if receipts.filter(last_read_id__lt=message_id).update(last_read_id=message_id):
+            return True
+        if receipts.exists():
+            return False
+        try:
+            with transaction.atomic(using='chat_db'):
+                cls.objects.create(conversation_id=conversation_id, user_id=user_id, last_read_id=message_id)
+            return True
+        except IntegrityError:
+            # Created concurrently by another request; advance that row instead
+            return bool(receipts.filter(last_read_id__lt=message_id).update(last_read_id=message_id))
+
+    @classmethod
+    async def amark_read(cls, conversation_id, user_id, message_id):
+        return await sync_to_async(cls.mark_read)(conversation_id, user_id, message_id)
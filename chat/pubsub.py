@@ -0,0 +1,99 @@
+"""
+In-process publish/subscribe for new chat messages.
+
+Views publish ``(conversation_id, message_id)`` after saving a message and the
+async long-poll endpoint (chat.async_views) waits on the broker instead of
+hitting the database on a timer. The broker class is pluggable through
+``settings.CHAT_BROKER`` (a dotted path); the default LocalBroker only sees
+messages published by the current process, so the long-poll view also checks
+the database every ``CHAT_LONG_POLL_RECHECK`` seconds for messages sent
+through other worker processes.
+"""
+
+import asyncio
+import threading
+from collections import OrderedDict
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+
+class LocalBroker:
+    """Broker that tracks the newest message id of recently active conversations.
+
+    Only the ``max_conversations`` most recently published conversations are
+    remembered; for the others ``last_id`` returns ``None`` and the views fall
+    back to the conversation's marker in the database.
+    """
+
+    max_conversations = 10_000
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._last_ids = OrderedDict()
+        # conversation id -> set of (event loop, future) for async waiters
+        self._async_waiters = {}
+
+    def publish(self, conversation_id, message_id):
+        """Record ``message_id`` as posted to a conversation and wake waiters."""
+        with self._lock:
+            if message_id <= self._last_ids.get(conversation_id, 0):
+                return
+            self._last_ids[conversation_id] = message_id
+            self._last_ids.move_to_end(conversation_id)
+            while len(self._last_ids) > self.max_conversations:
+                self._last_ids.popitem(last=False)
+            waiters = list(self._async_waiters.get(conversation_id, ()))
+        for loop, future in waiters:
+            loop.call_soon_threadsafe(_resolve, future)
+
+    def last_id(self, conversation_id):
+        """Newest message id seen for a conversation, or ``None`` if unknown."""
+        with self._lock:
+            return self._last_ids.get(conversation_id)
+
+    async def await_message(self, conversation_id, after_id, timeout):
+        """Wait until a message newer than ``after_id`` is published.
+
+        Returns ``True`` if one was, ``False`` if ``timeout`` seconds passed.
+        Waiting doesn't hold a thread.
+        """
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        waiter = (loop, future)
+        with self._lock:
+            if self._last_ids.get(conversation_id, 0) > after_id:
+                return True
+            self._async_waiters.setdefault(conversation_id, set()).add(waiter)
+        try:
+            await asyncio.wait_for(future, timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+        finally:
+            with self._lock:
+                waiters = self._async_waiters.get(conversation_id)
+                if waiters is not None:
+                    waiters.discard(waiter)
+                    if not waiters:
+                        del self._async_waiters[conversation_id]
+
+
+def _resolve(future):
+    if not future.done():
+        future.set_result(True)
+
+
+_broker = None
+_broker_lock = threading.Lock()
+
+
+def get_broker():
+    """Return the process-wide broker configured by ``settings.CHAT_BROKER``."""
+    global _broker
+    if _broker is None:
+        with _broker_lock:
+            if _broker is None:
+                broker_path = getattr(settings, 'CHAT_BROKER', 'chat.pubsub.LocalBroker')
+                _broker = import_string(broker_path)()
+    return _broker
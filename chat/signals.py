@@ -0,0 +1,21 @@
+from django.conf import settings
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .membership import invalidate
+from .models import ChatMember
+from .user_directory import directory
+
+
+@receiver(post_save, sender=ChatMember)
+@receiver(post_delete, sender=ChatMember)
+def chat_member_changed(sender, instance, **kwargs):
+    """Drop the cached member list when someone joins or leaves."""
+    invalidate(instance.conversation_id)
+
+
+@receiver(post_save, sender=settings.AUTH_USER_MODEL)
+@receiver(post_delete, sender=settings.AUTH_USER_MODEL)
+def user_changed(sender, instance, **kwargs):
+    """Forget the cached summary so renames and admin changes show up."""
+    directory.invalidate(instance.pk)
@@ -1,3 +1,482 @@
-﻿"""
-Chat tests removed for deployment. Keep original tests in development branch.
 """
+Tests for chat membership, the user directory, the inbox, read receipts,
+message history, starting pet conversations, the chat broker, message
+polling and the async send views.
+
+The rest of the original chat test suite was removed for deployment; it is
+kept in the development branch.
+"""
+import json
+import threading
+import time
+from io import StringIO
+from unittest import mock
+
+from asgiref.sync import sync_to_async
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connections
+from django.http import Http404
+from django.test import AsyncRequestFactory, SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from webapp.models import Pet
+
+from . import async_views, views
+from .membership import add_members, ais_member, invalidate, is_member, member_ids
+from .models import ChatMember, Conversation, Message, ReadReceipt
+from .pubsub import LocalBroker
+from .user_directory import UserDirectory, directory
+
+
+class MembershipTests(TestCase):
+    """Member sets are cached, invalidated on change and re-read for writes."""
+
+    databases = {'default', 'chat_db'}
+
+    def setUp(self):
+        cache.clear()
+        self.alice, self.bob = (User.objects.create_user(name, password='x') for name in ('alice', 'bob'))
+        self.convo = Conversation.objects.create(subject='Bruno')
+        add_members(self.convo.id, [self.alice.id, self.alice.id])
+
+    def remove_elsewhere(self, user):
+        # As another process would: no signal reaches this process's cache
+        ChatMember.objects.filter(conversation=self.convo, user_id=user.id)._raw_delete('chat_db')
+
+    def test_cached_until_invalidated(self):
+        self.assertEqual(member_ids(self.convo.id), {self.alice.id})
+        with self.assertNumQueries(0, using='chat_db'):
+            self.assertTrue(is_member(self.convo.id, self.alice.id))
+        self.remove_elsewhere(self.alice)
+        self.assertTrue(is_member(self.convo.id, self.alice.id))
+        invalidate(self.convo.id)
+        self.assertFalse(is_member(self.convo.id, self.alice.id))
+
+    def test_changes_invalidate(self):
+        self.assertEqual(member_ids(self.convo.id), {self.alice.id})
+        add_members(self.convo.id, [self.alice.id, self.bob.id])
+        self.assertEqual(member_ids(self.convo.id), {self.alice.id, self.bob.id})
+        ChatMember.objects.filter(conversation=self.convo, user_id=self.bob.id).delete()
+        self.assertEqual(member_ids(self.convo.id), {self.alice.id})
+
+    def test_add_members_inserts_only_new_ids(self):
+        # Cache the current members, then add one existing and one new member
+        self.assertEqual(member_ids(self.convo.id), {self.alice.id})
+        first = ChatMember.objects.get(conversation=self.convo, user_id=self.alice.id)
+        with CaptureQueriesContext(connections['chat_db']) as queries:
+            add_members(self.convo.id, [self.alice.id, self.bob.id, self.bob.id])
+        self.assertEqual([q['sql'].split()[0] for q in queries if 'SAVEPOINT' not in q['sql']], ['INSERT'])
+        self.assertEqual(ChatMember.objects.filter(conversation=self.convo).count(), 2)
+        self.assertEqual(ChatMember.objects.get(conversation=self.convo, user_id=self.alice.id).pk, first.pk)
+        # The cached set was dropped, so the next read sees the new member
+        self.assertEqual(member_ids(self.convo.id), {self.alice.id, self.bob.id})
+        add_members(self.convo.id, [self.alice.id, self.bob.id])
+        self.assertEqual(ChatMember.objects.filter(conversation=self.convo).count(), 2)
+
+    async def test_fresh_reads_the_database(self):
+        self.assertTrue(await ais_member(self.convo.id, self.alice.id))
+        await sync_to_async(self.remove_elsewhere)(self.alice)
+        self.assertFalse(await ais_member(self.convo.id, self.alice.id, fresh=True))
+        # ...and refreshes the cache for later reads
+        self.assertFalse(await ais_member(self.convo.id, self.alice.id))
+
+    def test_removed_member_cannot_send(self):
+        self.assertTrue(is_member(self.convo.id, self.alice.id))
+        self.remove_elsewhere(self.alice)
+        self.client.force_login(self.alice)
+        response = self.client.post(reverse('chat:send_message', args=[self.convo.id]), {'text': 'Hi'})
+        self.assertFalse(response.json()['success'])
+        response = self.client.post(reverse('chat:conversation', args=[self.convo.id]), {'text': 'Hi'})
+        self.assertEqual(response.status_code, 404)
+        self.assertFalse(Message.objects.exists())
+
+
+class UserDirectoryTests(TestCase):
+    """Usernames come from a small LRU; misses are fetched in one query."""
+
+    databases = {'default', 'chat_db'}
+
+    def setUp(self):
+        self.users = [User.objects.create_user(f'user{i}', password='x') for i in range(3)]
+        self.ids = [user.id for user in self.users]
+
+    def test_lru_evicts_least_recently_used(self):
+        users = UserDirectory(maxsize=2)
+        with self.assertNumQueries(2):
+            users.get_many([self.ids[0]])
+            users.get_many([self.ids[1]])
+        with self.assertNumQueries(0):
+            self.assertEqual(users.get_many([self.ids[0]])[self.ids[0]].username, 'user0')
+        # The third user pushes out the second, which was used longest ago
+        with self.assertNumQueries(1):
+            users.get_many([self.ids[2]])
+        with self.assertNumQueries(0):
+            users.get_many([self.ids[0], self.ids[2]])
+        with self.assertNumQueries(1):
+            users.get_many([self.ids[1]])
+
+    def test_misses_and_expiry(self):
+        users = UserDirectory(ttl=0)
+        with self.assertNumQueries(1):
+            found = users.get_many([*self.ids, 0])
+        self.assertEqual(set(found), set(self.ids))
+        with self.assertNumQueries(1):
+            users.get_many(self.ids)
+
+    def test_message_senders_looked_up_together(self):
+        convo = Conversation.objects.create(subject='Bruno')
+        for user in self.users * 2:
+            Message.objects.create(conversation=convo, sender_id=user.id, text=user.username,
+                                   created_at=timezone.now())
+        directory.clear()
+        with self.assertNumQueries(1):
+            data = views._messages_after(convo, 0)
+        self.assertEqual([m['sender'] for m in data], [m['text'] for m in data])
+        with self.assertNumQueries(0):
+            views._messages_after(convo, 0)
+
+
+class InboxTests(TestCase):
+    """The inbox lists a user's conversations by last message, with unread counts."""
+
+    databases = {'default', 'chat_db'}
+
+    def setUp(self):
+        cache.clear()
+        self.alice, self.bob = (User.objects.create_user(name, password='x') for name in ('alice', 'bob'))
+        self.older, self.newer, self.other = (Conversation.objects.create(subject=s) for s in ('A', 'B', 'C'))
+        add_members(self.older.id, [self.alice.id, self.bob.id])
+        add_members(self.newer.id, [self.alice.id, self.bob.id])
+        add_members(self.other.id, [self.bob.id])
+
+    def post(self, convo, sender, text):
+        msg = Message.objects.create(conversation=convo, sender_id=sender.id, text=text, created_at=timezone.now())
+        Conversation.record_message(msg)
+        return msg
+
+    def test_ordered_by_last_message_with_unread_counts(self):
+        self.post(self.newer, self.bob, 'First')
+        read = self.post(self.older, self.bob, 'Hi')
+        self.post(self.older, self.bob, 'Still there?')
+        self.post(self.older, self.alice, 'Yes')
+        self.post(self.other, self.bob, 'Elsewhere')
+        ReadReceipt.mark_read(self.older.id, self.alice.id, read.id)
+
+        inbox = [(c.subject, c.last_text, c.unread_count) for c in Conversation.inbox_for(self.alice.id)]
+        # Alice's own message counts for ordering but not as unread
+        self.assertEqual(inbox, [('A', 'Yes', 1), ('B', 'First', 1)])
+
+        self.post(self.newer, self.bob, 'Second')
+        self.client.force_login(self.alice)
+        response = self.client.get(reverse('chat:index'))
+        self.assertEqual([(c.subject, c.last_text, c.unread_count, c.last_sender.username)
+                          for c in response.context['conversations']],
+                         [('B', 'Second', 2, 'bob'), ('A', 'Yes', 1, 'alice')])
+
+
+class ReadReceiptTests(TestCase):
+    """The read watermark only moves forward, and bad ``up_to`` values are refused."""
+
+    databases = {'default', 'chat_db'}
+
+    def setUp(self):
+        cache.clear()
+        self.reader, self.writer = (User.objects.create_user(name, password='x') for name in ('reader', 'writer'))
+        self.convo = Conversation.objects.create(subject='Bruno')
+        add_members(self.convo.id, [self.reader.id, self.writer.id])
+        self.ids = []
+        for i in range(5):
+            msg = Message.objects.create(conversation=self.convo, sender_id=self.writer.id, text=str(i),
+                                         created_at=timezone.now())
+            Conversation.record_message(msg)
+            self.ids.append(msg.id)
+        self.url = reverse('chat:mark_read', args=[self.convo.id])
+        self.client.force_login(self.reader)
+
+    def watermark(self):
+        return ReadReceipt.objects.get(conversation=self.convo, user_id=self.reader.id).last_read_id
+
+    def unread(self):
+        return Conversation.inbox_for(self.reader.id).get().unread_count
+
+    def test_mark_read_up_to_a_message(self):
+        self.assertEqual(self.unread(), 5)
+        self.assertEqual(self.client.post(self.url, {'up_to': self.ids[2]}).json()['last_read_id'], self.ids[2])
+        self.assertEqual(self.watermark(), self.ids[2])
+        self.assertEqual(self.unread(), 2)
+        # Never backwards, and never past the newest message
+        self.client.post(self.url, {'up_to': self.ids[0]})
+        self.assertEqual(self.watermark(), self.ids[2])
+        self.assertFalse(ReadReceipt.mark_read(self.convo.id, self.reader.id, self.ids[1]))
+        self.client.post(self.url, {'up_to': self.ids[-1] + 100})
+        self.assertEqual(self.watermark(), self.ids[-1])
+        self.assertEqual(self.unread(), 0)
+
+    def test_bad_up_to_is_refused(self):
+        self.client.post(self.url, {'up_to': self.ids[1]})
+        for up_to in ('abc', '-1'):
+            response = self.client.post(self.url, {'up_to': up_to})
+            self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.watermark(), self.ids[1])
+        # Without up_to the whole conversation is read
+        self.client.post(self.url)
+        self.assertEqual(self.watermark(), self.ids[-1])
+
+
+@override_settings(CHAT_HISTORY_PAGE_SIZE=4)
+class MessageHistoryTests(TestCase):
+    """Older messages page back by id without gaps, and only for members."""
+
+    databases = {'default', 'chat_db'}
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user('reader', password='x')
+        self.convo = Conversation.objects.create(subject='Bruno')
+        add_members(self.convo.id, [self.user.id])
+        self.ids = [Message.objects.create(conversation=self.convo, sender_id=self.user.id, text=str(i),
+                                           created_at=timezone.now()).id for i in range(10)]
+        self.url = reverse('chat:message_history', args=[self.convo.id])
+
+    def test_pages_back_without_gaps(self):
+        self.client.force_login(self.user)
+        seen, pages, params = [], 0, {}
+        while True:
+            data = self.client.get(self.url, params).json()
+            page = [m['id'] for m in data['messages']]
+            self.assertEqual(page, sorted(page))
+            seen = page + seen
+            pages += 1
+            if not data['has_more']:
+                break
+            params = {'before': page[0]}
+        self.assertEqual(pages, 3)
+        self.assertEqual(seen, self.ids)
+
+    def test_non_member_gets_nothing(self):
+        self.client.force_login(User.objects.create_user('stranger', password='x'))
+        self.assertEqual(self.client.get(self.url).json(), {'messages': [], 'has_more': False})
+
+
+class StartPetConversationTests(TestCase):
+    """Asking about a pet again returns its conversation, also after leaving it."""
+
+    databases = {'default', 'chat_db'}
+
+    def setUp(self):
+        cache.clear()
+        self.owner = User.objects.create_user('owner', password='x')
+        self.requester = User.objects.create_user('requester', password='x')
+        self.admin = User.objects.create_user('admin', password='x', is_staff=True)
+        self.pet = Pet.objects.create(name='Bruno', species='dog', location='Pune', owner=self.owner)
+        self.client.force_login(self.requester)
+
+    def start(self):
+        response = self.client.get(reverse('chat:start_conversation', args=[self.pet.id]), follow=True)
+        self.assertEqual(response.status_code, 200)
+        return response.context['conversation']
+
+    def test_start_leave_start(self):
+        convo = self.start()
+        self.assertEqual(member_ids(convo.id), {self.owner.id, self.requester.id, self.admin.id})
+        self.client.post(reverse('chat:leave_conversation', args=[convo.id]))
+        self.assertFalse(is_member(convo.id, self.requester.id))
+        self.assertEqual(self.start().id, convo.id)
+        self.assertTrue(is_member(convo.id, self.requester.id))
+        self.assertEqual(Conversation.objects.count(), 1)
+
+    def test_key_legacy_conversations(self):
+        legacy = Conversation.objects.create(subject=f'About Bruno (pet:{self.pet.id})')
+        add_members(legacy.id, [self.owner.id, self.requester.id, self.admin.id])
+        # Members that can't be told apart are left alone
+        unclear = Conversation.objects.create(subject=f'About Bruno (pet:{self.pet.id})')
+        add_members(unclear.id, [self.owner.id, self.requester.id, self.admin.id + 100, self.admin.id + 101])
+        out = StringIO()
+        call_command('key_pet_conversations', stdout=out)
+        self.assertIn('Keyed 1 pet conversation(s)', out.getvalue())
+        self.assertIn(f'IDs: {unclear.id}', out.getvalue())
+        self.assertEqual(self.start().id, legacy.id)
+
+
+class LocalBrokerTests(SimpleTestCase):
+    """Waiters wake on a newer message or time out; only recent conversations are kept."""
+
+    async def test_publish_wakes_waiter(self):
+        broker = LocalBroker()
+        threading.Timer(0.05, broker.publish, (1, 5)).start()
+        started = time.monotonic()
+        self.assertTrue(await broker.await_message(1, 0, 5))
+        self.assertLess(time.monotonic() - started, 1)
+        self.assertEqual(broker._async_waiters, {})
+
+    async def test_timeout(self):
+        broker = LocalBroker()
+        broker.publish(1, 3)
+        # Only ids past after_id count, and other conversations don't wake it
+        threading.Timer(0.02, broker.publish, (2, 9)).start()
+        self.assertFalse(await broker.await_message(1, 3, 0.1))
+        self.assertTrue(await broker.await_message(1, 2, 0.1))
+        self.assertEqual(broker._async_waiters, {})
+
+    def test_remembers_recent_conversations_only(self):
+        broker = LocalBroker()
+        broker.max_conversations = 2
+        for convo_id in (1, 2, 3):
+            broker.publish(convo_id, 10)
+        broker.publish(2, 11)
+        broker.publish(4, 10)
+        self.assertEqual([broker.last_id(convo_id) for convo_id in (1, 2, 3, 4)], [None, 11, None, 10])
+
+
+class MessagePollingTests(TestCase):
+    """The WSGI endpoint answers at once; the async long-poll wakes or times out."""
+
+    databases = {'default', 'chat_db'}
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user('poller', password='x')
+        self.convo = Conversation.objects.create(subject='Bruno')
+        add_members(self.convo.id, [self.user.id])
+        self.first = self.post('Hello')
+
+    def post(self, text):
+        msg = Message.objects.create(conversation=self.convo, sender_id=self.user.id, text=text,
+                                     created_at=timezone.now())
+        Conversation.record_message(msg)
+        return msg
+
+    @override_settings(CHAT_LONG_POLL_TIMEOUT=60)
+    def test_wsgi_wait_does_not_hold_the_request(self):
+        self.client.force_login(self.user)
+        url = reverse('chat:wait_messages', args=[self.convo.id])
+        started = time.monotonic()
+        self.assertEqual(self.client.get(url, {'after': self.first.id}).json(), {'messages': []})
+        self.assertLess(time.monotonic() - started, 5)
+        self.assertEqual([m['text'] for m in self.client.get(url, {'after': 0}).json()['messages']], ['Hello'])
+
+    def test_unparsable_after_reads_as_zero(self):
+        self.client.force_login(self.user)
+        for name in ('chat:fetch_messages', 'chat:wait_messages'):
+            response = self.client.get(reverse(name, args=[self.convo.id]), {'after': 'x'})
+            self.assertEqual([m['text'] for m in response.json()['messages']], ['Hello'])
+
+    def test_unchanged_marker_answers_304(self):
+        self.client.force_login(self.user)
+        url = reverse('chat:fetch_messages', args=[self.convo.id])
+        etag = self.client.get(url, {'after': self.first.id})['ETag']
+        with CaptureQueriesContext(connections['chat_db']) as queries, \
+                mock.patch.object(directory, 'get_many', side_effect=AssertionError('looked up senders')):
+            response = self.client.get(url, {'after': self.first.id}, headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 304)
+        # Only the conversation's marker is read; the message table isn't touched
+        self.assertEqual(len(queries), 1)
+        self.assertNotIn('chat_message', queries[0]['sql'])
+
+    def test_etag_changes_with_the_marker(self):
+        self.client.force_login(self.user)
+        url = reverse('chat:fetch_messages', args=[self.convo.id])
+        etag = self.client.get(url, {'after': self.first.id})['ETag']
+        self.post('Again')
+        response = self.client.get(url, {'after': self.first.id}, headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual([m['text'] for m in response.json()['messages']], ['Again'])
+
+    async def call_async(self, view, after):
+        request = AsyncRequestFactory().get('/', {'after': after})
+
+        async def auser():
+            return self.user
+        request.user, request.auser = self.user, auser
+        response = await view(request, self.convo.id)
+        return [m['text'] for m in json.loads(response.content)['messages']]
+
+    async def test_async_fetch_with_unparsable_after(self):
+        self.assertEqual(await self.call_async(async_views.fetch_messages, 'x'), ['Hello'])
+
+    async def long_poll(self, broker, after):
+        with mock.patch.object(async_views, 'get_broker', return_value=broker):
+            return await self.call_async(async_views.wait_messages, after)
+
+    @override_settings(CHAT_LONG_POLL_TIMEOUT=0.2, CHAT_LONG_POLL_RECHECK=0.05)
+    async def test_long_poll_times_out(self):
+        started = time.monotonic()
+        self.assertEqual(await self.long_poll(LocalBroker(), self.first.id), [])
+        self.assertGreaterEqual(time.monotonic() - started, 0.2)
+
+    @override_settings(CHAT_LONG_POLL_TIMEOUT=5, CHAT_LONG_POLL_RECHECK=5)
+    async def test_long_poll_wakes_on_publish(self):
+        broker = LocalBroker()
+        broker.publish(self.convo.id, self.first.id)
+        # Stored but not yet published when the request starts waiting
+        second = await Message.objects.acreate(conversation=self.convo, sender_id=self.user.id, text='Again',
+                                               created_at=timezone.now())
+        threading.Timer(0.05, broker.publish, (self.convo.id, second.id)).start()
+        started = time.monotonic()
+        self.assertEqual(await self.long_poll(broker, self.first.id), ['Again'])
+        self.assertLess(time.monotonic() - started, 2)
+
+    @override_settings(CHAT_LONG_POLL_TIMEOUT=5, CHAT_LONG_POLL_RECHECK=0.05)
+    async def test_long_poll_sees_other_processes(self):
+        broker = LocalBroker()
+        broker.publish(self.convo.id, self.first.id)
+        # Sent through another process: the marker moves, this broker never hears of it
+        second = await Message.objects.acreate(conversation=self.convo, sender_id=self.user.id, text='Elsewhere',
+                                               created_at=timezone.now())
+        await Conversation.arecord_message(second)
+        started = time.monotonic()
+        self.assertEqual(await self.long_poll(broker, self.first.id), ['Elsewhere'])
+        self.assertLess(time.monotonic() - started, 2)
+
+
+class AsyncSendTests(TestCase):
+    """The async send paths re-check membership and publish what they store."""
+
+    databases = {'default', 'chat_db'}
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user('sender', password='x')
+        self.other = User.objects.create_user('reader', password='x')
+        self.convo = Conversation.objects.create(subject='Bruno')
+        add_members(self.convo.id, [self.user.id, self.other.id])
+        self.broker = LocalBroker()
+
+    async def post(self, view, text):
+        request = AsyncRequestFactory().post('/', {'text': text})
+
+        async def auser():
+            return self.user
+        request.user, request.auser = self.user, auser
+        with mock.patch.object(async_views, 'get_broker', return_value=self.broker):
+            return await view(request, self.convo.id)
+
+    async def test_member_sends(self):
+        response = await self.post(async_views.send_message_ajax, 'Hello')
+        data = json.loads(response.content)
+        self.assertTrue(data['success'])
+        self.assertEqual(self.broker.last_id(self.convo.id), data['id'])
+        response = await self.post(async_views.conversation_view, 'Again')
+        self.assertEqual(response.status_code, 302)
+        texts = [m.text async for m in Message.objects.filter(conversation=self.convo).order_by('id')]
+        self.assertEqual(texts, ['Hello', 'Again'])
+        convo = await Conversation.objects.aget(id=self.convo.id)
+        self.assertEqual(self.broker.last_id(self.convo.id), convo.last_message_id)
+
+    async def test_removed_member_refused(self):
+        self.assertTrue(await ais_member(self.convo.id, self.user.id))
+        # Removed through another process: this process's member cache still has them
+        await sync_to_async(ChatMember.objects.filter(conversation=self.convo, user_id=self.user.id)._raw_delete)(
+            'chat_db')
+        self.assertTrue(await ais_member(self.convo.id, self.user.id))
+
+        response = await self.post(async_views.send_message_ajax, 'Hello')
+        self.assertFalse(json.loads(response.content)['success'])
+        with self.assertRaises(Http404):
+            await self.post(async_views.conversation_view, 'Hello')
+        self.assertFalse(await Message.objects.aexists())
+        self.assertIsNone(self.broker.last_id(self.convo.id))
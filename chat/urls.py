@@ -1,6 +1,13 @@
+from django.conf import settings
 from django.urls import path
 from . import views
 
+# Under ASGI the chat hot path is served by async views (see home/asgi.py)
+if getattr(settings, 'CHAT_ASYNC_VIEWS', False):
+    from . import async_views as hot_views
+else:
+    hot_views = views
+
 app_name = 'chat'
 
 urlpatterns = [
@@ -8,9 +15,12 @@ urlpatterns = [
     path('select_admins/', views.start_with_admins, name='select_admins'),
     path('start_admins/', views.start_with_admins, name='start_with_admins'),
     path('', views.chat_index, name='index'),
-    path('conversation/<int:convo_id>/', views.conversation_view, name='conversation'),
-    path('conversation/<int:convo_id>/send/', views.send_message_ajax, name='send_message'),
-    path('conversation/<int:convo_id>/fetch/', views.fetch_messages, name='fetch_messages'),
+    path('conversation/<int:convo_id>/', hot_views.conversation_view, name='conversation'),
+    path('conversation/<int:convo_id>/send/', hot_views.send_message_ajax, name='send_message'),
+    path('conversation/<int:convo_id>/fetch/', hot_views.fetch_messages, name='fetch_messages'),
+    path('conversation/<int:convo_id>/wait/', hot_views.wait_messages, name='wait_messages'),
+    path('conversation/<int:convo_id>/read/', hot_views.mark_read, name='mark_read'),
+    path('conversation/<int:convo_id>/history/', views.message_history, name='message_history'),
     path('conversation/<int:convo_id>/leave/', views.leave_conversation, name='leave_conversation'),
     path('conversation/<int:convo_id>/delete/', views.delete_conversation, name='delete_conversation'),
     path('conversation/<int:convo_id>/message/<int:msg_id>/delete/', views.delete_message, name='delete_message'),
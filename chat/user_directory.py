@@ -0,0 +1,111 @@
+"""
+Process-wide cache of user summaries for the chat app.
+
+Chat rows live in ``chat_db`` and only store integer user ids, so every view
+that shows senders or participants has to map ids to usernames from the main
+database. The directory keeps a small LRU of ``UserSummary`` objects and
+fetches all misses for a request in a single query.
+
+Entries are dropped when a User is saved or deleted in this process (see
+chat.signals) and expire after ``CHAT_USER_DIRECTORY_TTL`` seconds so renames
+made through other worker processes show up eventually.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+
+_FIELDS = ('id', 'username', 'is_staff', 'is_superuser')
+
+
+class UserSummary:
+    """The few user attributes chat templates and JSON responses need."""
+
+    __slots__ = ('id', 'username', 'is_admin')
+
+    def __init__(self, id, username, is_admin):
+        self.id = id
+        self.username = username
+        self.is_admin = is_admin
+
+    @property
+    def pk(self):
+        return self.id
+
+    @classmethod
+    def from_row(cls, row):
+        return cls(row['id'], row['username'], row['is_staff'] or row['is_superuser'])
+
+    def __str__(self):
+        return self.username
+
+    def __repr__(self):
+        return f'<UserSummary {self.id}: {self.username}>'
+
+
+class UserDirectory:
+    """Thread-safe LRU of :class:`UserSummary` keyed by user id."""
+
+    def __init__(self, maxsize=1024, ttl=300):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _cached(self, user_ids):
+        now = time.monotonic()
+        found, missing = {}, []
+        with self._lock:
+            for user_id in user_ids:
+                entry = self._entries.get(user_id)
+                if entry is not None and entry[1] > now:
+                    self._entries.move_to_end(user_id)
+                    found[user_id] = entry[0]
+                else:
+                    missing.append(user_id)
+        return found, missing
+
+    def _store(self, summaries):
+        expires = time.monotonic() + self.ttl
+        with self._lock:
+            for summary in summaries:
+                self._entries[summary.id] = (summary, expires)
+                self._entries.move_to_end(summary.id)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def get_many(self, user_ids):
+        """Return ``{id: UserSummary}`` for the ids that exist (one query for misses)."""
+        found, missing = self._cached(set(user_ids))
+        if missing:
+            rows = get_user_model().objects.filter(id__in=missing).values(*_FIELDS)
+            fetched = [UserSummary.from_row(row) for row in rows]
+            self._store(fetched)
+            found.update((s.id, s) for s in fetched)
+        return found
+
+    async def aget_many(self, user_ids):
+        found, missing = self._cached(set(user_ids))
+        if missing:
+            rows = get_user_model().objects.filter(id__in=missing).values(*_FIELDS)
+            fetched = [UserSummary.from_row(row) async for row in rows]
+            self._store(fetched)
+            found.update((s.id, s) for s in fetched)
+        return found
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self._entries.pop(user_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+directory = UserDirectory(
+    maxsize=getattr(settings, 'CHAT_USER_DIRECTORY_SIZE', 1024),
+    ttl=getattr(settings, 'CHAT_USER_DIRECTORY_TTL', 300),
+)
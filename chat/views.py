@@ -1,12 +1,20 @@
 from django.shortcuts import render, get_object_or_404, redirect
 from django.contrib.auth.decorators import login_required, user_passes_test
-from django.http import JsonResponse, HttpResponse
-from .models import Conversation, Message, ChatParticipant, ChatMember
-from webapp.models import Notification
+from django.http import Http404, JsonResponse, HttpResponse
+from .models import Conversation, Message, ChatParticipant, ChatMember, ReadReceipt
+from webapp.notifications import notify_many
+from webapp.admin_directory import admin_directory
 from webapp.models import Pet
 from django.shortcuts import HttpResponse
 from django.contrib.auth.models import User
 from django.views.decorators.http import require_POST
+from django.conf import settings
+from django.core.paginator import Paginator
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date, quote_etag
+from .pubsub import get_broker
+from .membership import add_members, invalidate as invalidate_members, is_member, member_ids
+from .user_directory import directory
 
 
 @login_required
@@ -16,6 +24,7 @@ def leave_conversation(request, convo_id):
     chat_db = 'chat_db'
     # remove membership for current user
     ChatMember.objects.using(chat_db).filter(conversation_id=convo.id, user_id=request.user.id).delete()
+    invalidate_members(convo.id)
     # if no members remain, delete conversation and messages
     remaining = ChatMember.objects.using(chat_db).filter(conversation_id=convo.id).exists()
     if not remaining:
@@ -56,45 +65,48 @@ def delete_conversation(request, convo_id):
                 cursor.execute(f'DELETE FROM {conv_table} WHERE id = %s', [convo.id])
             except OperationalError:
                 pass
+    # Raw deletes bypass the ChatMember signals
+    invalidate_members(convo.id)
     return redirect('chat:index')
 
 
 @login_required
 def chat_index(request):
-    # List conversations for the user using the through table to avoid cross-db joins
-    # Use ChatParticipant (integer user ids) instead of M2M through table
-    convo_ids = list(ChatMember.objects.filter(user_id=request.user.id).values_list('conversation_id', flat=True))
-    convos = list(Conversation.objects.filter(id__in=convo_ids))
-    # collect participant ids for all conversations and load users from main DB
+    # One page of the user's conversations, newest activity first, with the last
+    # message and unread count annotated in the same query (see Conversation.inbox_for)
+    paginator = Paginator(Conversation.inbox_for(request.user.id), getattr(settings, 'CHAT_INDEX_PAGE_SIZE', 20))
+    page = paginator.get_page(request.GET.get('page'))
+    convos = list(page.object_list)
+    # collect participant ids for the page's conversations and load users from main DB
     convo_map = {c.id: c for c in convos}
     if convos:
-        all_convo_ids = [c.id for c in convos]
-        rows = ChatMember.objects.filter(conversation_id__in=all_convo_ids).values('conversation_id', 'user_id')
+        rows = ChatMember.objects.filter(conversation_id__in=list(convo_map)).values('conversation_id', 'user_id')
         convo_participants = {}
-        user_ids = set()
+        user_ids = {c.last_sender_id for c in convos if c.last_sender_id}
         for r in rows:
             convo_participants.setdefault(r['conversation_id'], []).append(r['user_id'])
             user_ids.add(r['user_id'])
-        from django.contrib.auth import get_user_model
-        UserModel = get_user_model()
-        users = UserModel.objects.filter(id__in=list(user_ids))
-        users_map = {u.id: u for u in users}
+        users_map = directory.get_many(user_ids)
         for cid, uids in convo_participants.items():
             # attach a safe participants list on the conversation object for templates
             setattr(convo_map[cid], 'participants_safe', [users_map.get(uid) for uid in uids if users_map.get(uid) is not None])
-    return render(request, 'chat/index.html', {'conversations': convos})
+        for c in convos:
+            setattr(c, 'last_sender', users_map.get(c.last_sender_id))
+    return render(request, 'chat/index.html', {'conversations': convos, 'page_obj': page})
 
 
 @login_required
 def conversation_view(request, convo_id):
     # Load conversation and ensure the current user is a participant (use through table to avoid cross-db joins)
     convo = get_object_or_404(Conversation, id=convo_id)
-    if not ChatMember.objects.filter(conversation_id=convo.id, user_id=request.user.id).exists():
-        from django.http import Http404
+    if not is_member(convo.id, request.user.id):
         raise Http404()
     if request.method == 'POST':
         text = request.POST.get('text', '').strip()
         if text:
+            # The check above may have used a cached member list
+            if not is_member(convo.id, request.user.id, fresh=True):
+                raise Http404()
             # Create message via the ORM on the chat DB (no FK to auth.User) to avoid
             # raw SQL, PRAGMA toggles and sqlite debugging-formatting issues.
             from django.utils import timezone
@@ -103,45 +115,56 @@ def conversation_view(request, convo_id):
                 conversation_id=convo.id,
                 sender_id=request.user.id,
                 text=text,
-                created_at=timezone.now(),
-                read=False
+                created_at=timezone.now()
             )
-            # Notify other participants - fetch participant ids from the ChatMember table to avoid cross-db joins
-            participant_ids = list(ChatMember.objects.filter(conversation_id=convo.id).values_list('user_id', flat=True))
+            Conversation.record_message(msg)
+            get_broker().publish(convo.id, msg.id)
+            # Notify other participants - use the cached member ids to avoid cross-db joins
+            participant_ids = member_ids(convo.id)
             # Exclude sender
             participant_ids = [pid for pid in participant_ids if pid != request.user.id]
-            from django.contrib.auth import get_user_model
-            UserModel = get_user_model()
-            recipients = UserModel.objects.filter(id__in=participant_ids)
-            for participant in recipients:
-                Notification.objects.create(
-                    user=participant,
-                    actor=request.user,
-                    verb='New message',
-                    message=f'New message from {request.user.username}: {text[:200]}',
-                    url=f'/chat/conversation/{convo.id}/'
-                )
+            recipients = directory.get_many(participant_ids).keys()
+            notify_many(
+                recipients,
+                verb='New message',
+                message=f'New message from {request.user.username}: {text[:200]}',
+                url=f'/chat/conversation/{convo.id}/',
+                actor=request.user,
+            )
             return redirect('chat:conversation', convo_id=convo.id)
     # Load messages without select_related to avoid cross-db joins; then load senders from auth DB
     # use related_name 'chat_messages' for Message relation
-    msgs = list(convo.chat_messages.all())
-    sender_ids = {m.sender_id for m in msgs}
-    from django.contrib.auth import get_user_model
-    UserModel = get_user_model()
-    senders = UserModel.objects.filter(id__in=list(sender_ids)) if sender_ids else []
-    senders_map = {s.id: s for s in senders}
+    msgs, has_more = Message.history(convo.id)
+    if convo.last_message_id:
+        # Opening the conversation shows the newest messages, so they are read
+        ReadReceipt.mark_read(convo.id, request.user.id, convo.last_message_id)
+    rows = sorted(member_ids(convo.id))
+    # senders and participants hydrated together from the user directory
+    users_map = directory.get_many({m.sender_id for m in msgs} | set(rows))
     for m in msgs:
-        setattr(m, 'sender_user', senders_map.get(m.sender_id))
+        setattr(m, 'sender_user', users_map.get(m.sender_id))
 
-    # attach conversation participants safely
-    rows = ChatMember.objects.filter(conversation_id=convo.id).values_list('user_id', flat=True)
-    if rows:
-        users = UserModel.objects.filter(id__in=list(rows))
-        users_map = {u.id: u for u in users}
     # attach participants attribute so templates don't try to access M2M across DBs
     setattr(convo, 'participants_safe', [users_map.get(uid) for uid in rows if users_map.get(uid) is not None])
+    setattr(convo, 'participant_ids', rows)
 
-    return render(request, 'chat/conversation.html', {'conversation': convo, 'messages': msgs})
+    return render(request, 'chat/conversation.html', {'conversation': convo, 'messages': msgs, 'has_more': has_more,
+                                                      'long_poll': False})
+
+
+@login_required
+def message_history(request, convo_id):
+    """Older messages for infinite scroll: the page before ``?before=<id>``."""
+    convo = get_object_or_404(Conversation, id=convo_id)
+    if not is_member(convo.id, request.user.id):
+        return JsonResponse({'messages': [], 'has_more': False})
+    try:
+        before = int(request.GET['before'])
+    except (KeyError, ValueError):
+        before = None
+    msgs, has_more = Message.history(convo.id, before=before)
+    data = _serialize_messages(msgs, directory.get_many({m.sender_id for m in msgs}))
+    return JsonResponse({'messages': data, 'has_more': has_more})
 
 
 @login_required
@@ -149,7 +172,7 @@ def conversation_view(request, convo_id):
 def send_message_ajax(request, convo_id):
     # Ensure user is participant without cross-db joins
     convo = get_object_or_404(Conversation, id=convo_id)
-    if not ChatMember.objects.filter(conversation_id=convo.id, user_id=request.user.id).exists():
+    if not is_member(convo.id, request.user.id, fresh=True):
         return JsonResponse({'success': False, 'error': 'Not a participant'})
     text = request.POST.get('text', '').strip()
     if not text:
@@ -161,23 +184,20 @@ def send_message_ajax(request, convo_id):
         conversation_id=convo.id,
         sender_id=request.user.id,
         text=text,
-        created_at=timezone.now(),
-        read=False
+        created_at=timezone.now()
     )
+    Conversation.record_message(msg)
+    get_broker().publish(convo.id, msg.id)
     # Notify other participants - avoid cross-db joins
-    participant_ids = list(ChatMember.objects.filter(conversation_id=convo.id).values_list('user_id', flat=True))
-    participant_ids = [pid for pid in participant_ids if pid != request.user.id]
-    from django.contrib.auth import get_user_model
-    UserModel = get_user_model()
-    recipients = UserModel.objects.filter(id__in=participant_ids)
-    for participant in recipients:
-        Notification.objects.create(
-            user=participant,
-            actor=request.user,
-            verb='New message',
-            message=f'New message from {request.user.username}: {msg.text[:200]}',
-            url=f'/chat/conversation/{convo.id}/'
-        )
+    participant_ids = [pid for pid in member_ids(convo.id) if pid != request.user.id]
+    recipients = directory.get_many(participant_ids).keys()
+    notify_many(
+        recipients,
+        verb='New message',
+        message=f'New message from {request.user.username}: {msg.text[:200]}',
+        url=f'/chat/conversation/{convo.id}/',
+        actor=request.user,
+    )
     # sender is the current user (sender_id stored on Message)
     return JsonResponse({'success': True, 'id': msg.id, 'text': msg.text, 'sender': request.user.username, 'created_at': msg.created_at.isoformat()})
 
@@ -196,64 +216,34 @@ def start_conversation(request, pet_id):
         return redirect('chat:index')
 
     # collect admin ids (staff or superuser), exclude current user if admin
-    from django.contrib.auth import get_user_model
-    UserModel = get_user_model()
-    admin_qs = UserModel.objects.filter(is_staff=True) | UserModel.objects.filter(is_superuser=True)
-    admin_ids = list(admin_qs.values_list('id', flat=True))
-    admin_ids = [aid for aid in admin_ids if aid != request.user.id]
+    admin_ids = [aid for aid in admin_directory.staff_ids() if aid != request.user.id]
 
-    # We want conversations to be scoped to the specific pet so that starting a chat
+    # Conversations are scoped to the specific pet so that starting a chat
     # about a different pet (even with the same participants) creates a NEW
-    # conversation. To support that we only reuse an existing conversation if its
-    # subject includes the pet id tag `(pet:<id>)`.
-    from django.db.models import Count
-    convo_ids = (ChatMember.objects
-                .filter(user_id__in=[owner.id, request.user.id])
-                .values('conversation_id')
-                .annotate(cnt=Count('user_id'))
-                .filter(cnt=2)
-                .values_list('conversation_id', flat=True))
-    # Look for a conversation among these ids that is explicitly about this pet
+    # conversation: the pet is part of the participant key. Admins are added
+    # as members but are not part of the key, since the admin team changes.
+    # Chats from before the key existed are keyed by key_pet_conversations.
     pet_tag = f'(pet:{pet.id})'
-    convo = Conversation.objects.filter(id__in=list(convo_ids), subject__contains=pet_tag).first()
-    chat_db = 'chat_db'
-    if convo:
-        # ensure admins are members of existing conversation
-        for aid in admin_ids:
-            ChatMember.objects.using(chat_db).get_or_create(conversation_id=convo.id, user_id=aid)
+    participants = [owner.id, request.user.id]
+    convo, created = Conversation.find_or_create_for(
+        participants, tag=f'pet:{pet.id}', subject=f'About {pet.name} {pet_tag}')
+    if not created:
+        # Rejoin a conversation the requester (or owner) left, and make sure
+        # today's admins are members
+        add_members(convo.id, participants + admin_ids)
         return redirect('chat:conversation', convo_id=convo.id)
 
-    # create new conversation and add owner, requester and admins
-    # create a conversation explicitly tagged with the pet id so it won't be
-    # reused for other pets with the same participants
-    convo = Conversation.objects.using(chat_db).create(subject=f'About {pet.name} {pet_tag}')
-    # create chat members via get_or_create to avoid UNIQUE constraint failures
-    ChatMember.objects.using(chat_db).get_or_create(conversation_id=convo.id, user_id=owner.id)
-    ChatMember.objects.using(chat_db).get_or_create(conversation_id=convo.id, user_id=request.user.id)
-    for aid in admin_ids:
-        ChatMember.objects.using(chat_db).get_or_create(conversation_id=convo.id, user_id=aid)
-
-    # Notify owner
-    Notification.objects.create(
-        user=owner,
-        actor=request.user,
+    # add owner, requester and admins to the new conversation in one insert
+    add_members(convo.id, participants + admin_ids)
+
+    # Notify owner and admins (admin ids come straight from the user table)
+    notify_many(
+        [owner.id] + admin_ids,
         verb='Conversation started',
         message=f'{request.user.username} started a conversation about {pet.name}.',
-        url=f'/chat/conversation/{convo.id}/'
+        url=f'/chat/conversation/{convo.id}/',
+        actor=request.user,
     )
-    # Notify admins
-    for aid in admin_ids:
-        try:
-            admin_user = UserModel.objects.get(id=aid)
-            Notification.objects.create(
-                user=admin_user,
-                actor=request.user,
-                verb='Conversation started',
-                message=f"{request.user.username} started a conversation about {pet.name}.",
-                url=f'/chat/conversation/{convo.id}/'
-            )
-        except UserModel.DoesNotExist:
-            continue
 
     return redirect('chat:conversation', convo_id=convo.id)
 
@@ -264,15 +254,12 @@ def start_with_admins(request):
     the selected admin user(s). If called with GET, render a selection
     page where the user can choose which admins to contact.
     """
-    from django.contrib.auth import get_user_model
-    UserModel = get_user_model()
-    from django.db.models import Q, Count
-
-    # admins list
-    admins = UserModel.objects.filter(Q(is_staff=True) | Q(is_superuser=True)).exclude(id=request.user.id)
+    staff_ids = admin_directory.staff_ids()
 
     if request.method == 'GET':
         # Render selection page (if there are multiple admins, user can choose)
+        from django.contrib.auth import get_user_model
+        admins = get_user_model().objects.filter(id__in=staff_ids - {request.user.id}).order_by('id')
         return render(request, 'chat/select_admins.html', {'admins': admins})
 
     # POST: create/find conversation with chosen admin ids
@@ -284,55 +271,128 @@ def start_with_admins(request):
         admin_ids = [int(a) for a in admin_ids]
     except ValueError:
         return HttpResponse('Invalid admin ids', status=400)
+    # only admins can be added this way (checked against the database, not the cache)
+    staff_ids = admin_directory.staff_ids(fresh=True)
+    admin_ids = [aid for aid in admin_ids if aid in staff_ids]
+    if not admin_ids:
+        return HttpResponse('No admin selected', status=400)
 
     participant_ids = sorted(set(admin_ids + [request.user.id]))
 
-    # Look for existing conversation that contains exactly these participants.
-    # We find conversations where the count of ChatMember rows for these ids equals len(participant_ids)
-    convo_ids = (ChatMember.objects
-                .filter(user_id__in=participant_ids)
-                .values('conversation_id')
-                .annotate(cnt=Count('user_id'))
-                .filter(cnt=len(participant_ids))
-                .values_list('conversation_id', flat=True))
-    convo = Conversation.objects.filter(id__in=list(convo_ids)).first()
+    # Find or create the conversation for exactly these participants
+    convo, created = Conversation.find_or_create_for(participant_ids, subject='Support / Admins')
 
-    chat_db = 'chat_db'
-    if not convo:
-        convo = Conversation.objects.using(chat_db).create(subject='Support / Admins')
-
-    # Ensure ChatMember rows exist; use get_or_create to avoid UNIQUE constraint errors
-    for uid in participant_ids:
-        ChatMember.objects.using(chat_db).get_or_create(conversation_id=convo.id, user_id=uid)
+    # Ensure ChatMember rows exist (existing memberships are skipped)
+    add_members(convo.id, participant_ids)
 
     # Notify selected admins only
-    recipients = UserModel.objects.filter(id__in=admin_ids)
-    for participant in recipients:
-        Notification.objects.create(
-            user=participant,
-            actor=request.user,
-            verb='Conversation started',
-            message=f'{request.user.username} started a conversation with you.',
-            url=f'/chat/conversation/{convo.id}/'
-        )
+    notify_many(
+        admin_ids,
+        verb='Conversation started',
+        message=f'{request.user.username} started a conversation with you.',
+        url=f'/chat/conversation/{convo.id}/',
+        actor=request.user,
+    )
 
     return redirect('chat:conversation', convo_id=convo.id)
 
 
+def _serialize_messages(msgs, senders_map):
+    return [{'id': m.id, 'sender': (senders_map.get(m.sender_id).username if senders_map.get(m.sender_id) else None), 'text': m.text, 'created_at': m.created_at.isoformat()} for m in msgs]
+
+
+def _messages_after(convo, last_id):
+    """Serialize messages newer than ``last_id`` with their sender usernames."""
+    msgs = list(convo.chat_messages.filter(id__gt=last_id).order_by('id'))
+    return _serialize_messages(msgs, directory.get_many({m.sender_id for m in msgs}))
+
+
+def _after_id(request):
+    """The ``after`` message id a poll asks for; anything unparsable means 0."""
+    try:
+        return int(request.GET.get('after', 0))
+    except ValueError:
+        return 0
+
+
+def _marker_validators(convo):
+    """ETag and Last-Modified for a conversation's last-message marker."""
+    etag = quote_etag(f'{convo.id}-{convo.last_message_id or 0}')
+    last_modified = int(convo.last_message_at.timestamp()) if convo.last_message_at else None
+    return etag, last_modified
+
+
+def _with_validators(response, etag, last_modified):
+    response['ETag'] = etag
+    if last_modified is not None:
+        response['Last-Modified'] = http_date(last_modified)
+    # Let the browser keep the body but revalidate on every poll
+    patch_cache_control(response, private=True, no_cache=True)
+    return response
+
+
 @login_required
 def fetch_messages(request, convo_id):
     convo = get_object_or_404(Conversation, id=convo_id)
-    if not ChatMember.objects.filter(conversation_id=convo.id, user_id=request.user.id).exists():
+    if not is_member(convo.id, request.user.id):
         return JsonResponse({'messages': []})
-    last_id = int(request.GET.get('after', 0))
-    msgs = list(convo.chat_messages.filter(id__gt=last_id))
-    sender_ids = {m.sender_id for m in msgs}
-    from django.contrib.auth import get_user_model
-    UserModel = get_user_model()
-    senders = UserModel.objects.filter(id__in=list(sender_ids)) if sender_ids else []
-    senders_map = {s.id: s for s in senders}
-    data = [{'id': m.id, 'sender': (senders_map.get(m.sender_id).username if senders_map.get(m.sender_id) else None), 'text': m.text, 'created_at': m.created_at.isoformat()} for m in msgs]
-    return JsonResponse({'messages': data})
+    last_id = _after_id(request)
+    etag, last_modified = _marker_validators(convo)
+    not_modified = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if not_modified is not None:
+        return not_modified
+    if (convo.last_message_id or 0) > last_id:
+        data = _messages_after(convo, last_id)
+    else:
+        # The marker says nothing is newer: skip the message and user tables
+        data = []
+    return _with_validators(JsonResponse({'messages': data}), etag, last_modified)
+
+
+@login_required
+def wait_messages(request, convo_id):
+    """Short-poll fallback for the long-poll endpoint under WSGI.
+
+    A held request would tie up one of the worker's threads for up to
+    ``CHAT_LONG_POLL_TIMEOUT`` seconds, so here the answer comes at once, as
+    from ``fetch_messages``. The waiting version is chat.async_views.
+    """
+    return fetch_messages(request, convo_id)
+
+
+def _read_upto(request, convo):
+    """Message id a mark-read request advances to: ``up_to`` if given, else the
+    newest message, never past the conversation's last-message marker.
+
+    ``None`` if ``up_to`` is not a message id (unparsable or negative).
+    """
+    newest = convo.last_message_id or 0
+    if 'up_to' not in request.POST:
+        return newest
+    try:
+        up_to = int(request.POST['up_to'])
+    except ValueError:
+        return None
+    return min(up_to, newest) if up_to >= 0 else None
+
+
+def _bad_read_upto():
+    return JsonResponse({'success': False, 'error': 'Invalid up_to'}, status=400)
+
+
+@login_required
+@require_POST
+def mark_read(request, convo_id):
+    """Advance the current user's read watermark; called from the polling loop."""
+    convo = get_object_or_404(Conversation, id=convo_id)
+    if not is_member(convo.id, request.user.id, fresh=True):
+        return JsonResponse({'success': False, 'error': 'Not a participant'})
+    up_to = _read_upto(request, convo)
+    if up_to is None:
+        return _bad_read_upto()
+    if up_to:
+        ReadReceipt.mark_read(convo.id, request.user.id, up_to)
+    return JsonResponse({'success': True, 'last_read_id': up_to})
 
 
 @login_required
@@ -355,7 +415,7 @@ def delete_message(request, convo_id, msg_id):
 
 
 def is_admin(user):
-    return user.is_authenticated and (user.is_staff or hasattr(user, 'adminprofile'))
+    return user.is_staff or admin_directory.has_profile(user, fresh=True)
 
 
 @user_passes_test(is_admin)
@@ -370,10 +430,7 @@ def admin_conversations(request):
         for r in rows:
             convo_participants.setdefault(r['conversation_id'], []).append(r['user_id'])
             user_ids.add(r['user_id'])
-        from django.contrib.auth import get_user_model
-        UserModel = get_user_model()
-        users = UserModel.objects.filter(id__in=list(user_ids))
-        users_map = {u.id: u for u in users}
+        users_map = directory.get_many(user_ids)
         for cid, uids in convo_participants.items():
             setattr(convo_map[cid], 'participants_safe', [users_map.get(uid) for uid in uids if users_map.get(uid) is not None])
     return render(request, 'chat/admin_list.html', {'conversations': convos})
@@ -12,5 +12,12 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'home.settings')
+# Route the chat hot path to the async views (chat.async_views)
+os.environ.setdefault('CHAT_ASYNC_VIEWS', 'true')
 
 application = get_asgi_application()
+
+# Periodic maintenance (found-to-adoption sweep) runs inside server processes only
+from webapp.scheduler import start_scheduler  # noqa: E402
+
+start_scheduler()
@@ -89,6 +89,7 @@ TEMPLATES = [
                 'django.contrib.auth.context_processors.auth',
                     'django.contrib.messages.context_processors.messages',
                     'webapp.context_processors.notifications_processor',
+                    'webapp.context_processors.admin_processor',
             ],
         },
     },
@@ -150,8 +151,10 @@ else:
 if dj_database_url and os.environ.get('CHAT_DATABASE_URL'):
     DATABASES['chat_db'] = dj_database_url.parse(os.environ.get('CHAT_DATABASE_URL'))
 else:
-    # Use the same DB as default for chat if not explicitly configured
-    DATABASES['chat_db'] = DATABASES.get('default')
+    # Use the same DB as default for chat if not explicitly configured. Copy
+    # the dict: the test runner rewrites NAME per alias, and a shared dict
+    # makes it tear down the real database file.
+    DATABASES['chat_db'] = dict(DATABASES.get('default'))
 
 # Route chat app models to chat_db
 DATABASE_ROUTERS = ['chat.db_routers.ChatRouter']
@@ -207,4 +210,89 @@ MEDIA_ROOT = BASE_DIR / 'media'
 # Authentication Settings
 LOGIN_URL = '/login/'
 LOGIN_REDIRECT_URL = '/dashboard/'
-LOGOUT_REDIRECT_URL = '/'
\ No newline at end of file
+LOGOUT_REDIRECT_URL = '/'
+
+# Seconds between in-process sweeps that move found pets to adoption once
+# their hold period is over. Off by default: run the ``move_found_pets``
+# command from cron. Each server process starts its own sweep thread, so only
+# enable this for single-process deployments.
+FOUND_PET_SWEEP_INTERVAL = int(os.environ.get('FOUND_PET_SWEEP_INTERVAL', '0'))
+
+# How long each process may keep its cached admin id sets (webapp.admin_directory).
+# They are used for display and recipients; permission checks read the database.
+ADMIN_DIRECTORY_TTL = int(os.environ.get('ADMIN_DIRECTORY_TTL', '300'))
+
+# Chat long-polling (ASGI only; under WSGI the page polls every few seconds):
+# how long /chat/conversation/<id>/wait/ holds a request, how often it checks
+# the database for messages sent through other processes, and the pub/sub
+# broker used to wake waiting requests (dotted path).
+CHAT_LONG_POLL_TIMEOUT = int(os.environ.get('CHAT_LONG_POLL_TIMEOUT', '25'))
+CHAT_LONG_POLL_RECHECK = float(os.environ.get('CHAT_LONG_POLL_RECHECK', '3'))
+CHAT_BROKER = os.environ.get('CHAT_BROKER', 'chat.pubsub.LocalBroker')
+
+# Serve conversation/send/fetch/wait with the async views in chat.async_views.
+# home/asgi.py enables this; there is no benefit under WSGI.
+CHAT_ASYNC_VIEWS = os.environ.get('CHAT_ASYNC_VIEWS', 'False').lower() in ('1', 'true', 'yes')
+
+# Seconds a conversation's cached member list may be reused. Invalidation is
+# immediate in the process that changed membership; other processes using the
+# default per-process cache catch up when the entry expires. Sending a message
+# and marking it read always check the database.
+CHAT_MEMBERSHIP_CACHE_TTL = int(os.environ.get('CHAT_MEMBERSHIP_CACHE_TTL', '60'))
+
+# Per-process LRU of user summaries used to show chat senders/participants
+CHAT_USER_DIRECTORY_SIZE = int(os.environ.get('CHAT_USER_DIRECTORY_SIZE', '1024'))
+CHAT_USER_DIRECTORY_TTL = int(os.environ.get('CHAT_USER_DIRECTORY_TTL', '300'))
+
+# Conversations per page on the chat index
+CHAT_INDEX_PAGE_SIZE = int(os.environ.get('CHAT_INDEX_PAGE_SIZE', '20'))
+
+# Messages per conversation history page (initial render and each older page)
+CHAT_HISTORY_PAGE_SIZE = int(os.environ.get('CHAT_HISTORY_PAGE_SIZE', '50'))
+
+# Pet search backend (dotted path); empty picks SQLite FTS5 or the basic fallback
+PET_SEARCH_BACKEND = os.environ.get('PET_SEARCH_BACKEND', '')
+
+# Facet counts on pet lists and the admin dashboard: cache lifetime and how
+# many locations to list
+PET_FACET_CACHE_TTL = int(os.environ.get('PET_FACET_CACHE_TTL', '300'))
+PET_FACET_LOCATION_LIMIT = int(os.environ.get('PET_FACET_LOCATION_LIMIT', '10'))
+
+# Nearby pet searches (?near=<place> or ?lat=&lon= on the list pages): default
+# and maximum radius in km
+PET_NEAR_RADIUS_KM = float(os.environ.get('PET_NEAR_RADIUS_KM', '25'))
+PET_NEAR_MAX_RADIUS_KM = float(os.environ.get('PET_NEAR_MAX_RADIUS_KM', '200'))
+
+# Lost/found matching: how far apart (km) and how many days apart a pair may
+# be, and the lowest score (0-1) worth storing
+PET_MATCH_RADIUS_KM = float(os.environ.get('PET_MATCH_RADIUS_KM', '50'))
+PET_MATCH_WINDOW_DAYS = int(os.environ.get('PET_MATCH_WINDOW_DAYS', '30'))
+PET_MATCH_MIN_SCORE = float(os.environ.get('PET_MATCH_MIN_SCORE', '0.5'))
+
+# Resized pet photos (webapp.images): WebP/JPEG quality, 1-95
+PET_IMAGE_QUALITY = int(os.environ.get('PET_IMAGE_QUALITY', '80'))
+
+# Uploaded media is stored once per distinct content, under hash names
+# (webapp.storage). Static files keep Django's default storage; the
+# STATICFILES_STORAGE setting above is no longer read by Django 5.1+.
+STORAGES = {
+    'default': {'BACKEND': os.environ.get('MEDIA_STORAGE_BACKEND', 'webapp.storage.ContentHashStorage')},
+    'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'},
+}
+
+# gc_media: hours an unreferenced image is kept before it is deleted
+MEDIA_GC_GRACE_HOURS = float(os.environ.get('MEDIA_GC_GRACE_HOURS', '24'))
+
+# Serve MEDIA_URL from the app (webapp.media) outside DEBUG too, and how long
+# browsers may cache renditions and media whose names aren't content hashes
+# (seconds)
+SERVE_MEDIA = os.environ.get('SERVE_MEDIA', 'True').lower() in ('1', 'true', 'yes')
+MEDIA_CACHE_MAX_AGE = int(os.environ.get('MEDIA_CACHE_MAX_AGE', '3600'))
+
+# Pet photo uploads (webapp.uploads): largest accepted file (MB) and image
+# (pixels), the longest side kept (larger photos are downscaled) and how many
+# downscales may run at once per process
+PET_IMAGE_MAX_UPLOAD_MB = float(os.environ.get('PET_IMAGE_MAX_UPLOAD_MB', '10'))
+PET_IMAGE_MAX_PIXELS = int(os.environ.get('PET_IMAGE_MAX_PIXELS', '50000000'))
+PET_IMAGE_MAX_DIMENSION = int(os.environ.get('PET_IMAGE_MAX_DIMENSION', '3200'))
+PET_IMAGE_RESIZE_WORKERS = int(os.environ.get('PET_IMAGE_RESIZE_WORKERS', '2'))
@@ -14,14 +14,19 @@ Including another URLconf
     1. Import the include() function: from django.urls import include, path
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
+import re
+from urllib.parse import urlsplit
+
 from django.contrib import admin
-from django.urls import path, include
+from django.urls import path, include, re_path
 from django.shortcuts import redirect
 
 # --- Add these two imports ---
 from django.conf import settings
 from django.conf.urls.static import static
 
+from webapp.media import serve_media
+
 urlpatterns = [
     # Backwards-compatible redirect: some links may point to /admin/start-chat/<id>/
     # but Django's admin captures the 'admin/' space. Redirect here to the
@@ -33,7 +38,11 @@ urlpatterns = [
 ]
 
 # --- Add this block at the end ---
-# This line is what allows images to be served in development mode.
-if settings.DEBUG:
+# Uploaded images, in production too: webapp.media adds long-lived caching,
+# conditional and range requests. Turn off with SERVE_MEDIA=False when a web
+# server or CDN serves MEDIA_ROOT itself.
+if getattr(settings, 'SERVE_MEDIA', True) and not urlsplit(settings.MEDIA_URL).netloc:
+    urlpatterns += [re_path(rf'^{re.escape(settings.MEDIA_URL.lstrip("/"))}(?P<path>.+)$', serve_media)]
+elif settings.DEBUG:
     urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
 
@@ -14,3 +14,8 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'home.settings')
 
 application = get_wsgi_application()
+
+# Periodic maintenance (found-to-adoption sweep) runs inside server processes only
+from webapp.scheduler import start_scheduler  # noqa: E402
+
+start_scheduler()
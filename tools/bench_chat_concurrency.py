@@ -0,0 +1,213 @@
+"""
+Benchmark: chat delivery on one worker process, WSGI short-poll vs ASGI long-poll.
+
+N clients watch the same conversation, then one message is posted.
+
+* WSGI: each client calls ``chat.views.fetch_messages`` every ``--interval``
+  seconds (3 in the page), on a pool of ``--threads`` threads (1 for the
+  Procfile's sync worker). Every request is answered at once, so nothing is
+  held open; the cost is a steady stream of requests and a delivery delay of
+  up to one interval.
+* ASGI: ``chat.async_views.wait_messages`` runs on a single event loop. Every
+  client waits concurrently on the broker without holding a thread, and is
+  woken as soon as the message is published.
+
+The script uses throwaway SQLite databases in a temp dir and calls the views
+directly (no network server needed):
+
+    python tools/bench_chat_concurrency.py --clients 500
+"""
+import argparse
+import asyncio
+import heapq
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+_tmp = tempfile.mkdtemp(prefix='chat-bench-')
+os.environ['DATABASE_URL'] = f'sqlite:///{os.path.join(_tmp, "default.sqlite3")}'
+os.environ['CHAT_DATABASE_URL'] = f'sqlite:///{os.path.join(_tmp, "chat.sqlite3")}'
+os.environ['FOUND_PET_SWEEP_INTERVAL'] = '0'
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'home.settings')
+
+import django  # noqa: E402
+
+django.setup()
+
+from django.conf import settings  # noqa: E402
+from django.contrib.auth import get_user_model  # noqa: E402
+from django.core.management import call_command  # noqa: E402
+from django.test import RequestFactory  # noqa: E402
+
+from chat import async_views, views  # noqa: E402
+from chat.models import ChatMember, Conversation, Message  # noqa: E402
+from chat.pubsub import get_broker  # noqa: E402
+
+
+class WaitCounter:
+    """Tracks how many clients are parked on the broker at the same time."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.current = 0
+        self.peak = 0
+
+    def enter(self):
+        with self.lock:
+            self.current += 1
+            self.peak = max(self.peak, self.current)
+
+    def leave(self):
+        with self.lock:
+            self.current -= 1
+
+
+def instrument(broker, counter):
+    await_message = broker.await_message
+
+    async def counted_await(*args, **kwargs):
+        counter.enter()
+        try:
+            return await await_message(*args, **kwargs)
+        finally:
+            counter.leave()
+
+    def restore():
+        broker.await_message = await_message
+
+    broker.await_message = counted_await
+    return restore
+
+
+def setup_conversation(clients):
+    call_command('migrate', verbosity=0)
+    call_command('migrate', database='chat_db', verbosity=0)
+    UserModel = get_user_model()
+    UserModel.objects.bulk_create([UserModel(username=f'bench{i}') for i in range(clients + 1)])
+    users = list(UserModel.objects.order_by('id'))
+    convo = Conversation.objects.create(subject='bench')
+    ChatMember.objects.bulk_create([ChatMember(conversation=convo, user_id=u.id) for u in users])
+    return convo, users
+
+
+def post_message(convo, sender):
+    last = Message.objects.create(conversation=convo, sender_id=sender.id, text='ping')
+    Conversation.record_message(last)
+    get_broker().publish(convo.id, last.id)
+    return last
+
+
+def make_request(factory, convo, user, after, endpoint='wait'):
+    request = factory.get(f'/chat/conversation/{convo.id}/{endpoint}/', {'after': after})
+    request.user = user
+
+    async def auser():
+        return user
+
+    request.auser = auser
+    return request
+
+
+def bench_wsgi(convo, users, threads, delay, interval):
+    factory = RequestFactory()
+    after = Message.objects.filter(conversation=convo).order_by('-id').values_list('id', flat=True).first() or 0
+    clients = users[1:]
+    done, polls = [], 0
+
+    def poll(user):
+        response = views.fetch_messages(make_request(factory, convo, user, after, 'fetch'), convo.id)
+        return bool(json.loads(response.content)['messages'])
+
+    start = time.perf_counter()
+    # Clients poll on their own clocks, spread evenly over one interval
+    schedule = [(start + i * interval / len(clients), i) for i in range(len(clients))]
+    posted = peak_threads = None
+    in_flight = {}
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        while schedule or in_flight:
+            now = time.perf_counter()
+            if posted is None and now - start >= delay:
+                peak_threads = threading.active_count()
+                posted = time.perf_counter()
+                post_message(convo, users[0])
+            for future in [f for f in in_flight if f.done()]:
+                i, due = in_flight.pop(future)
+                if future.result():
+                    done.append(time.perf_counter())
+                else:
+                    heapq.heappush(schedule, (due + interval, i))
+            while schedule and schedule[0][0] <= now:
+                due, i = heapq.heappop(schedule)
+                in_flight[pool.submit(poll, clients[i])] = (i, due)
+                polls += 1
+            time.sleep(0.001)
+    return start, posted, done, peak_threads, polls
+
+
+def bench_asgi(convo, users, delay):
+    factory = RequestFactory()
+    after = Message.objects.filter(conversation=convo).order_by('-id').values_list('id', flat=True).first() or 0
+    done = []
+
+    async def client(user):
+        response = await async_views.wait_messages(make_request(factory, convo, user, after), convo.id)
+        done.append(time.perf_counter())
+        return response
+
+    async def run():
+        from asgiref.sync import sync_to_async
+        tasks = [asyncio.ensure_future(client(u)) for u in users[1:]]
+        await asyncio.sleep(delay)
+        peak_threads = threading.active_count()
+        posted = time.perf_counter()
+        await sync_to_async(post_message)(convo, users[0])
+        await asyncio.gather(*tasks)
+        return posted, peak_threads
+
+    start = time.perf_counter()
+    posted, peak_threads = asyncio.run(run())
+    return start, posted, done, peak_threads, len(users) - 1
+
+
+def report(name, held, clients, result):
+    start, posted, done, peak_threads, requests = result
+    latencies = sorted(t - posted for t in done)
+    print(f'{name}:')
+    print(f'  clients held open at once : {held} / {clients}')
+    print(f'  requests served           : {requests}')
+    print(f'  OS threads while waiting  : {peak_threads}')
+    print(f'  delivery latency p50/max  : {latencies[len(latencies) // 2] * 1000:.1f} ms / {latencies[-1] * 1000:.1f} ms')
+    print(f'  wall time                 : {max(done) - start:.2f} s')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--clients', type=int, default=500)
+    parser.add_argument('--threads', type=int, default=1,
+                        help='threads serving WSGI requests (gunicorn --threads; 1 for the Procfile\'s sync worker)')
+    parser.add_argument('--interval', type=float, default=3.0, help='seconds between WSGI short-polls')
+    parser.add_argument('--delay', type=float, default=1.0, help='seconds clients wait before a message is posted')
+    parser.add_argument('--timeout', type=float, default=5.0, help='ASGI long-poll timeout')
+    args = parser.parse_args()
+
+    settings.CHAT_LONG_POLL_TIMEOUT = args.timeout
+    convo, users = setup_conversation(args.clients)
+
+    wsgi = bench_wsgi(convo, users, args.threads, args.delay, args.interval)
+    report(f'WSGI short-poll every {args.interval:g} s ({args.threads} thread(s))', 0, args.clients, wsgi)
+
+    counter = WaitCounter()
+    restore = instrument(get_broker(), counter)
+    asgi = bench_asgi(convo, users, args.delay)
+    restore()
+    report('ASGI long-poll (1 event loop)', counter.peak, args.clients, asgi)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,83 @@
+"""
+Process-wide cache of who the site admins are.
+
+Two overlapping notions of "admin" exist: users with ``is_staff`` or
+``is_superuser`` (they receive contact messages and join support chats) and
+users with an ``AdminProfile`` (they may use the admin dashboard). Both id
+sets are loaded together in two small queries and kept until a User or
+AdminProfile is saved or deleted in this process (see webapp.signals), or for
+``ADMIN_DIRECTORY_TTL`` seconds so changes made through other worker
+processes show up eventually.
+
+That delay is fine for display (the admin menu) and for choosing who gets a
+message, not for permissions: a revoked admin would keep access until the
+entry expires. Permission checks pass ``fresh=True``, which asks the database.
+"""
+
+import threading
+import time
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db.models import Q
+
+
+class AdminDirectory:
+    """Thread-safe snapshot of the staff and admin-profile user ids."""
+
+    def __init__(self, ttl=300):
+        self.ttl = ttl
+        self._snapshot = None
+        self._expires = 0
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _staff():
+        UserModel = get_user_model()
+        return UserModel.objects.filter(Q(is_staff=True) | Q(is_superuser=True))
+
+    def _load(self):
+        from .models import AdminProfile
+        staff = frozenset(self._staff().values_list('id', flat=True))
+        profiles = frozenset(AdminProfile.objects.values_list('user_id', flat=True))
+        return staff, profiles
+
+    def _get(self):
+        with self._lock:
+            if self._snapshot is not None and self._expires > time.monotonic():
+                return self._snapshot
+            generation = self._generation
+        snapshot = self._load()
+        with self._lock:
+            # Don't keep a snapshot that an invalidation raced past
+            if generation == self._generation:
+                self._snapshot = snapshot
+                self._expires = time.monotonic() + self.ttl
+        return snapshot
+
+    def staff_ids(self, fresh=False):
+        """Ids of users with ``is_staff`` or ``is_superuser``."""
+        if fresh:
+            return frozenset(self._staff().values_list('id', flat=True))
+        return self._get()[0]
+
+    def profile_ids(self):
+        """Ids of users that have an ``AdminProfile``."""
+        return self._get()[1]
+
+    def has_profile(self, user, fresh=False):
+        if not user.is_authenticated:
+            return False
+        if fresh:
+            from .models import AdminProfile
+            return AdminProfile.objects.filter(user_id=user.id).exists()
+        return user.id in self.profile_ids()
+
+    def invalidate(self):
+        with self._lock:
+            self._snapshot = None
+            self._generation += 1
+
+
+admin_directory = AdminDirectory(ttl=getattr(settings, 'ADMIN_DIRECTORY_TTL', 300))
@@ -1,8 +1,13 @@
-from .models import Notification
+from .admin_directory import admin_directory
+from .notifications import get_unread_count
 
 def notifications_processor(request):
     """Add unread notification count to context for authenticated users."""
     if request.user.is_authenticated:
-        unread_count = Notification.objects.filter(user=request.user, unread=True).count()
-        return {'unread_notifications_count': unread_count}
+        return {'unread_notifications_count': get_unread_count(request.user)}
     return {'unread_notifications_count': 0}
+
+
+def admin_processor(request):
+    """Expose whether the current user has an admin profile, without a query per page."""
+    return {'user_is_admin': admin_directory.has_profile(request.user)}
@@ -102,11 +102,21 @@ class AdminRegistrationForm(UserCreationForm, PasswordVisibilityMixin):
             AdminProfile.objects.create(user=user)
         return user
 
+class PetImageField(forms.ImageField):
+    """ImageField that reports why webapp.uploads rejected a photo while it streamed in."""
+
+    def to_python(self, data):
+        error = getattr(data, 'upload_error', None)
+        if error:
+            raise ValidationError(error, code='invalid_image')
+        return super().to_python(data)
+
 class PetForm(forms.ModelForm):
     class Meta:
         model = Pet
         fields = ['name', 'species', 'breed', 'color', 'age', 'gender', 'status', 
                  'location', 'description', 'contact_email', 'contact_phone', 'image']
+        field_classes = {'image': PetImageField}
         widgets = {
             'description': forms.Textarea(attrs={'rows': 4}),
             'age': forms.TextInput(attrs={'placeholder': 'e.g., 2 years, 6 months, Puppy'}),
@@ -154,9 +164,10 @@ class PetRegistrationRequestForm(forms.ModelForm):
         model = PetRegistrationRequest
         fields = [
             'name', 'species', 'breed', 'color', 'age', 'gender', 
-            'pet_status', 'location', 'description', 'contact_email', 
+            'pet_status', 'location', 'latitude', 'longitude', 'description', 'contact_email',
             'contact_phone', 'image'
         ]
+        field_classes = {'image': PetImageField}
         widgets = {
             'name': forms.TextInput(attrs={'class': 'form-control', 'placeholder': 'Pet name'}),
             'species': forms.Select(attrs={'class': 'form-control'}),
@@ -166,6 +177,9 @@ class PetRegistrationRequestForm(forms.ModelForm):
             'gender': forms.Select(attrs={'class': 'form-control'}),
             'pet_status': forms.Select(attrs={'class': 'form-control'}),
             'location': forms.TextInput(attrs={'class': 'form-control', 'placeholder': 'City, State/Province'}),
+            # Filled in by the "Use my location" button
+            'latitude': forms.HiddenInput(),
+            'longitude': forms.HiddenInput(),
             'description': forms.Textarea(attrs={
                 'class': 'form-control', 
                 'rows': 4, 
@@ -187,3 +201,11 @@ class PetRegistrationRequestForm(forms.ModelForm):
         # Make contact_email show user's email as placeholder if available
         if hasattr(self, 'instance') and hasattr(self.instance, 'user') and self.instance.user:
             self.fields['contact_email'].widget.attrs['placeholder'] = f'Leave blank to use: {self.instance.user.email}'
+
+    def clean(self):
+        cleaned = super().clean()
+        # Coordinates are only useful as a pair and within range
+        lat, lon = cleaned.get('latitude'), cleaned.get('longitude')
+        if lat is None or lon is None or not (-90 <= lat <= 90 and -180 <= lon <= 180):
+            cleaned['latitude'] = cleaned['longitude'] = None
+        return cleaned
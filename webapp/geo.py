@@ -0,0 +1,176 @@
+"""
+Nearby-pet lookups on top of a geohash index.
+
+Pets carry optional coordinates. They are entered by the reporter, or looked
+up offline from ``location`` in the ``Place`` table, and stored with a
+geohash. A radius query covers the circle's bounding box with the finest
+geohash cells that take at most ``MAX_COVERING_CELLS`` of them, range-scans
+each cell prefix on the ``(status, geohash)`` index, then keeps only
+candidates within the exact great-circle distance. The work is proportional
+to the pets in those few cells, not to the size of the table.
+"""
+
+import math
+import re
+
+from django.conf import settings
+from django.db.models import Q
+
+_BASE32 = '0123456789bcdefghjkmnpqrstuvwxyz'
+# One past the last base32 character, for "starts with" as a range scan
+_PREFIX_END = '{'
+EARTH_RADIUS_KM = 6371.0088
+GEOHASH_PRECISION = 9
+# Upper bound on range scans per radius query
+MAX_COVERING_CELLS = 16
+
+DEFAULT_RADIUS_KM = getattr(settings, 'PET_NEAR_RADIUS_KM', 25)
+MAX_RADIUS_KM = getattr(settings, 'PET_NEAR_MAX_RADIUS_KM', 200)
+# Offered in the "nearby" radius picker
+RADIUS_CHOICES_KM = (5, 10, 25, 50, 100)
+
+
+def encode_geohash(lat, lon, precision=GEOHASH_PRECISION):
+    lat_range, lon_range = [-90.0, 90.0], [-180.0, 180.0]
+    chars, bits, bit_count, even = [], 0, 0, True
+    while len(chars) < precision:
+        rng, value = (lon_range, lon) if even else (lat_range, lat)
+        mid = (rng[0] + rng[1]) / 2
+        bits <<= 1
+        if value >= mid:
+            bits |= 1
+            rng[0] = mid
+        else:
+            rng[1] = mid
+        even = not even
+        bit_count += 1
+        if bit_count == 5:
+            chars.append(_BASE32[bits])
+            bits, bit_count = 0, 0
+    return ''.join(chars)
+
+
+def cell_size(precision):
+    """``(height, width)`` of a geohash cell in degrees."""
+    lon_bits = math.ceil(precision * 5 / 2)
+    lat_bits = precision * 5 - lon_bits
+    return 180.0 / 2 ** lat_bits, 360.0 / 2 ** lon_bits
+
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    lat1, lon1, lat2, lon2 = map(math.radians, (lat1, lon1, lat2, lon2))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(min(1.0, a)))
+
+
+def _bounding_box(lat, lon, radius_km):
+    km_per_degree = math.pi * EARTH_RADIUS_KM / 180
+    dlat = radius_km / km_per_degree
+    dlon = min(180.0, dlat / max(math.cos(math.radians(lat)), 0.01))
+    return max(-90.0, lat - dlat), min(90.0, lat + dlat), lon - dlon, lon + dlon
+
+
+def _cell_span(low, high, size):
+    """Index of the first cell covering ``[low, high]`` and how many there are."""
+    first = math.floor(low / size)
+    return first, math.floor(high / size) - first + 1
+
+
+def covering_cells(lat, lon, radius_km, max_cells=MAX_COVERING_CELLS):
+    """Geohash prefixes covering the circle's bounding box.
+
+    Uses the finest precision that needs at most ``max_cells`` cells, so a
+    large radius scans a few dozen mid-sized cells rather than nine huge ones.
+    """
+    south, north, west, east = _bounding_box(lat, lon, radius_km)
+    chosen = None
+    for precision in range(1, GEOHASH_PRECISION + 1):
+        height, width = cell_size(precision)
+        lat_span, lon_span = _cell_span(south, north, height), _cell_span(west, east, width)
+        if chosen is not None and lat_span[1] * lon_span[1] > max_cells:
+            break
+        chosen = precision, height, width, lat_span, lon_span
+    precision, height, width, (first_lat, lat_count), (first_lon, lon_count) = chosen
+    lats = [(first_lat + i) * height for i in range(lat_count)]
+    lons = [(first_lon + i) * width for i in range(lon_count)]
+    cells = set()
+    for cell_lat in lats:
+        for cell_lon in lons:
+            # Encode the cell's centre, wrapping across the antimeridian
+            centre_lat = min(90.0, cell_lat + height / 2)
+            centre_lon = (cell_lon + width / 2 + 180.0) % 360.0 - 180.0
+            cells.add(encode_geohash(centre_lat, centre_lon, precision))
+    return sorted(cells)
+
+
+def pets_near(lat, lon, radius_km=DEFAULT_RADIUS_KM, queryset=None, limit=None):
+    """Pets within ``radius_km`` of a point, nearest first.
+
+    Each pet gets a ``distance_km`` attribute. ``queryset`` narrows the
+    candidates (e.g. by status) before the geohash range scans.
+    """
+    from .models import Pet
+    if queryset is None:
+        queryset = Pet.objects.all()
+    radius_km = min(radius_km, MAX_RADIUS_KM)
+    in_cells = Q()
+    for prefix in covering_cells(lat, lon, radius_km):
+        in_cells |= Q(geohash__gte=prefix, geohash__lt=prefix + _PREFIX_END)
+    nearby = []
+    for pet in queryset.filter(in_cells):
+        distance = haversine_km(lat, lon, pet.latitude, pet.longitude)
+        if distance <= radius_km:
+            pet.distance_km = distance
+            nearby.append(pet)
+    nearby.sort(key=lambda pet: (pet.distance_km, -pet.id))
+    return nearby[:limit] if limit else nearby
+
+
+_PLACE_SPLIT = re.compile(r'[,/;|]+')
+
+
+def normalize_place(name):
+    return ' '.join(re.findall(r'\w+', (name or '').lower()))
+
+
+def geocode(location):
+    """Look up ``(lat, lon)`` for free-text ``location`` in the Place table.
+
+    The whole string is tried first, then each comma-separated part from the
+    most specific ("Koregaon Park, Pune" -> "koregaon park", then "pune").
+    Returns ``None`` when nothing matches.
+    """
+    from .models import Place
+    candidates = [normalize_place(location)]
+    candidates += [normalize_place(part) for part in _PLACE_SPLIT.split(location or '')]
+    candidates = [c for c in dict.fromkeys(candidates) if c]
+    if not candidates:
+        return None
+    found = dict((p.name, p) for p in Place.objects.filter(name__in=candidates))
+    for candidate in candidates:
+        if candidate in found:
+            return found[candidate].latitude, found[candidate].longitude
+    return None
+
+
+def parse_near(params):
+    """Read a search point from ``lat``/``lon`` or a ``near`` place name.
+
+    Returns ``(lat, lon, radius_km)`` or ``None`` if no usable point was given.
+    """
+    point = None
+    try:
+        lat, lon = float(params['lat']), float(params['lon'])
+        if -90 <= lat <= 90 and -180 <= lon <= 180:
+            point = lat, lon
+    except (KeyError, ValueError):
+        pass
+    if point is None and params.get('near'):
+        point = geocode(params['near'])
+    if point is None:
+        return None
+    try:
+        radius = float(params.get('radius', DEFAULT_RADIUS_KM))
+    except ValueError:
+        radius = DEFAULT_RADIUS_KM
+    return point[0], point[1], max(1.0, min(radius, MAX_RADIUS_KM))
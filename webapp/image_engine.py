@@ -0,0 +1,136 @@
+"""
+Shared engine for the bulk image management commands.
+
+Rendering and resizing are CPU-bound Pillow work. ``ImageEngine.map``
+spreads them over a ``ProcessPoolExecutor`` (``workers=1`` runs in-process;
+``threads=True`` suits network-bound work such as downloads). Worker
+functions are module-level functions that take a picklable spec and return
+encoded image bytes. They never touch the database.
+
+The parent stores each result under its content name (webapp.storage,
+``pet_images/1f2e....png``), so identical outputs are written once and
+shared, and a rerun skips files that already exist. Pets are then pointed
+at their files with one UPDATE per distinct file, and their renditions
+(webapp.images) are made in parallel too. ``engine.stats`` counts what
+happened and the throughput, for the command to print.
+"""
+
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
+from io import BytesIO
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import connections
+from PIL import Image
+
+from .images import generate_renditions
+from .storage import content_name
+
+
+def gradient(size, top, bottom):
+    """A vertical ``top``-to-``bottom`` colour gradient, computed inside Pillow."""
+    mask = Image.linear_gradient('L').resize(size)
+    return Image.composite(Image.new('RGB', size, bottom), Image.new('RGB', size, top), mask)
+
+
+def encode(image, fmt='JPEG', **options):
+    buffer = BytesIO()
+    image.save(buffer, fmt, **options)
+    return buffer.getvalue()
+
+
+class EngineStats:
+    """Counters and timing for one engine run."""
+
+    def __init__(self):
+        self.processed = self.failed = 0
+        self.stored = self.reused = self.bytes_written = 0
+        self.started = time.perf_counter()
+
+    @property
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+    @property
+    def rate(self):
+        return self.processed / self.elapsed if self.elapsed else 0.0
+
+    def __str__(self):
+        return (f'{self.processed} image(s) in {self.elapsed:.2f}s ({self.rate:.1f}/s); '
+                f'{self.stored} stored, {self.reused} already stored, {self.failed} failed, '
+                f'{self.bytes_written / 1024:.0f} KiB written')
+
+
+def _setup_worker():
+    # Spawned (non-forked) workers start without Django configured
+    import django
+    django.setup()
+
+
+def _guarded(func, spec):
+    try:
+        return func(spec), None
+    except Exception as exc:
+        return None, f'{type(exc).__name__}: {exc}'
+
+
+def _renditions(spec):
+    name, force = spec
+    return len(generate_renditions(name, force=force))
+
+
+class ImageEngine:
+    """Runs image work in parallel and stores results by content."""
+
+    def __init__(self, workers=None, storage=default_storage):
+        self.workers = max(1, workers or os.cpu_count() or 1)
+        self.storage = storage
+        self.stats = EngineStats()
+
+    def map(self, func, specs, threads=False):
+        """Yield ``(spec, result, error)`` for each spec, in order.
+
+        ``func`` must be a module-level function when processes are used. An
+        exception in ``func`` becomes ``error`` and doesn't stop the run.
+        """
+        specs = list(specs)
+        task = partial(_guarded, func)
+        if self.workers == 1 or len(specs) < 2:
+            results = map(task, specs)
+        elif threads:
+            with ThreadPoolExecutor(max_workers=self.workers) as pool:
+                results = list(pool.map(task, specs))
+        else:
+            # Children must not share the parent's database connections
+            connections.close_all()
+            with ProcessPoolExecutor(max_workers=self.workers, initializer=_setup_worker) as pool:
+                chunksize = max(1, len(specs) // (self.workers * 4))
+                results = list(pool.map(task, specs, chunksize=chunksize))
+        for spec, (result, error) in zip(specs, results):
+            self.stats.processed += 1
+            self.stats.failed += error is not None
+            yield spec, result, error
+
+    def store(self, data, ext, directory='pet_images'):
+        """Save ``data`` under its content name unless it is already stored."""
+        name = content_name(data, ext, directory)
+        if self.storage.exists(name):
+            self.stats.reused += 1
+            return name
+        self.stats.stored += 1
+        self.stats.bytes_written += len(data)
+        return self.storage.save(name, ContentFile(data))
+
+    def make_renditions(self, names, force=False):
+        """Generate the resized copies of ``names`` in parallel.
+
+        Returns the run's ``EngineStats`` (kept apart from ``self.stats``) and
+        ``[(name, error)]`` for the files that could not be processed.
+        """
+        engine = ImageEngine(self.workers, self.storage)
+        specs = [(name, force) for name in sorted(set(names))]
+        errors = [(name, error) for (name, _), _, error in engine.map(_renditions, specs) if error]
+        return engine.stats, errors
@@ -0,0 +1,240 @@
+"""
+Resized copies ("renditions") of uploaded pet photos.
+
+Originals are stored as uploaded and are often several megabytes. For each
+photo ``generate_renditions`` writes a few downscaled copies per rendition
+(``card``, ``detail``, ``admin``) in WebP and JPEG under
+``MEDIA_ROOT/thumbs/``. Templates use them through the ``pet_images`` tags,
+which emit ``srcset`` so the browser picks the smallest copy that fits.
+
+Rendition names follow from the original's name, so templates build their
+URLs without a query. Widths larger than the original are skipped (only the
+smallest is always written, at most the original's size), and ``srcset``
+lists only the widths that exist.
+
+Saving a pet schedules its renditions on a background thread once the
+transaction commits (``schedule_renditions``), so the request doesn't wait
+for the encodes. Until a photo's renditions exist (just uploaded, or uploads
+from before this, not yet backfilled with ``make_thumbnails``) the tags fall
+back to the original. A process that stops with renditions still queued
+leaves the same fallback, which ``make_thumbnails`` repairs.
+"""
+
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.signals import setting_changed
+from django.db import transaction
+from django.dispatch import receiver
+from PIL import Image, ImageOps
+
+logger = logging.getLogger(__name__)
+
+# Widths (largest first) and the aspect ratio to crop to, if any
+RENDITIONS = {
+    # Pet cards on the lists: 200px tall, full card width
+    'card': {'widths': (800, 400), 'aspect': (4, 3), 'sizes': '(max-width: 576px) 100vw, 400px'},
+    # Pet detail page: half the row on large screens, uncropped
+    'detail': {'widths': (1600, 800), 'aspect': None, 'sizes': '(max-width: 992px) 100vw, 50vw'},
+    # Admin tables and dashboard lists: small squares
+    'admin': {'widths': (160, 80), 'aspect': (1, 1), 'sizes': '80px'},
+}
+# (file extension, Pillow format, MIME type), preferred first
+FORMATS = (('webp', 'WEBP', 'image/webp'), ('jpg', 'JPEG', 'image/jpeg'))
+# Encoded once and served many times: favour size over encoding speed
+SAVE_OPTIONS = {'WEBP': {'method': 4}, 'JPEG': {'optimize': True, 'progressive': True}}
+THUMBS_DIR = 'thumbs'
+QUALITY = getattr(settings, 'PET_IMAGE_QUALITY', 80)
+
+# Renditions known to exist; they are only ever added, so positives are safe
+# to remember for the life of the process. Likewise the widths written for
+# each (source, rendition), which are fixed once its renditions exist.
+_rendered = set()
+_widths = {}
+_RENDERED_LIMIT = 10000
+
+
+@receiver(setting_changed)
+def _media_changed(setting, **kwargs):
+    # Names are derived from content, so the same name recurs across media roots
+    if setting in ('MEDIA_ROOT', 'STORAGES'):
+        _rendered.clear()
+        _widths.clear()
+
+
+def rendition_name(source_name, rendition, width, ext):
+    """Storage name of one rendition of ``source_name``."""
+    base, _ = os.path.splitext(source_name)
+    return f'{THUMBS_DIR}/{base}/{rendition}-{width}.{ext}'
+
+
+def _last_written(source_name, rendition):
+    # generate_renditions writes the smallest JPEG of each rendition last
+    return rendition_name(source_name, rendition, RENDITIONS[rendition]['widths'][-1], FORMATS[-1][0])
+
+
+def has_rendition(source_name, rendition, storage=default_storage):
+    name = _last_written(source_name, rendition)
+    if name in _rendered:
+        return True
+    if not storage.exists(name):
+        return False
+    if len(_rendered) >= _RENDERED_LIMIT:
+        _rendered.clear()
+    _rendered.add(name)
+    return True
+
+
+def rendition_widths(source_name, rendition, storage=default_storage):
+    """The widths of ``rendition`` written for ``source_name``, largest first.
+
+    Only call this once ``has_rendition`` is true.
+    """
+    key = (source_name, rendition)
+    if key not in _widths:
+        *larger, smallest = RENDITIONS[rendition]['widths']
+        if len(_widths) >= _RENDERED_LIMIT:
+            _widths.clear()
+        _widths[key] = tuple(w for w in larger if storage.exists(rendition_name(source_name, rendition, w, FORMATS[-1][0])))
+        _widths[key] += (smallest,)
+    return _widths[key]
+
+
+def _to_rgb(image):
+    if image.mode in ('RGBA', 'LA') or (image.mode == 'P' and 'transparency' in image.info):
+        # JPEG has no alpha: flatten transparent images onto white
+        image = image.convert('RGBA')
+        background = Image.new('RGB', image.size, 'white')
+        background.paste(image, mask=image.getchannel('A'))
+        return background
+    return image.convert('RGB')
+
+
+def _max_width(image, aspect):
+    """Widest rendition ``image`` can give without upscaling, after any crop."""
+    if aspect:
+        return max(1, min(image.width, image.height * aspect[0] // aspect[1]))
+    return image.width
+
+
+def _resize(image, width, aspect):
+    width = min(width, _max_width(image, aspect))
+    box = (0, 0, image.width, image.height)
+    if aspect:
+        # Centre crop to the aspect ratio as part of the resize
+        height = width * aspect[1] // aspect[0]
+        crop_w = min(image.width, image.height * aspect[0] / aspect[1])
+        crop_h = crop_w * aspect[1] / aspect[0]
+        left, top = (image.width - crop_w) / 2, (image.height - crop_h) / 2
+        box = (left, top, left + crop_w, top + crop_h)
+    else:
+        height = max(1, round(image.height * width / image.width))
+    # reducing_gap: cheap integer downscale first, Lanczos for the last step
+    return image.resize((width, height), Image.LANCZOS, box=box, reducing_gap=3.0)
+
+
+def generate_renditions(source_name, storage=default_storage, force=False):
+    """Write every missing rendition of ``source_name``; returns the names written.
+
+    The original is decoded once, and every rendition is resized from it.
+    Renditions are never upscaled: widths the original can't fill are skipped,
+    except the smallest, which is written at the original's size instead.
+    Raises ``OSError`` (including ``PIL.UnidentifiedImageError``) for files
+    Pillow can't read.
+    """
+    todo = [r for r in RENDITIONS if force or not has_rendition(source_name, r, storage)]
+    if not todo:
+        return []
+    largest = max(RENDITIONS[r]['widths'][0] for r in todo)
+    with storage.open(source_name, 'rb') as handle, Image.open(handle) as original:
+        # JPEGs decode at 1/2, 1/4 or 1/8 scale if that still covers the width
+        original.draft('RGB', (largest, 1))
+        image = _to_rgb(ImageOps.exif_transpose(original))
+
+    written = []
+    for rendition in todo:
+        spec = RENDITIONS[rendition]
+        *larger, smallest = spec['widths']
+        widths = [w for w in larger if w <= _max_width(image, spec['aspect'])] + [smallest]
+        _widths.pop((source_name, rendition), None)
+        for width in widths:
+            resized = _resize(image, width, spec['aspect'])
+            for ext, pil_format, _ in FORMATS:
+                buffer = BytesIO()
+                resized.save(buffer, pil_format, quality=QUALITY, **SAVE_OPTIONS[pil_format])
+                name = rendition_name(source_name, rendition, width, ext)
+                if storage.exists(name):
+                    storage.delete(name)
+                written.append(storage.save(name, ContentFile(buffer.getvalue())))
+    return written
+
+
+def delete_renditions(source_name, storage=default_storage):
+    """Remove every rendition of ``source_name``."""
+    for rendition, spec in RENDITIONS.items():
+        for width in spec['widths']:
+            for ext, _, _ in FORMATS:
+                name = rendition_name(source_name, rendition, width, ext)
+                _rendered.discard(name)
+                if storage.exists(name):
+                    storage.delete(name)
+        _widths.pop((source_name, rendition), None)
+
+
+def ensure_renditions(field_file, replace=False):
+    """Generate missing renditions for an ImageField value, logging bad files.
+
+    ``replace`` drops existing renditions first: a new upload can reuse the
+    name of a deleted file, whose renditions must not be shown for it.
+    """
+    if not field_file:
+        return []
+    if replace:
+        delete_renditions(field_file.name, field_file.storage)
+    try:
+        return generate_renditions(field_file.name, field_file.storage)
+    except (OSError, Image.DecompressionBombError):
+        logger.warning("Could not make renditions of %s", field_file.name, exc_info=True)
+        return []
+
+
+@lru_cache(maxsize=None)
+def _render_pool():
+    # One encoder thread per process: renditions queue up rather than compete
+    # with requests for the CPU
+    return ThreadPoolExecutor(max_workers=1, thread_name_prefix='pet-renditions')
+
+
+def schedule_renditions(field_file, replace=False):
+    """Run :func:`ensure_renditions` in the background after the transaction commits."""
+    if field_file:
+        transaction.on_commit(lambda: _render_pool().submit(ensure_renditions, field_file, replace))
+
+
+def srcsets(field_file, rendition):
+    """``[(mime_type, srcset)]`` for each format, or ``None`` if not generated yet."""
+    if not field_file or not has_rendition(field_file.name, rendition, field_file.storage):
+        return None
+    storage = field_file.storage
+    widths = rendition_widths(field_file.name, rendition, storage)
+    return [
+        (mime, ', '.join(f'{storage.url(rendition_name(field_file.name, rendition, w, ext))} {w}w'
+                         for w in reversed(widths)))
+        for ext, _, mime in FORMATS
+    ]
+
+
+def rendition_url(field_file, rendition, width=None, ext='jpg'):
+    """URL of one rendition (the smallest by default), or of the original if missing."""
+    if not field_file:
+        return ''
+    if not has_rendition(field_file.name, rendition, field_file.storage):
+        return field_file.url
+    width = width or RENDITIONS[rendition]['widths'][-1]
+    return field_file.storage.url(rendition_name(field_file.name, rendition, width, ext))
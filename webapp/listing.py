@@ -0,0 +1,157 @@
+"""
+Keyset (cursor) pagination for the public pet listing pages.
+
+The list views order pets newest first on ``(date_added, id)``. Instead of
+OFFSET pagination, each page remembers the last row it rendered and the next
+page asks the database for rows strictly "older" than that row, so the cost of
+a page stays the same no matter how deep the visitor scrolls.
+"""
+
+import base64
+from datetime import datetime, timezone as dt_timezone
+
+from django.conf import settings
+from django.db.models import Q
+from django.utils import timezone
+
+from .facets import compute_facets, count_facets, pet_facets
+from .geo import DEFAULT_RADIUS_KM, RADIUS_CHOICES_KM, parse_near, pets_near
+from .models import Pet
+
+DEFAULT_PAGE_SIZE = getattr(settings, 'PET_LIST_PAGE_SIZE', 24)
+MAX_PAGE_SIZE = getattr(settings, 'PET_LIST_MAX_PAGE_SIZE', 96)
+# Ids beyond this can't come from a real row (SQLite integers are 64-bit)
+MAX_ID = 2 ** 63 - 1
+
+
+def encode_cursor(pet):
+    """Encode the ordering key of ``pet`` into an opaque, URL-safe cursor."""
+    raw = f'{pet.date_added.isoformat()}|{pet.id}'
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """Return ``(date_added, id)`` for a cursor, or ``None`` if it is invalid.
+
+    Cursors come back from the browser, so anything that doesn't decode to a
+    timestamp and a plausible id is treated as "no cursor".
+    """
+    if not cursor:
+        return None
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        raw = base64.urlsafe_b64decode(padded.encode()).decode()
+        date_part, id_part = raw.rsplit('|', 1)
+        date_added, pet_id = datetime.fromisoformat(date_part), int(id_part)
+    except (ValueError, UnicodeDecodeError):
+        return None
+    if not 0 < pet_id <= MAX_ID:
+        return None
+    if timezone.is_naive(date_added):
+        date_added = timezone.make_aware(date_added, dt_timezone.utc)
+    return date_added, pet_id
+
+
+def get_page_size(request):
+    """Read ``?page_size=`` from the request, clamped to ``MAX_PAGE_SIZE``."""
+    try:
+        size = int(request.GET.get('page_size', DEFAULT_PAGE_SIZE))
+    except (TypeError, ValueError):
+        size = DEFAULT_PAGE_SIZE
+    return max(1, min(size, MAX_PAGE_SIZE))
+
+
+class PetPage:
+    """One page of a keyset-paginated pet listing."""
+
+    def __init__(self, pets, next_cursor, page_size, is_first):
+        self.pets = pets
+        self.next_cursor = next_cursor
+        self.page_size = page_size
+        self.is_first = is_first
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+
+def paginate_pets(request, queryset):
+    """Return a :class:`PetPage` for ``queryset`` using ``?cursor=`` from the request.
+
+    ``queryset`` is reordered on ``(-date_added, -id)`` so the cursor is
+    stable even when several pets share the same timestamp. One extra row is
+    fetched to find out whether another page exists without a COUNT query.
+    """
+    page_size = get_page_size(request)
+    queryset = queryset.order_by('-date_added', '-id')
+
+    position = decode_cursor(request.GET.get('cursor'))
+    if position:
+        date_added, pet_id = position
+        queryset = queryset.filter(
+            Q(date_added__lt=date_added) | Q(date_added=date_added, id__lt=pet_id)
+        )
+
+    rows = list(queryset[:page_size + 1])
+    pets = rows[:page_size]
+    next_cursor = encode_cursor(pets[-1]) if len(rows) > page_size else None
+    return PetPage(pets, next_cursor, page_size, is_first=position is None)
+
+
+def list_filters(params):
+    """The visitor's ``?species=`` and ``?name=`` list filters, validated."""
+    species = params.get('species', '')
+    return {
+        'species': species if species in dict(Pet.SPECIES_CHOICES) else '',
+        'name': params.get('name', '').strip()[:50],
+    }
+
+
+def pet_list_context(request, queryset, page_title, filters=None):
+    """Build the template context shared by the pet listing pages.
+
+    ``filters`` are the field lookups ``queryset`` was built from. The
+    visitor's species and name filters are applied here, before paging, and
+    carried through the page links with every other query parameter.
+
+    ``facets`` counts the pets matching all of that, nearby search included;
+    ``species_facets`` counts the whole page type, for the species menu.
+    """
+    filters = filters or {}
+    chosen = list_filters(request.GET)
+    lookups = dict(filters)
+    if chosen['species']:
+        lookups['species'] = chosen['species']
+        queryset = queryset.filter(species=chosen['species'])
+    if chosen['name']:
+        lookups['name__icontains'] = chosen['name']
+        queryset = queryset.filter(name__icontains=chosen['name'])
+    near = parse_near(request.GET)
+    if near:
+        # "Near me"/"near <place>": nearest pets within the radius instead of
+        # the newest-first pages
+        lat, lon, radius = near
+        nearby = pets_near(lat, lon, radius, queryset)
+        pets, page = nearby[:get_page_size(request)], None
+        facets = count_facets(nearby)
+    else:
+        page = paginate_pets(request, queryset)
+        pets = page.pets
+        # Names are free text: caching each search would only fill the cache
+        facets = compute_facets(lookups) if chosen['name'] else pet_facets(lookups)
+    params = request.GET.copy()
+    params.pop('cursor', None)
+    return {
+        'pets': pets,
+        'page': page,
+        'near': {'lat': near[0], 'lon': near[1], 'radius': near[2]} if near else None,
+        'near_radius': round(near[2]) if near else DEFAULT_RADIUS_KM,
+        'near_radius_choices': RADIUS_CHOICES_KM,
+        'page_title': page_title,
+        'facets': facets,
+        'species_facets': pet_facets(filters),
+        'facet_filters': filters,
+        'list_filters': chosen,
+        # Query string for the page links: everything but the cursor
+        'page_query': params.urlencode(),
+    }
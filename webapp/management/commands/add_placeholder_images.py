@@ -1,81 +1,80 @@
+from collections import defaultdict
+
 from django.core.management.base import BaseCommand
+from webapp.image_engine import ImageEngine
 from webapp.models import Pet
-from django.core.files.base import ContentFile
 import requests
-from io import BytesIO
+
+# Free placeholder image services for different animals
+PLACEHOLDER_URLS = {
+    'dog': [
+        'https://place.dog/500/500',
+        'https://placedog.net/500/500?random=1',
+        'https://placedog.net/500/500?random=2',
+        'https://placedog.net/500/500?random=3',
+        'https://placedog.net/500/500?random=4',
+    ],
+    'cat': [
+        'https://placekitten.com/500/500',
+        'https://placekitten.com/g/500/500',
+        'https://placekitten.com/501/501',
+        'https://placekitten.com/502/502',
+        'https://placekitten.com/503/503',
+    ]
+}
+
+
+def download(url):
+    """Engine worker: the image at ``url`` as bytes."""
+    response = requests.get(url, timeout=10)
+    response.raise_for_status()
+    return response.content
+
 
 class Command(BaseCommand):
     help = 'Assign placeholder images to pets without images'
 
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=8, help='Parallel downloads')
+
     def handle(self, *args, **options):
-        # Free placeholder image services for different animals
-        placeholder_urls = {
-            'dog': [
-                'https://place.dog/500/500',
-                'https://placedog.net/500/500?random=1',
-                'https://placedog.net/500/500?random=2',
-                'https://placedog.net/500/500?random=3',
-                'https://placedog.net/500/500?random=4',
-            ],
-            'cat': [
-                'https://placekitten.com/500/500',
-                'https://placekitten.com/g/500/500',
-                'https://placekitten.com/501/501',
-                'https://placekitten.com/502/502',
-                'https://placekitten.com/503/503',
-            ]
-        }
-        
         # For birds and rabbits, we'll use simple color backgrounds with emojis
         # since there aren't good placeholder services for these
-        
-        updated_count = 0
-        
-        # Get pets without images
+        engine = ImageEngine(workers=options['workers'])
+
+        # Get pets without images; each placeholder URL is downloaded once
         pets_without_images = Pet.objects.filter(image__isnull=True) | Pet.objects.filter(image='')
-        
-        for pet in pets_without_images:
-            image_url = None
-            
-            # Get appropriate placeholder
-            if pet.species in placeholder_urls:
+        pets_by_url = defaultdict(list)
+        for pet in pets_without_images.only('id', 'name', 'species'):
+            urls = PLACEHOLDER_URLS.get(pet.species)
+            if urls:
                 # Use index to get different images for different pets
-                pet_index = pet.id % len(placeholder_urls[pet.species])
-                image_url = placeholder_urls[pet.species][pet_index]
-            
-            if image_url:
-                try:
-                    # Download image
-                    response = requests.get(image_url, timeout=10)
-                    if response.status_code == 200:
-                        # Create filename
-                        filename = f"{pet.species}_{pet.name.lower().replace(' ', '_')}_{pet.id}.jpg"
-                        
-                        # Save image to pet
-                        pet.image.save(
-                            filename,
-                            ContentFile(response.content),
-                            save=True
-                        )
-                        
-                        updated_count += 1
-                        self.stdout.write(f'Added placeholder image for {pet.name} ({pet.species})')
-                    else:
-                        self.stdout.write(
-                            self.style.WARNING(f'Failed to download image for {pet.name}: HTTP {response.status_code}')
-                        )
-                
-                except requests.RequestException as e:
-                    self.stdout.write(
-                        self.style.ERROR(f'Error downloading image for {pet.name}: {e}')
-                    )
-                except Exception as e:
-                    self.stdout.write(
-                        self.style.ERROR(f'Error updating {pet.name}: {e}')
-                    )
+                pets_by_url[urls[pet.id % len(urls)]].append(pet)
             else:
                 self.stdout.write(f'No placeholder available for {pet.name} ({pet.species})')
-        
+
+        names = []
+        updated_count = 0
+        for url, data, error in engine.map(download, pets_by_url, threads=True):
+            pets = pets_by_url[url]
+            if error:
+                for pet in pets:
+                    self.stdout.write(self.style.ERROR(f'Error downloading image for {pet.name}: {error}'))
+                continue
+            image_name = engine.store(data, 'jpg')
+            Pet.objects.filter(id__in=[pet.id for pet in pets]).update(image=image_name)
+            names.append(image_name)
+            updated_count += len(pets)
+            for pet in pets:
+                self.stdout.write(f'Added placeholder image for {pet.name} ({pet.species})')
+
+        self.stdout.write(f'Downloaded: {engine.stats}')
+        # update() skips the post_save signal that makes resized copies
+        stats, errors = engine.make_renditions(names)
+        for name, error in errors:
+            self.stdout.write(self.style.WARNING(f'No resized copies for {name}: {error}'))
+        self.stdout.write(f'Resized copies: {stats}')
+
         self.stdout.write(
             self.style.SUCCESS(f'Successfully added placeholder images for {updated_count} pets')
-        )
\ No newline at end of file
+        )
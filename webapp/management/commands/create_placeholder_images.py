@@ -1,79 +1,84 @@
+from collections import defaultdict
+from functools import lru_cache
+
 from django.core.management.base import BaseCommand
+from webapp.image_engine import ImageEngine, encode
 from webapp.models import Pet
 from PIL import Image, ImageDraw, ImageFont
-import os
-from django.conf import settings
+
+# Colors for different species
+COLORS = {
+    'dog': '#D2691E',      # SaddleBrown
+    'cat': '#708090',      # SlateGray
+    'bird': '#4169E1',     # RoyalBlue
+    'rabbit': '#F5DEB3'    # Wheat
+}
+
+
+@lru_cache(maxsize=None)
+def _font():
+    try:
+        # Try to use a basic font
+        return ImageFont.truetype("arial.ttf", 24)
+    except OSError:
+        # Fall back to default font
+        return ImageFont.load_default()
+
+
+def render_placeholder(spec):
+    """Engine worker: a 400x400 PNG with the pet's name, species and breed."""
+    name, species, breed = spec
+    img = Image.new('RGB', (400, 400), COLORS.get(species, '#808080'))
+    draw = ImageDraw.Draw(img)
+    font = _font()
+
+    text_lines = [name, f"({species.title()})", breed or "Mixed Breed"]
+    y_offset = 150
+    for line in text_lines:
+        # Center the text
+        bbox = draw.textbbox((0, 0), line, font=font)
+        x = (400 - (bbox[2] - bbox[0])) // 2
+        draw.text((x, y_offset), line, fill='white', font=font)
+        y_offset += 40
+    return encode(img, 'PNG')
+
 
 class Command(BaseCommand):
     help = 'Create simple placeholder images for pets without photos'
 
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=None, help='Worker processes (default: one per CPU)')
+
     def handle(self, *args, **options):
-        # Colors for different species
-        colors = {
-            'dog': '#D2691E',      # SaddleBrown
-            'cat': '#708090',      # SlateGray  
-            'bird': '#4169E1',     # RoyalBlue
-            'rabbit': '#F5DEB3'    # Wheat
-        }
-        
-        # Create media/pet_images directory if it doesn't exist
-        media_dir = os.path.join(settings.MEDIA_ROOT, 'pet_images')
-        os.makedirs(media_dir, exist_ok=True)
-        
-        created_count = 0
-        
-        # Get pets without images
+        engine = ImageEngine(workers=options['workers'])
+
+        # Pets without images; pets that would get identical placeholders
+        # (same name, species and breed) share one render and one file
         pets_without_images = Pet.objects.filter(image__isnull=True) | Pet.objects.filter(image='')
-        
-        for pet in pets_without_images:
-            try:
-                # Create a 400x400 placeholder image
-                img = Image.new('RGB', (400, 400), colors.get(pet.species, '#808080'))
-                draw = ImageDraw.Draw(img)
-                
-                # Add pet name and species text
-                try:
-                    # Try to use a basic font
-                    font = ImageFont.truetype("arial.ttf", 24)
-                except:
-                    # Fall back to default font
-                    font = ImageFont.load_default()
-                
-                # Add text
-                text_lines = [
-                    pet.name,
-                    f"({pet.species.title()})",
-                    pet.breed or "Mixed Breed"
-                ]
-                
-                y_offset = 150
-                for line in text_lines:
-                    # Get text size
-                    bbox = draw.textbbox((0, 0), line, font=font)
-                    text_width = bbox[2] - bbox[0]
-                    
-                    # Center the text
-                    x = (400 - text_width) // 2
-                    draw.text((x, y_offset), line, fill='white', font=font)
-                    y_offset += 40
-                
-                # Save image
-                filename = f"{pet.species}_{pet.name.lower().replace(' ', '_')}_{pet.id}.png"
-                filepath = os.path.join(media_dir, filename)
-                img.save(filepath)
-                
-                # Update pet with image path
-                pet.image = f'pet_images/{filename}'
-                pet.save()
-                
-                created_count += 1
-                self.stdout.write(f'Created placeholder for {pet.name} ({pet.species})')
-                
-            except Exception as e:
-                self.stdout.write(
-                    self.style.ERROR(f'Error creating image for {pet.name}: {e}')
-                )
-        
+        pets_by_spec = defaultdict(list)
+        for pet in pets_without_images.only('id', 'name', 'species', 'breed'):
+            pets_by_spec[pet.name, pet.species, pet.breed or ''].append(pet.id)
+
+        names = []
+        created_count = 0
+        for spec, data, error in engine.map(render_placeholder, pets_by_spec):
+            name, species, _ = spec
+            if error:
+                self.stdout.write(self.style.ERROR(f'Error creating image for {name}: {error}'))
+                continue
+            image_name = engine.store(data, 'png')
+            Pet.objects.filter(id__in=pets_by_spec[spec]).update(image=image_name)
+            names.append(image_name)
+            created_count += len(pets_by_spec[spec])
+            self.stdout.write(f'Created placeholder for {name} ({species})')
+
+        self.stdout.write(f'Rendered: {engine.stats}')
+        # update() skips the post_save signal that makes resized copies
+        stats, errors = engine.make_renditions(names)
+        for name, error in errors:
+            self.stdout.write(self.style.WARNING(f'No resized copies for {name}: {error}'))
+        self.stdout.write(f'Resized copies: {stats}')
+
         self.stdout.write(
             self.style.SUCCESS(f'Successfully created {created_count} placeholder images')
-        )
\ No newline at end of file
+        )
@@ -0,0 +1,30 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from webapp.image_engine import ImageEngine
+from webapp.storage import collect_garbage, rehash_files
+
+
+class Command(BaseCommand):
+    help = 'Delete pet images that no pet or registration request uses (run daily, e.g. from cron)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='List the files without deleting them')
+        parser.add_argument('--grace-hours', type=float, default=None,
+                            help='Keep files modified this recently (default: MEDIA_GC_GRACE_HOURS)')
+        parser.add_argument('--rehash', action='store_true',
+                            help='First move images with pre-hash names to content names, merging duplicates')
+
+    def handle(self, *args, **options):
+        if options['rehash'] and not options['dry_run']:
+            moved = rehash_files()
+            stats, _ = ImageEngine().make_renditions(moved.values())
+            self.stdout.write(f'Renamed {len(moved)} image(s) to {len(set(moved.values()))} content name(s); '
+                              f'resized copies: {stats}')
+
+        grace = None if options['grace_hours'] is None else timedelta(hours=options['grace_hours'])
+        deleted = collect_garbage(grace=grace, dry_run=options['dry_run'])
+        for name in deleted:
+            self.stdout.write(f'  {name}')
+        verb = 'Would delete' if options['dry_run'] else 'Deleted'
+        self.stdout.write(self.style.SUCCESS(f'{verb} {len(deleted)} unreferenced image(s)'))
@@ -0,0 +1,49 @@
+import re
+from collections import defaultdict
+
+from django.core.management.base import BaseCommand
+from chat.models import ChatMember, Conversation
+from webapp.admin_directory import admin_directory
+from webapp.models import Pet
+
+PET_TAG = re.compile(r'\(pet:(\d+)\)')
+
+
+class Command(BaseCommand):
+    help = 'Give pet conversations created before participant keys their key (run once after upgrading)'
+
+    def handle(self, *args, **options):
+        # Pet chats are keyed on the owner and the requester; the admins, who
+        # are members too, are told apart with the auth tables
+        convos = list(Conversation.objects.filter(participant_key__isnull=True, subject__contains='(pet:')
+                      .order_by('id'))
+        members = defaultdict(set)
+        for cid, uid in ChatMember.objects.filter(conversation_id__in=[c.id for c in convos]).values_list(
+                'conversation_id', 'user_id'):
+            members[cid].add(uid)
+        pet_ids = {int(match.group(1)) for match in map(PET_TAG.search, (c.subject for c in convos)) if match}
+        owners = dict(Pet.objects.filter(id__in=pet_ids).values_list('id', 'owner_id'))
+        staff_ids = admin_directory.staff_ids()
+
+        keyed, skipped = 0, []
+        for convo in convos:
+            match = PET_TAG.search(convo.subject)
+            pet_id = int(match.group(1)) if match else None
+            owner_id = owners.get(pet_id)
+            others = members[convo.id] - {owner_id}
+            # An admin asking about a pet is the requester if they are the only one
+            requesters = (others - staff_ids) or others
+            if owner_id is None or owner_id not in members[convo.id] or len(requesters) != 1:
+                skipped.append(convo.id)
+                continue
+            key = Conversation.participant_key_for([owner_id, *requesters], tag=f'pet:{pet_id}')
+            # The oldest conversation wins when several share a key
+            if Conversation.objects.filter(participant_key=key).exists():
+                skipped.append(convo.id)
+                continue
+            keyed += Conversation.objects.filter(id=convo.id, participant_key__isnull=True).update(participant_key=key)
+
+        if skipped:
+            self.stdout.write(self.style.WARNING(
+                f'Left {len(skipped)} conversation(s) without a key (IDs: {", ".join(map(str, skipped))})'))
+        self.stdout.write(self.style.SUCCESS(f'Keyed {keyed} pet conversation(s)'))
@@ -0,0 +1,56 @@
+import csv
+
+from django.core.management.base import BaseCommand, CommandError
+from webapp.geo import normalize_place
+from webapp.models import Pet, Place
+
+
+class Command(BaseCommand):
+    help = 'Load place names and coordinates (CSV with name,latitude,longitude) into the offline geocoding table'
+
+    def add_arguments(self, parser):
+        parser.add_argument('csv_path')
+        parser.add_argument('--geocode-pets', action='store_true',
+                            help='Geocode pets that have no coordinates yet afterwards')
+
+    def handle(self, *args, **options):
+        places, skipped = {}, []
+        try:
+            with open(options['csv_path'], newline='', encoding='utf-8') as handle:
+                reader = csv.DictReader(handle)
+                missing = {'name', 'latitude', 'longitude'} - set(reader.fieldnames or ())
+                if missing:
+                    raise CommandError(f'The CSV has no {", ".join(sorted(missing))} column(s)')
+                for row in reader:
+                    name = normalize_place(row['name'])
+                    if not name:
+                        continue
+                    try:
+                        latitude, longitude = float(row['latitude']), float(row['longitude'])
+                        valid = -90 <= latitude <= 90 and -180 <= longitude <= 180
+                    except (TypeError, ValueError):
+                        # Blank, non-numeric or missing on a short row
+                        valid = False
+                    if not valid:
+                        skipped.append(reader.line_num)
+                        continue
+                    # A later row for the same place wins
+                    places[name] = Place(name=name, display_name=row['name'].strip(),
+                                         latitude=latitude, longitude=longitude)
+        except (OSError, UnicodeDecodeError, csv.Error) as exc:
+            raise CommandError(exc)
+
+        if skipped:
+            self.stdout.write(self.style.WARNING(
+                f'Skipped {len(skipped)} row(s) without valid coordinates (lines: {", ".join(map(str, skipped))})'))
+        places = list(places.values())
+        Place.objects.bulk_create(places, update_conflicts=True, unique_fields=['name'],
+                                  update_fields=['display_name', 'latitude', 'longitude'])
+        self.stdout.write(self.style.SUCCESS(f'Loaded {len(places)} place(s)'))
+
+        if options['geocode_pets']:
+            located = 0
+            for pet in Pet.objects.filter(latitude__isnull=True):
+                pet.save(update_fields=['latitude', 'longitude'])
+                located += pet.geohash is not None
+            self.stdout.write(self.style.SUCCESS(f'Geocoded {located} pet(s)'))
@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+from webapp.image_engine import ImageEngine
+from webapp.models import Pet, PetRegistrationRequest
+
+
+class Command(BaseCommand):
+    help = 'Generate resized WebP/JPEG copies of existing pet photos'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--force', action='store_true',
+                            help='Regenerate renditions that already exist')
+        parser.add_argument('--workers', type=int, default=None,
+                            help='Worker processes (default: one per CPU)')
+
+    def handle(self, *args, **options):
+        names = set()
+        for model in (Pet, PetRegistrationRequest):
+            names.update(model.objects.exclude(image='').exclude(image__isnull=True)
+                         .values_list('image', flat=True))
+
+        stats, errors = ImageEngine(workers=options['workers']).make_renditions(names, force=options['force'])
+        for name, error in errors:
+            self.stdout.write(self.style.WARNING(f'Skipped {name}: {error}'))
+        self.stdout.write(self.style.SUCCESS(f'Processed {len(names)} photo(s): {stats}'))
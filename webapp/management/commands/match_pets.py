@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+from webapp.matching import rebuild_matches
+
+
+class Command(BaseCommand):
+    help = 'Rebuild lost/found pet matches from scratch (run nightly, e.g. from cron)'
+
+    def handle(self, *args, **options):
+        count = rebuild_matches()
+        self.stdout.write(self.style.SUCCESS(f'Stored {count} lost/found match(es)'))
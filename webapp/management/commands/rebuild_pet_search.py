@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+from webapp.search import get_search_backend
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the pet search index from the pet table'
+
+    def handle(self, *args, **options):
+        backend = get_search_backend()
+        backend.rebuild()
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt pet search index ({type(backend).__name__})'))
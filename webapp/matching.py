@@ -0,0 +1,191 @@
+"""
+Automatic matching of lost pets with found reports.
+
+Every lost/found pair that could be the same animal is stored as a
+``PetMatch`` with a 0-1 score, so ``pet_detail`` lists likely matches with a
+single query.
+
+Comparing every lost pet with every found pet is quadratic, so candidates are
+blocked first. Only pets of the same species are compared. They must also be
+within ``PET_MATCH_RADIUS_KM`` of each other (geohash cells, as in
+webapp.geo), or share the same location text when either has no coordinates.
+``score_pair`` then rejects pairs reported more than ``PET_MATCH_WINDOW_DAYS``
+apart or with conflicting genders, and scores the rest on breed, color,
+distance, gender and date.
+
+One pet's matches are refreshed whenever it is saved (``refresh_matches``,
+from webapp.signals). The nightly ``match_pets`` command rebuilds the whole
+table with ``rebuild_matches``, blocking in memory. That also drops matches
+left behind by bulk status updates such as the found-to-adoption sweep.
+"""
+
+import re
+from bisect import bisect_left
+from collections import defaultdict
+from functools import lru_cache
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+
+from .geo import _PREFIX_END, covering_cells, haversine_km, pets_near
+from .models import Pet, PetMatch
+
+RADIUS_KM = getattr(settings, 'PET_MATCH_RADIUS_KM', 50)
+WINDOW_DAYS = getattr(settings, 'PET_MATCH_WINDOW_DAYS', 30)
+MIN_SCORE = getattr(settings, 'PET_MATCH_MIN_SCORE', 0.5)
+
+OPPOSITE = {'lost': 'found', 'found': 'lost'}
+WEIGHTS = {'breed': 3.0, 'color': 3.0, 'location': 3.0, 'gender': 1.0, 'date': 1.0}
+# Saving any other field can't change a pet's matches
+MATCH_FIELDS = frozenset({'status', 'species', 'breed', 'color', 'gender', 'location',
+                          'latitude', 'longitude', 'found_date'})
+# Only what scoring needs, for the batch rebuild
+_SCORE_FIELDS = ('id', 'species', 'status', 'breed', 'color', 'gender', 'location',
+                 'latitude', 'longitude', 'geohash', 'date_added', 'found_date')
+
+_STOPWORDS = frozenset({'and', 'with', 'mix', 'mixed', 'cross', 'unknown'})
+
+
+@lru_cache(maxsize=4096)
+def _words(text):
+    return frozenset(word for word in re.findall(r'[a-z]+', (text or '').lower()) if word not in _STOPWORDS)
+
+
+def similarity(a, b):
+    """Share of the shorter description's words found in the other.
+
+    Words match on a shared prefix ("lab" ~ "labrador"). Returns 0.5 when
+    either side is blank: unknown is neither evidence for nor against.
+    """
+    a, b = _words(a), _words(b)
+    if not a or not b:
+        return 0.5
+    if len(a) > len(b):
+        a, b = b, a
+    hits = sum(any(x.startswith(y) or y.startswith(x) for y in b if min(len(x), len(y)) >= 3 or x == y) for x in a)
+    return hits / len(a)
+
+
+def _reported_at(pet):
+    return (pet.status == 'found' and pet.found_date) or pet.date_added
+
+
+def _location_key(pet):
+    return (pet.location or '').strip().lower()
+
+
+def score_pair(lost, found):
+    """Score a lost/found pair as an unsaved ``PetMatch``.
+
+    Returns ``None`` if they can't be the same animal.
+    """
+    if lost.species != found.species or {lost.gender, found.gender} == {'male', 'female'}:
+        return None
+    days = abs((_reported_at(found) - _reported_at(lost)).total_seconds()) / 86400
+    if days > WINDOW_DAYS:
+        return None
+
+    distance = None
+    if lost.geohash and found.geohash:
+        distance = haversine_km(lost.latitude, lost.longitude, found.latitude, found.longitude)
+        if distance > RADIUS_KM:
+            return None
+        location = 1 - distance / RADIUS_KM
+    elif _location_key(lost) == _location_key(found):
+        # Same place name, but no coordinates to say how close
+        location = 0.5
+    else:
+        return None
+
+    parts = {
+        'breed': similarity(lost.breed, found.breed),
+        'color': similarity(lost.color, found.color),
+        'location': location,
+        'gender': 1.0 if lost.gender == found.gender != 'unknown' else 0.5,
+        'date': 1 - days / WINDOW_DAYS,
+    }
+    score = sum(WEIGHTS[part] * value for part, value in parts.items()) / sum(WEIGHTS.values())
+    reasons = [part for part in ('breed', 'color', 'gender') if parts[part] == 1.0]
+    reasons.append(f'{distance:.0f} km' if distance is not None else 'same area')
+    return PetMatch(lost=lost, found=found, score=round(score, 3), distance_km=distance,
+                    reasons=', '.join(reasons))
+
+
+def candidates_for(pet):
+    """Pets of the opposite status that pass the blocking keys for ``pet``."""
+    window = timedelta(days=WINDOW_DAYS)
+    start, end = _reported_at(pet) - window, _reported_at(pet) + window
+    queryset = Pet.objects.filter(species=pet.species, status=OPPOSITE[pet.status]).exclude(id=pet.id)
+    if pet.status == 'lost':
+        queryset = queryset.filter(Q(found_date__range=(start, end))
+                                   | Q(found_date__isnull=True, date_added__range=(start, end)))
+    else:
+        queryset = queryset.filter(date_added__range=(start, end))
+
+    same_place = queryset.filter(location__iexact=(pet.location or '').strip())
+    if not pet.geohash:
+        return list(same_place)
+    return pets_near(pet.latitude, pet.longitude, RADIUS_KM, queryset) + list(same_place.filter(geohash__isnull=True))
+
+
+def refresh_matches(pet):
+    """Recompute the matches of one pet; returns the new ``PetMatch`` rows."""
+    matches = []
+    if pet.status in OPPOSITE:
+        for candidate in candidates_for(pet):
+            pair = (pet, candidate) if pet.status == 'lost' else (candidate, pet)
+            match = score_pair(*pair)
+            if match and match.score >= MIN_SCORE:
+                matches.append(match)
+    with transaction.atomic():
+        PetMatch.objects.filter(Q(lost=pet) | Q(found=pet)).delete()
+        PetMatch.objects.bulk_create(matches)
+    return matches
+
+
+def rebuild_matches():
+    """Recompute every match from scratch; returns the number stored.
+
+    Found pets are bucketed by species into geohash-sorted lists and by
+    location text. Each lost pet is compared only with the found pets in its
+    covering cells (bisected like the index range scans) and, where
+    coordinates are missing, at its place.
+    """
+    found_by_cell = defaultdict(list)
+    found_by_place = defaultdict(list)
+    unlocated_by_place = defaultdict(list)
+    for pet in Pet.objects.filter(status='found').only(*_SCORE_FIELDS):
+        key = pet.species, _location_key(pet)
+        found_by_place[key].append(pet)
+        if pet.geohash:
+            found_by_cell[pet.species].append(pet)
+        else:
+            unlocated_by_place[key].append(pet)
+    hashes = {}
+    for species, pets in found_by_cell.items():
+        pets.sort(key=lambda pet: pet.geohash)
+        hashes[species] = [pet.geohash for pet in pets]
+
+    matches = []
+    for lost in Pet.objects.filter(status='lost').only(*_SCORE_FIELDS).iterator():
+        # Same blocks as candidates_for(): located pets by cell plus unlocated
+        # ones by place, or everything at the place for an unlocated pet
+        key = lost.species, _location_key(lost)
+        by_place = unlocated_by_place if lost.geohash else found_by_place
+        candidates = {pet.id: pet for pet in by_place.get(key, ())}
+        if lost.geohash and lost.species in hashes:
+            cells, keys = found_by_cell[lost.species], hashes[lost.species]
+            for prefix in covering_cells(lost.latitude, lost.longitude, RADIUS_KM):
+                low, high = bisect_left(keys, prefix), bisect_left(keys, prefix + _PREFIX_END)
+                candidates.update((pet.id, pet) for pet in cells[low:high])
+        for candidate in candidates.values():
+            match = score_pair(lost, candidate)
+            if match and match.score >= MIN_SCORE:
+                matches.append(match)
+
+    with transaction.atomic():
+        PetMatch.objects.all().delete()
+        PetMatch.objects.bulk_create(matches, batch_size=500)
+    return len(matches)
@@ -0,0 +1,138 @@
+"""
+Serving uploaded media (pet photos and their renditions) from the app.
+
+Content-hashed files (webapp.storage) never change under the same URL. They
+are sent with a year-long ``Cache-Control: immutable``, so browsers and CDNs
+don't even revalidate, and their ``ETag`` is the hash itself. Renditions
+(webapp.images) keep their names when regenerated with other settings, and
+other files, such as older uploads not yet moved with ``gc_media --rehash``,
+can change too; they are cached for ``MEDIA_CACHE_MAX_AGE`` seconds and then
+revalidated against an ``ETag`` from their modification time and size.
+
+Responses carry an ``ETag`` and ``Last-Modified`` and answer conditional
+requests with 304. They also honour single ``Range`` requests. The body is a
+``FileResponse`` over the open file, which gunicorn sends with
+``sendfile()`` (zero-copy) rather than reading it through Python.
+"""
+
+import mimetypes
+import os
+import re
+
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation
+from django.core.files.storage import default_storage
+from django.http import FileResponse, Http404, HttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+from django.views.decorators.http import require_safe
+
+from .images import THUMBS_DIR
+from .storage import is_hashed
+
+IMMUTABLE = 'public, max-age=31536000, immutable'
+MAX_AGE = getattr(settings, 'MEDIA_CACHE_MAX_AGE', 3600)
+RANGE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+def is_immutable(name):
+    """Whether ``name`` is a content-addressed original (renditions are not)."""
+    return not name.startswith(f'{THUMBS_DIR}/') and is_hashed(name)
+
+
+def etag_for(name, stat):
+    """The content hash for content-addressed originals, else mtime and size."""
+    if is_immutable(name):
+        return f'"{os.path.splitext(os.path.basename(name))[0]}"'
+    return f'"{stat.st_mtime_ns:x}-{stat.st_size:x}"'
+
+
+def parse_range(header, size):
+    """``(start, end)`` (inclusive) of a single-range ``Range`` header.
+
+    ``None`` means serve the whole file (no header, or one we don't handle,
+    such as multiple ranges); ``ValueError`` means it can't be satisfied.
+    """
+    match = RANGE.match(header.strip()) if header else None
+    if not match or match.groups() == ('', ''):
+        return None
+    first, last = match.groups()
+    if not first:
+        # Suffix range: the last N bytes
+        start, end = max(0, size - int(last)), size - 1
+    else:
+        start, end = int(first), min(int(last), size - 1) if last else size - 1
+    if start > end or start >= size:
+        raise ValueError(header)
+    return start, end
+
+
+class FileRange:
+    """Up to ``length`` bytes of an open file, from its current position.
+
+    Keeps ``fileno()`` so gunicorn can still ``sendfile()`` it; gunicorn stops
+    at the response's Content-Length, and ``read()`` does the same for
+    servers that copy.
+    """
+
+    def __init__(self, file, length):
+        self.file, self.remaining = file, length
+
+    def fileno(self):
+        return self.file.fileno()
+
+    def read(self, size=-1):
+        size = self.remaining if size is None or size < 0 else min(size, self.remaining)
+        data = self.file.read(size) if size else b''
+        self.remaining -= len(data)
+        return data
+
+    def close(self):
+        self.file.close()
+
+
+@require_safe
+def serve_media(request, path):
+    try:
+        full_path = default_storage.path(path)
+        stat = os.stat(full_path)
+    except (SuspiciousFileOperation, NotImplementedError, OSError):
+        raise Http404('No such file')
+    if not os.path.isfile(full_path):
+        raise Http404('No such file')
+
+    etag = etag_for(path, stat)
+    headers = {
+        'ETag': etag,
+        'Last-Modified': http_date(stat.st_mtime),
+        'Cache-Control': IMMUTABLE if is_immutable(path) else f'public, max-age={MAX_AGE}',
+        'Accept-Ranges': 'bytes',
+    }
+    not_modified = get_conditional_response(request, etag=etag, last_modified=int(stat.st_mtime))
+    if not_modified is not None:
+        for header, value in headers.items():
+            not_modified.headers.setdefault(header, value)
+        return not_modified
+
+    size = stat.st_size
+    content_range = None
+    # If-Range: only send the part if the client's copy is still current
+    if_range = request.headers.get('If-Range')
+    if not if_range or if_range == etag:
+        try:
+            content_range = parse_range(request.headers.get('Range'), size)
+        except ValueError:
+            return HttpResponse(status=416, headers={**headers, 'Content-Range': f'bytes */{size}'})
+
+    start, end = content_range or (0, size - 1)
+    length = end - start + 1 if size else 0
+    headers['Content-Length'] = str(length)
+    if content_range:
+        headers['Content-Range'] = f'bytes {start}-{end}/{size}'
+    status = 206 if content_range else 200
+    content_type = mimetypes.guess_type(full_path)[0] or 'application/octet-stream'
+    if request.method == 'HEAD':
+        return HttpResponse(status=status, content_type=content_type, headers=headers)
+    handle = open(full_path, 'rb')
+    handle.seek(start)
+    return FileResponse(FileRange(handle, length), status=status, content_type=content_type, headers=headers)
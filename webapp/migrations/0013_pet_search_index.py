@@ -0,0 +1,53 @@
+from django.db import migrations
+
+FTS_TABLE = 'webapp_pet_fts'
+COLUMNS = 'name, breed, color, location, description'
+NEW_VALUES = 'new.id, new.name, new.breed, new.color, new.location, new.description'
+OLD_VALUES = "'delete', old.id, old.name, old.breed, old.color, old.location, old.description"
+
+CREATE = [
+    # External-content FTS5 table: the text lives only in webapp_pet
+    f"CREATE VIRTUAL TABLE {FTS_TABLE} USING fts5({COLUMNS}, content='webapp_pet', content_rowid='id', "
+    f"tokenize='unicode61 remove_diacritics 2')",
+    f"CREATE TRIGGER {FTS_TABLE}_ai AFTER INSERT ON webapp_pet BEGIN "
+    f"INSERT INTO {FTS_TABLE}(rowid, {COLUMNS}) VALUES ({NEW_VALUES}); END",
+    f"CREATE TRIGGER {FTS_TABLE}_ad AFTER DELETE ON webapp_pet BEGIN "
+    f"INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, {COLUMNS}) VALUES ({OLD_VALUES}); END",
+    f"CREATE TRIGGER {FTS_TABLE}_au AFTER UPDATE OF {COLUMNS} ON webapp_pet BEGIN "
+    f"INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, {COLUMNS}) VALUES ({OLD_VALUES}); "
+    f"INSERT INTO {FTS_TABLE}(rowid, {COLUMNS}) VALUES ({NEW_VALUES}); END",
+    f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES('rebuild')",
+]
+
+DROP = [
+    f'DROP TRIGGER IF EXISTS {FTS_TABLE}_ai',
+    f'DROP TRIGGER IF EXISTS {FTS_TABLE}_ad',
+    f'DROP TRIGGER IF EXISTS {FTS_TABLE}_au',
+    f'DROP TABLE IF EXISTS {FTS_TABLE}',
+]
+
+
+def create_search_index(apps, schema_editor):
+    # Only SQLite gets the FTS5 index; other databases use the basic backend
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    for statement in CREATE:
+        schema_editor.execute(statement)
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    for statement in DROP:
+        schema_editor.execute(statement)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('webapp', '0012_notificationcounter'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,79 @@
+import csv
+import re
+from pathlib import Path
+
+from django.db import migrations
+
+PLACES_CSV = Path(__file__).resolve().parent.parent / 'data' / 'places.csv'
+
+# Copies of the webapp.geo helpers as they were when this migration was
+# written, so later changes there can't change what it does
+BASE32 = '0123456789bcdefghjkmnpqrstuvwxyz'
+PLACE_SPLIT = re.compile(r'[,/;|]+')
+
+
+def encode_geohash(lat, lon, precision=9):
+    lat_range, lon_range = [-90.0, 90.0], [-180.0, 180.0]
+    chars, bits, bit_count, even = [], 0, 0, True
+    while len(chars) < precision:
+        rng, value = (lon_range, lon) if even else (lat_range, lat)
+        mid = (rng[0] + rng[1]) / 2
+        bits <<= 1
+        if value >= mid:
+            bits |= 1
+            rng[0] = mid
+        else:
+            rng[1] = mid
+        even = not even
+        bit_count += 1
+        if bit_count == 5:
+            chars.append(BASE32[bits])
+            bits, bit_count = 0, 0
+    return ''.join(chars)
+
+
+def normalize_place(name):
+    return ' '.join(re.findall(r'\w+', (name or '').lower()))
+
+
+def seed_places(apps, schema_editor):
+    Place = apps.get_model('webapp', 'Place')
+    db = schema_editor.connection.alias
+    with open(PLACES_CSV, newline='', encoding='utf-8') as handle:
+        rows = list(csv.DictReader(handle))
+    Place.objects.using(db).bulk_create([
+        Place(name=normalize_place(row['name']), display_name=row['name'],
+              latitude=float(row['latitude']), longitude=float(row['longitude']))
+        for row in rows
+    ], ignore_conflicts=True)
+
+
+def geocode_pets(apps, schema_editor):
+    # Same lookup as webapp.geo.geocode, against the historical models
+    Place = apps.get_model('webapp', 'Place')
+    Pet = apps.get_model('webapp', 'Pet')
+    db = schema_editor.connection.alias
+    places = {p.name: (p.latitude, p.longitude) for p in Place.objects.using(db).all()}
+    updated = []
+    for pet in Pet.objects.using(db).filter(latitude__isnull=True).only('id', 'location'):
+        parts = [pet.location] + PLACE_SPLIT.split(pet.location)
+        for part in parts:
+            point = places.get(normalize_place(part))
+            if point:
+                pet.latitude, pet.longitude = point
+                pet.geohash = encode_geohash(*point)
+                updated.append(pet)
+                break
+    Pet.objects.using(db).bulk_update(updated, ['latitude', 'longitude', 'geohash'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('webapp', '0014_pet_coordinates_place'),
+    ]
+
+    operations = [
+        migrations.RunPython(seed_places, migrations.RunPython.noop),
+        migrations.RunPython(geocode_pets, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 5.2.6 on 2026-10-18 04:24
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('webapp', '0015_seed_places'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PetMatch',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('score', models.FloatField(help_text='0-1, higher is a better match')),
+                ('distance_km', models.FloatField(blank=True, null=True)),
+                ('reasons', models.CharField(blank=True, help_text="What matched, e.g. 'breed, color, 3 km'", max_length=200)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('found', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='lost_matches', to='webapp.pet')),
+                ('lost', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='found_matches', to='webapp.pet')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['lost', '-score'], name='petmatch_lost_score_idx'), models.Index(fields=['found', '-score'], name='petmatch_found_score_idx')],
+                'constraints': [models.UniqueConstraint(fields=('lost', 'found'), name='petmatch_unique_pair')],
+            },
+        ),
+    ]
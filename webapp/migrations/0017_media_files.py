@@ -0,0 +1,38 @@
+# Generated by Django 5.2.6 on 2026-10-18 04:53
+
+from collections import Counter
+
+from django.db import migrations, models
+
+
+def count_references(apps, schema_editor):
+    # Same as webapp.storage.recount_references, against the historical models
+    MediaFile = apps.get_model('webapp', 'MediaFile')
+    db = schema_editor.connection.alias
+    refs = Counter()
+    for model_name in ('Pet', 'PetRegistrationRequest'):
+        model = apps.get_model('webapp', model_name)
+        refs.update(model.objects.using(db).exclude(image='').exclude(image__isnull=True)
+                    .values_list('image', flat=True))
+    MediaFile.objects.using(db).bulk_create(
+        [MediaFile(name=name, refs=count) for name, count in refs.items()], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('webapp', '0016_pet_matches'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MediaFile',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=255, unique=True)),
+                ('refs', models.PositiveIntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.RunPython(count_references, migrations.RunPython.noop),
+    ]
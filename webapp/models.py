@@ -1,4 +1,4 @@
-from django.db import models
+from django.db import models, transaction
 from django.contrib.auth.models import User
 from django.utils import timezone
 from datetime import timedelta
@@ -70,23 +70,90 @@ class Pet(models.Model):
     image = models.ImageField(upload_to='pet_images/', blank=True, null=True)
     date_added = models.DateTimeField(auto_now_add=True)
     found_date = models.DateTimeField(null=True, blank=True, help_text="Date when the pet was found")
+    # Optional coordinates (entered, or geocoded from ``location``) and their
+    # geohash for nearby searches (see webapp.geo)
+    latitude = models.FloatField(null=True, blank=True)
+    longitude = models.FloatField(null=True, blank=True)
+    geohash = models.CharField(max_length=12, null=True, blank=True, editable=False)
+
+    class Meta:
+        indexes = [
+            # Home page: newest first across all statuses (keyset on date_added, id)
+            models.Index(fields=['date_added', 'id'], name='pet_added_idx'),
+            # Adoption/lost/found lists: filter on status, newest first
+            models.Index(fields=['status', 'date_added', 'id'], name='pet_status_added_idx'),
+            # pet_detail "similar pets"
+            models.Index(fields=['species', 'status'], name='pet_species_status_idx'),
+            # Found-to-adoption sweep
+            models.Index(fields=['status', 'found_date'], name='pet_status_found_idx'),
+            # Nearby lost/found pets: geohash prefix range scans per status
+            models.Index(fields=['status', 'geohash'], name='pet_status_geohash_idx'),
+            # Facet counts (webapp.facets): grouped straight from the index
+            models.Index(fields=['status', 'species', 'gender', 'location'], name='pet_facet_idx'),
+        ]
     
     def __str__(self):
         return f"{self.name} ({self.get_status_display()})"
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_location = instance.__dict__.get('location')
+        return instance
+
+    def locate(self):
+        """Fill in coordinates and geohash before saving.
+
+        Coordinates are geocoded from ``location`` when missing, or again when
+        the location text was edited; a pet with no match has no geohash and
+        simply doesn't appear in nearby searches.
+        """
+        from .geo import encode_geohash, geocode
+        loaded = getattr(self, '_loaded_location', self.location)
+        if loaded != self.location:
+            self.latitude = self.longitude = None
+        if self.latitude is None or self.longitude is None:
+            point = geocode(self.location)
+            self.latitude, self.longitude = point if point else (None, None)
+        if self.latitude is not None and self.longitude is not None:
+            self.geohash = encode_geohash(self.latitude, self.longitude)
+        else:
+            self.geohash = None
+        self._loaded_location = self.location
+
+    def save(self, *args, **kwargs):
+        update_fields = kwargs.get('update_fields')
+        if update_fields is None or {'location', 'latitude', 'longitude'} & set(update_fields):
+            self.locate()
+            if update_fields is not None:
+                kwargs['update_fields'] = set(update_fields) | {'latitude', 'longitude', 'geohash'}
+        super().save(*args, **kwargs)
+
+    def nearby_pets(self, status, radius_km=None, limit=6):
+        """Other pets with ``status`` near this one, nearest first."""
+        from .geo import DEFAULT_RADIUS_KM, pets_near
+        if self.geohash is None:
+            return []
+        queryset = Pet.objects.filter(status=status).exclude(id=self.id)
+        return pets_near(self.latitude, self.longitude, radius_km or DEFAULT_RADIUS_KM, queryset, limit)
     
-    def should_move_to_adoption(self):
-        """Check if found pet should be moved to adoption after 15 days"""
-        if self.status == 'found' and self.found_date:
-            return timezone.now() >= self.found_date + timedelta(days=15)
-        return False
-    
-    def auto_move_to_adoption(self):
-        """Automatically move found pets to adoption after 15 days"""
-        if self.should_move_to_adoption():
-            self.status = 'for_adoption'
-            self.save()
-            return True
-        return False
+    # Found pets are held this many days for their family before adoption
+    FOUND_HOLD_DAYS = 15
+
+    @classmethod
+    def move_found_to_adoption(cls, now=None):
+        """Move every found pet past its hold period to adoption in one UPDATE.
+
+        Returns the list of moved pet ids. The selected rows are locked (where
+        the database supports it) so the reported ids match what was updated.
+        """
+        cutoff = (now or timezone.now()) - timedelta(days=cls.FOUND_HOLD_DAYS)
+        due = cls.objects.filter(status='found', found_date__lte=cutoff)
+        with transaction.atomic():
+            pet_ids = list(due.select_for_update().values_list('id', flat=True))
+            if pet_ids:
+                due.filter(id__in=pet_ids).update(status='for_adoption')
+        return pet_ids
 
 class PetRegistrationRequest(models.Model):
     STATUS_CHOICES = [
@@ -127,6 +194,9 @@ class PetRegistrationRequest(models.Model):
     gender = models.CharField(max_length=10, choices=GENDER_CHOICES, default='unknown')
     pet_status = models.CharField(max_length=15, choices=PET_STATUS_CHOICES, default='for_adoption')
     location = models.CharField(max_length=100)
+    # Optional point picked by the reporter ("use my location")
+    latitude = models.FloatField(null=True, blank=True)
+    longitude = models.FloatField(null=True, blank=True)
     description = models.TextField(blank=True, null=True)
     contact_email = models.EmailField(blank=True, null=True)
     contact_phone = models.CharField(max_length=15, blank=True, null=True)
@@ -158,6 +228,8 @@ class PetRegistrationRequest(models.Model):
                 gender=self.gender,
                 status=self.pet_status,
                 location=self.location,
+                latitude=self.latitude,
+                longitude=self.longitude,
                 description=self.description,
                 contact_email=self.contact_email or self.user.email,
                 contact_phone=self.contact_phone,
@@ -197,6 +269,11 @@ class AdoptionRequest(models.Model):
     message = models.TextField(blank=True, null=True)
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['pet', 'user', 'status'], name='adoptreq_pet_user_status_idx'),
+        ]
+
     def __str__(self):
         return f"{self.user.username} requests {self.pet.name} ({self.status})"
 
@@ -213,7 +290,95 @@ class Notification(models.Model):
 
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            # Partial index: Django renders ``unread=True`` as a bare ``"unread"``
+            # predicate, which SQLite can only match against an index condition.
+            models.Index(fields=['user', 'created_at'], name='notif_user_unread_idx', condition=models.Q(unread=True)),
+        ]
 
     def __str__(self):
         return f"Notification to {self.user.username}: {self.verb}"
 
+
+class NotificationCounter(models.Model):
+    """Denormalized unread notification count per user.
+
+    Kept in step with Notification by webapp.notifications so templates can
+    show the badge with a primary-key lookup instead of a COUNT(*).
+    """
+    user = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True, related_name='notification_counter')
+    unread = models.PositiveIntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.user_id}: {self.unread} unread"
+
+
+class Place(models.Model):
+    """Offline geocoding table: a normalized place name and its coordinates."""
+    name = models.CharField(max_length=100, unique=True, help_text="Lower-case words, e.g. 'navi mumbai'")
+    display_name = models.CharField(max_length=100)
+    latitude = models.FloatField()
+    longitude = models.FloatField()
+
+    def __str__(self):
+        return self.display_name
+
+
+class PetMatch(models.Model):
+    """A scored candidate pairing of a lost pet with a found pet (see webapp.matching)."""
+    lost = models.ForeignKey(Pet, on_delete=models.CASCADE, related_name='found_matches')
+    found = models.ForeignKey(Pet, on_delete=models.CASCADE, related_name='lost_matches')
+    score = models.FloatField(help_text="0-1, higher is a better match")
+    distance_km = models.FloatField(null=True, blank=True)
+    reasons = models.CharField(max_length=200, blank=True, help_text="What matched, e.g. 'breed, color, 3 km'")
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['lost', 'found'], name='petmatch_unique_pair'),
+        ]
+        indexes = [
+            # pet_detail: best matches for one pet, from either side
+            models.Index(fields=['lost', '-score'], name='petmatch_lost_score_idx'),
+            models.Index(fields=['found', '-score'], name='petmatch_found_score_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.lost_id} <-> {self.found_id} ({self.score:.2f})"
+
+    @classmethod
+    def for_pet(cls, pet, limit=6):
+        """Best current matches for a lost or found pet, as the other pets.
+
+        One joined query; each returned pet carries its ``match``. Pets that
+        have since changed status (reunited, moved to adoption) are skipped.
+        """
+        if pet.status == 'lost':
+            mine, other = 'lost', 'found'
+        elif pet.status == 'found':
+            mine, other = 'found', 'lost'
+        else:
+            return []
+        rows = (cls.objects.filter(**{mine: pet, f'{other}__status': other})
+                .select_related(other).order_by('-score', f'{other}_id')[:limit])
+        pets = []
+        for match in rows:
+            other_pet = getattr(match, other)
+            other_pet.match = match
+            other_pet.distance_km = match.distance_km
+            pets.append(other_pet)
+        return pets
+
+
+class MediaFile(models.Model):
+    """How many pets and registration requests use a stored image (see webapp.storage).
+
+    Files are shared by content, so one is only deleted, by ``gc_media``,
+    once nothing references it.
+    """
+    name = models.CharField(max_length=255, unique=True)
+    refs = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.name} ({self.refs} refs)"
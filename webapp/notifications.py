@@ -0,0 +1,109 @@
+"""
+Helpers for the in-app notification system.
+
+The unread badge shown on every page reads from NotificationCounter instead of
+counting Notification rows. Counters are adjusted with single atomic UPDATEs
+and lazily (re)built from the Notification table the first time a user is seen.
+Saving or deleting a Notification adjusts them through signals; code that
+changes ``unread`` with a bulk ``update()`` must adjust them itself, as
+``mark_read`` does, or call ``rebuild_unread_count``.
+
+``notify_many`` fans a notification out to many users with one INSERT, inside
+the caller's request and transaction, so it is never lost to a restart.
+"""
+
+from django.db import IntegrityError, transaction
+from django.db.models import F
+
+from .models import Notification, NotificationCounter
+
+
+def _count_unread(user_id):
+    return Notification.objects.filter(user_id=user_id, unread=True).count()
+
+
+def get_unread_count(user):
+    """Return the unread notification count for ``user`` (one PK lookup)."""
+    unread = (NotificationCounter.objects
+              .filter(user_id=user.id)
+              .values_list('unread', flat=True)
+              .first())
+    if unread is None:
+        unread = rebuild_unread_count(user.id)
+    return unread
+
+
+def rebuild_unread_count(user_id):
+    """Recompute a user's counter from the Notification table and store it."""
+    unread = _count_unread(user_id)
+    NotificationCounter.objects.update_or_create(user_id=user_id, defaults={'unread': unread})
+    return unread
+
+
+def adjust_unread_count(user_id, delta):
+    """Atomically add ``delta`` (may be negative) to a user's unread counter."""
+    if not delta:
+        return
+    counters = NotificationCounter.objects.filter(user_id=user_id)
+    if delta < 0:
+        # Never drive the counter below zero; if it would, it has drifted
+        # (or was never seeded) and is rebuilt on the next read.
+        if not counters.filter(unread__gte=-delta).update(unread=F('unread') + delta):
+            counters.delete()
+        return
+    updated = counters.update(unread=F('unread') + delta)
+    if not updated:
+        # First notification for this user: seed the counter from the table,
+        # which already includes the rows that triggered this call.
+        try:
+            with transaction.atomic():
+                NotificationCounter.objects.create(user_id=user_id, unread=_count_unread(user_id))
+        except IntegrityError:
+            # Another request seeded the counter concurrently; recount so our
+            # rows are neither missed nor counted twice.
+            rebuild_unread_count(user_id)
+
+
+def mark_read(notification):
+    """Mark ``notification`` read, decrementing the counter only if it was unread."""
+    changed = Notification.objects.filter(id=notification.id, unread=True).update(unread=False)
+    if changed:
+        adjust_unread_count(notification.user_id, -changed)
+    notification.unread = False
+    return bool(changed)
+
+
+def _recipient_ids(recipients):
+    """Accept users, user ids or a queryset of either and return unique ids."""
+    ids = []
+    seen = set()
+    for recipient in recipients:
+        user_id = getattr(recipient, 'pk', recipient)
+        if user_id is not None and user_id not in seen:
+            seen.add(user_id)
+            ids.append(user_id)
+    return ids
+
+
+def _create_notifications(user_ids, verb, message, url, actor_id):
+    with transaction.atomic():
+        Notification.objects.bulk_create([
+            Notification(user_id=user_id, actor_id=actor_id, verb=verb, message=message, url=url)
+            for user_id in user_ids
+        ])
+        # bulk_create skips post_save, so bump the counters here in one UPDATE.
+        # Users without a counter row are seeded from the table on first read.
+        NotificationCounter.objects.filter(user_id__in=user_ids).update(unread=F('unread') + 1)
+    return len(user_ids)
+
+
+def notify_many(recipients, verb, message='', url='', actor=None):
+    """Create one notification per recipient using a single bulk INSERT.
+
+    ``recipients`` may be users, user ids or a queryset. Returns the number of
+    notifications created.
+    """
+    user_ids = _recipient_ids(recipients)
+    if not user_ids:
+        return 0
+    return _create_notifications(user_ids, verb, message, url, getattr(actor, 'pk', actor))
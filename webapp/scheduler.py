@@ -0,0 +1,68 @@
+"""
+Periodic maintenance jobs.
+
+``sweep_found_pets`` is normally run by the ``move_found_pets`` command from
+cron. Setting ``FOUND_PET_SWEEP_INTERVAL`` instead runs it from a daemon
+thread started by the WSGI/ASGI entry points. That thread runs in every server
+process, so it is meant for single-process deployments. Concurrent sweeps
+are still safe: the rows are locked (or, on SQLite, the write is serialized),
+and a sweep only moves pets that are still found.
+"""
+
+import logging
+import threading
+
+from django.conf import settings
+from django.db import close_old_connections
+
+logger = logging.getLogger(__name__)
+
+_lock = threading.Lock()
+_thread = None
+
+
+def sweep_found_pets():
+    """Run the found-to-adoption sweep once and return the moved pet ids.
+
+    The bulk UPDATE skips ``post_save``, so the data that depends on a pet's
+    status is brought up to date here: pets up for adoption are no longer
+    lost/found match candidates. (Their photos, and so the media reference
+    counts, are unchanged; the search index follows the table by trigger.)
+    """
+    from .models import Pet, PetMatch
+
+    pet_ids = Pet.move_found_to_adoption()
+    if pet_ids:
+        PetMatch.objects.filter(found_id__in=pet_ids).delete()
+        logger.info("Moved %d found pet(s) to adoption: %s", len(pet_ids), pet_ids)
+    return pet_ids
+
+
+def _run(interval, stop_event):
+    while not stop_event.is_set():
+        try:
+            sweep_found_pets()
+        except Exception:
+            logger.exception("Found pet sweep failed")
+        finally:
+            # This thread owns its own DB connection; don't let it go stale
+            close_old_connections()
+        stop_event.wait(interval)
+
+
+def start_scheduler():
+    """Start the sweep thread once per process. Returns the thread or ``None``."""
+    global _thread
+    interval = getattr(settings, 'FOUND_PET_SWEEP_INTERVAL', 0)
+    if not interval or interval <= 0:
+        return None
+    with _lock:
+        if _thread is None or not _thread.is_alive():
+            stop_event = threading.Event()
+            _thread = threading.Thread(
+                target=_run, args=(interval, stop_event),
+                name='found-pet-sweeper', daemon=True,
+            )
+            _thread.stop_event = stop_event
+            _thread.start()
+    return _thread
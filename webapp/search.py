@@ -0,0 +1,160 @@
+"""
+Ranked full-text search over pets.
+
+The search backend is pluggable (``settings.PET_SEARCH_BACKEND``). On SQLite
+the default backend queries ``webapp_pet_fts``, an FTS5 index over the pet's
+text fields that triggers keep in step with ``webapp_pet`` (see migration
+0013), and ranks matches with bm25. Other databases fall back to
+``BasicSearchBackend``, which filters with ``icontains`` and lists newest first.
+
+Free text is turned into prefix terms that must all match, so "lab pun"
+finds a Labrador in Pune. Species and status filter on the indexed columns;
+the location filter is matched against the location column of the index.
+"""
+
+import re
+import threading
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import Q
+from django.utils.module_loading import import_string
+
+from .models import Pet
+
+FTS_TABLE = 'webapp_pet_fts'
+# Indexed columns, in table order, with their bm25 weights
+FTS_COLUMNS = (('name', 10.0), ('breed', 4.0), ('color', 2.0), ('location', 3.0), ('description', 1.0))
+# Deepest page served: past it the OFFSET would be far beyond any result (and
+# huge numbers overflow the database's integers), so the page is just empty
+MAX_PAGE = 1000
+
+_WORD = re.compile(r'\w+', re.UNICODE)
+
+
+def tokenize(text):
+    return _WORD.findall(text or '')
+
+
+def fts_terms(text):
+    """Quote each word as an FTS5 prefix term; user syntax is never passed through."""
+    return ' '.join(f'"{word}"*' for word in tokenize(text))
+
+
+class SearchPage:
+    """One page of search results, best match first."""
+
+    def __init__(self, pets, number, has_next):
+        self.pets = pets
+        self.number = number
+        self.has_next = has_next
+
+    @property
+    def has_previous(self):
+        return self.number > 1
+
+
+class BaseSearchBackend:
+    """Interface for pet search backends."""
+
+    def search_ids(self, query='', species=None, status=None, location=None, limit=24, offset=0):
+        """Return the ids of matching pets, best match first."""
+        raise NotImplementedError
+
+    def rebuild(self):
+        """Re-index every pet (after bulk loads that bypassed the sync mechanism)."""
+
+    def _filtered(self, species, status):
+        queryset = Pet.objects.all()
+        if species:
+            queryset = queryset.filter(species=species)
+        if status:
+            queryset = queryset.filter(status=status)
+        return queryset
+
+
+class BasicSearchBackend(BaseSearchBackend):
+    """Portable fallback: every word must appear in one of the text fields."""
+
+    def search_ids(self, query='', species=None, status=None, location=None, limit=24, offset=0):
+        queryset = self._filtered(species, status)
+        for word in tokenize(query):
+            queryset = queryset.filter(
+                Q(name__icontains=word) | Q(breed__icontains=word) | Q(color__icontains=word)
+                | Q(location__icontains=word) | Q(description__icontains=word)
+            )
+        for word in tokenize(location):
+            queryset = queryset.filter(location__icontains=word)
+        queryset = queryset.order_by('-date_added', '-id').values_list('id', flat=True)
+        return list(queryset[offset:offset + limit])
+
+
+class SQLiteFTSBackend(BaseSearchBackend):
+    """FTS5 index maintained by triggers, ranked with bm25."""
+
+    def _match(self, query, location):
+        parts = []
+        if tokenize(query):
+            parts.append(f'({fts_terms(query)})')
+        if tokenize(location):
+            parts.append(f'location : ({fts_terms(location)})')
+        return ' AND '.join(parts)
+
+    def search_ids(self, query='', species=None, status=None, location=None, limit=24, offset=0):
+        match = self._match(query, location)
+        if not match:
+            # Filters only: no text to rank by, list newest first
+            queryset = self._filtered(species, status).order_by('-date_added', '-id')
+            return list(queryset.values_list('id', flat=True)[offset:offset + limit])
+
+        weights = ', '.join(str(weight) for _, weight in FTS_COLUMNS)
+        sql = [
+            f'SELECT p.id FROM {FTS_TABLE} JOIN webapp_pet p ON p.id = {FTS_TABLE}.rowid',
+            f'WHERE {FTS_TABLE} MATCH %s',
+        ]
+        params = [match]
+        if species:
+            sql.append('AND p.species = %s')
+            params.append(species)
+        if status:
+            sql.append('AND p.status = %s')
+            params.append(status)
+        sql.append(f'ORDER BY bm25({FTS_TABLE}, {weights}), p.id DESC LIMIT %s OFFSET %s')
+        params += [limit, offset]
+        with connection.cursor() as cursor:
+            cursor.execute(' '.join(sql), params)
+            return [row[0] for row in cursor.fetchall()]
+
+    def rebuild(self):
+        with connection.cursor() as cursor:
+            cursor.execute(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES('rebuild')")
+
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def get_search_backend():
+    """Return the process-wide backend from ``settings.PET_SEARCH_BACKEND``."""
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                default = 'webapp.search.SQLiteFTSBackend' if connection.vendor == 'sqlite' else 'webapp.search.BasicSearchBackend'
+                _backend = import_string(getattr(settings, 'PET_SEARCH_BACKEND', None) or default)()
+    return _backend
+
+
+def search_pets(query='', species=None, status=None, location=None, page=1, page_size=24):
+    """Return a :class:`SearchPage` of pets for the given text and filters."""
+    page = max(1, page)
+    if page > MAX_PAGE:
+        return SearchPage([], page, False)
+    ids = get_search_backend().search_ids(
+        query, species=species, status=status, location=location,
+        limit=page_size + 1, offset=(page - 1) * page_size,
+    )
+    has_next = len(ids) > page_size
+    ids = ids[:page_size]
+    pets_by_id = Pet.objects.select_related('owner').in_bulk(ids)
+    return SearchPage([pets_by_id[pid] for pid in ids if pid in pets_by_id], page, has_next)
@@ -0,0 +1,90 @@
+from django.conf import settings
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from .admin_directory import admin_directory
+from .images import schedule_renditions
+from .matching import MATCH_FIELDS, OPPOSITE, refresh_matches
+from .models import AdminProfile, Notification, Pet, PetRegistrationRequest
+from .notifications import adjust_unread_count
+from .storage import adjust_references
+
+
+@receiver(pre_save, sender=Notification)
+def notification_saving(sender, instance, **kwargs):
+    # The stored (user_id, unread) being overwritten, if the row exists
+    instance._previous_unread = None
+    if instance.pk is not None:
+        instance._previous_unread = (sender.objects.filter(pk=instance.pk)
+                                     .values_list('user_id', 'unread').first())
+
+
+@receiver(post_save, sender=Notification)
+def notification_saved(sender, instance, created, **kwargs):
+    """Keep the unread counter in step when a notification is created or changes."""
+    previous = None if created else getattr(instance, '_previous_unread', None)
+    if previous != (instance.user_id, instance.unread):
+        if previous and previous[1]:
+            adjust_unread_count(previous[0], -1)
+        if instance.unread:
+            adjust_unread_count(instance.user_id, 1)
+
+
+@receiver(post_delete, sender=Notification)
+def notification_deleted(sender, instance, **kwargs):
+    if instance.unread:
+        adjust_unread_count(instance.user_id, -1)
+
+
+@receiver(post_save, sender=Pet)
+def pet_saved(sender, instance, created, raw=False, update_fields=None, **kwargs):
+    """Re-match a lost or found pet whenever its matchable details change."""
+    if raw or (created and instance.status not in OPPOSITE):
+        return
+    if update_fields is not None and not MATCH_FIELDS & set(update_fields):
+        return
+    refresh_matches(instance)
+
+
+@receiver(pre_save, sender=Pet)
+@receiver(pre_save, sender=PetRegistrationRequest)
+def photo_uploading(sender, instance, raw=False, update_fields=None, **kwargs):
+    # The upload is written to storage (committed) after this signal
+    instance._photo_uploaded = bool(instance.image) and not instance.image._committed
+    # The stored photo being replaced, whose reference is released on save
+    instance._photo_replaced = None
+    if not (raw or instance._state.adding) and (update_fields is None or 'image' in update_fields):
+        instance._photo_replaced = (sender.objects.filter(pk=instance.pk)
+                                    .values_list('image', flat=True).first())
+
+
+@receiver(post_save, sender=Pet)
+@receiver(post_save, sender=PetRegistrationRequest)
+def photo_saved(sender, instance, raw=False, update_fields=None, **kwargs):
+    """Count the reference to the photo and queue its resized copies."""
+    if raw or (update_fields is not None and 'image' not in update_fields):
+        return
+    previous, current = getattr(instance, '_photo_replaced', None), instance.image.name
+    if previous != current:
+        adjust_references(current, 1)
+        adjust_references(previous, -1)
+    schedule_renditions(instance.image, replace=getattr(instance, '_photo_uploaded', False))
+
+
+@receiver(post_delete, sender=Pet)
+@receiver(post_delete, sender=PetRegistrationRequest)
+def photo_released(sender, instance, **kwargs):
+    # The file itself stays until gc_media finds nothing else uses it
+    adjust_references(instance.image.name, -1)
+
+
+@receiver(post_save, sender=settings.AUTH_USER_MODEL)
+@receiver(post_delete, sender=settings.AUTH_USER_MODEL)
+@receiver(post_save, sender=AdminProfile)
+@receiver(post_delete, sender=AdminProfile)
+def admin_membership_changed(sender, instance, update_fields=None, **kwargs):
+    """Reload the admin id sets after any user or admin profile change."""
+    # Logins save only last_login; that can't change who is an admin
+    if update_fields is not None and set(update_fields) == {'last_login'}:
+        return
+    admin_directory.invalidate()
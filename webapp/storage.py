@@ -0,0 +1,179 @@
+"""
+Content-addressed storage for uploaded pet photos.
+
+``ContentHashStorage`` names every saved file after a hash of its bytes
+(``pet_images/<sha256[:32]>.jpg``), keeping the upload directory and
+extension. Saving bytes that are already stored writes nothing and returns the
+existing name, so re-uploads, approved registration requests and generated
+placeholders share one file. A name never changes meaning, so its URL can be
+cached forever.
+
+Shared files can't be deleted along with one pet. Instead ``MediaFile`` counts
+the ``Pet``/``PetRegistrationRequest`` rows referencing each file (kept up to
+date by signals), and ``collect_garbage`` (the ``gc_media`` command) deletes
+files nothing references any more. Bulk ``update()`` calls bypass the signals,
+so it recounts from the tables first rather than trusting the counters.
+"""
+
+import hashlib
+import os
+import posixpath
+import re
+from collections import Counter
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.files.base import File
+from django.core.files.storage import FileSystemStorage, default_storage
+from django.db.models import F
+from django.utils import timezone
+
+from .images import THUMBS_DIR, delete_renditions
+
+HASH_LENGTH = 32
+HASHED_NAME = re.compile(rf'[0-9a-f]{{{HASH_LENGTH}}}(\.\w+)?$')
+GRACE_HOURS = getattr(settings, 'MEDIA_GC_GRACE_HOURS', 24)
+
+
+def content_hash(content):
+    """Hex digest identifying ``content`` (a Django ``File``)."""
+    digest = hashlib.sha256()
+    for chunk in content.chunks():
+        digest.update(chunk)
+    content.seek(0)
+    return digest.hexdigest()[:HASH_LENGTH]
+
+
+def hashed_name(name, digest):
+    """``name`` with its file name replaced by ``digest`` (directory and extension kept)."""
+    directory, filename = posixpath.split(name)
+    return posixpath.join(directory, digest + os.path.splitext(filename)[1].lower())
+
+
+def content_name(data, ext, directory='pet_images'):
+    """Storage name of ``data`` under ``ContentHashStorage``."""
+    return hashed_name(f'{directory}/image.{ext}', hashlib.sha256(data).hexdigest()[:HASH_LENGTH])
+
+
+def is_hashed(name):
+    return bool(HASHED_NAME.match(posixpath.basename(name)))
+
+
+class ContentHashStorage(FileSystemStorage):
+    """``FileSystemStorage`` that stores each distinct file once, by content.
+
+    Renditions keep the names webapp.images gives them: those already follow
+    from the content-addressed original.
+    """
+
+    def save(self, name, content, max_length=None):
+        if name is None:
+            name = content.name
+        if name.startswith(f'{THUMBS_DIR}/'):
+            return super().save(name, content, max_length)
+        if not hasattr(content, 'chunks'):
+            content = File(content, name)
+        name = hashed_name(name, content_hash(content))
+        if self.exists(name):
+            # Bump the mtime: collect_garbage spares recently saved files, whose
+            # referencing row may not be committed yet
+            os.utime(self.path(name))
+            return name
+        # Write under a unique temporary name, then move into place: identical
+        # content saved concurrently just replaces the file with itself
+        temp = super().save(f'{name}.part', content)
+        os.replace(self.path(temp), self.path(name))
+        return name
+
+
+def image_models():
+    from .models import Pet, PetRegistrationRequest
+    return (Pet, PetRegistrationRequest)
+
+
+def adjust_references(name, delta):
+    """Add ``delta`` to the reference count of stored file ``name``."""
+    from .models import MediaFile
+    if not name or not delta:
+        return
+    files = MediaFile.objects.filter(name=name)
+    if delta < 0:
+        files.filter(refs__gte=-delta).update(refs=F('refs') + delta)
+    elif not files.update(refs=F('refs') + delta):
+        MediaFile.objects.bulk_create([MediaFile(name=name, refs=0)], ignore_conflicts=True)
+        files.update(refs=F('refs') + delta)
+
+
+def count_references():
+    """``{name: rows referencing it}`` across the image models, from the tables."""
+    refs = Counter()
+    for model in image_models():
+        refs.update(model.objects.exclude(image='').exclude(image__isnull=True)
+                    .values_list('image', flat=True).iterator())
+    return refs
+
+
+def recount_references():
+    """Reset every ``MediaFile`` counter from the tables; returns the counts."""
+    from .models import MediaFile
+    refs = count_references()
+    MediaFile.objects.exclude(name__in=list(refs)).update(refs=0)
+    MediaFile.objects.bulk_create(
+        [MediaFile(name=name, refs=count) for name, count in refs.items()],
+        update_conflicts=True, unique_fields=['name'], update_fields=['refs'], batch_size=500,
+    )
+    return refs
+
+
+def upload_directories():
+    return sorted({model._meta.get_field('image').upload_to.strip('/') for model in image_models()})
+
+
+def rehash_files(storage=default_storage):
+    """Move referenced files with pre-hash names to content names.
+
+    Duplicates among them collapse into one file. The old files are left for
+    ``collect_garbage``; the new ones still need their renditions. Returns
+    ``{old name: new name}``.
+    """
+    moved = {}
+    for name in count_references():
+        if is_hashed(name) or not storage.exists(name):
+            continue
+        with storage.open(name, 'rb') as handle:
+            moved[name] = storage.save(name, handle)
+        for model in image_models():
+            model.objects.filter(image=name).update(image=moved[name])
+    return moved
+
+
+def collect_garbage(storage=default_storage, grace=None, dry_run=False):
+    """Delete stored images (and their renditions) that nothing references.
+
+    Files modified within ``grace`` (default ``MEDIA_GC_GRACE_HOURS``) are
+    kept: their referencing row may still be in an open transaction.
+    Returns the deleted names.
+    """
+    from .models import MediaFile
+    refs = recount_references()
+    cutoff = timezone.now() - (timedelta(hours=GRACE_HOURS) if grace is None else grace)
+
+    deleted = []
+    for directory in upload_directories():
+        if not storage.exists(directory):
+            continue
+        for filename in storage.listdir(directory)[1]:
+            name = f'{directory}/{filename}'
+            if refs[name] or storage.get_modified_time(name) > cutoff:
+                continue
+            if not dry_run:
+                storage.delete(name)
+                delete_renditions(name, storage)
+            deleted.append(name)
+    if not dry_run:
+        MediaFile.objects.filter(refs=0, name__in=deleted).delete()
+        # Counters for files removed by other means
+        stale = [name for name in MediaFile.objects.filter(refs=0).values_list('name', flat=True)
+                 if not storage.exists(name)]
+        MediaFile.objects.filter(name__in=stale).delete()
+    return deleted
@@ -0,0 +1,210 @@
+"""
+Streaming upload handling for pet photos.
+
+``PetImageUploadHandler`` takes over the ``image`` field of the pet forms.
+It streams the upload to a temporary file, so a large photo is never held in
+memory, and it validates while the data arrives:
+
+* the first bytes must be a JPEG, PNG, GIF or WebP signature;
+* the dimensions, read from the header, must stay under
+  ``PET_IMAGE_MAX_PIXELS`` (a guard against decompression bombs);
+* the size must stay under ``PET_IMAGE_MAX_UPLOAD_MB``.
+
+A rejected upload stops being written; the rest of it is read and discarded.
+The form's ``PetImageField`` then reports the reason. Photos larger than
+``PET_IMAGE_MAX_DIMENSION`` on a side are downscaled once complete, in a small
+worker pool that bounds how many large images are decoded at once.
+
+Views opt in with the ``pet_image_uploads`` decorator.
+"""
+
+import struct
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache, wraps
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.uploadedfile import TemporaryUploadedFile, UploadedFile
+from django.core.files.uploadhandler import FileUploadHandler, StopFutureHandlers
+from django.template.defaultfilters import filesizeformat
+from django.views.decorators.csrf import csrf_exempt, csrf_protect
+from PIL import Image, ImageOps
+
+MAX_UPLOAD_BYTES = int(getattr(settings, 'PET_IMAGE_MAX_UPLOAD_MB', 10) * 1024 * 1024)
+MAX_PIXELS = getattr(settings, 'PET_IMAGE_MAX_PIXELS', 50_000_000)
+MAX_DIMENSION = getattr(settings, 'PET_IMAGE_MAX_DIMENSION', 3200)
+RESIZE_WORKERS = getattr(settings, 'PET_IMAGE_RESIZE_WORKERS', 2)
+# JPEG headers (EXIF, embedded thumbnails) can run long before the size
+HEADER_LIMIT = 256 * 1024
+SIGNATURES = (
+    (b'\xff\xd8\xff', 'JPEG'),
+    (b'\x89PNG\r\n\x1a\n', 'PNG'),
+    (b'GIF87a', 'GIF'),
+    (b'GIF89a', 'GIF'),
+)
+SAVE_OPTIONS = {'JPEG': {'quality': 90}, 'WEBP': {'quality': 90}, 'PNG': {'optimize': True}}
+
+
+def sniff_format(head):
+    """Image format from a file's first bytes, or ``None`` if not one we take."""
+    if head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+        return 'WEBP'
+    for signature, fmt in SIGNATURES:
+        if head.startswith(signature):
+            return fmt
+    return None
+
+
+def _webp_size(head):
+    # Pillow decodes WebP from the whole file; the header is enough here
+    chunk = head[12:16]
+    if chunk == b'VP8 ' and len(head) >= 30:
+        width, height = struct.unpack('<HH', head[26:30])
+        return width & 0x3fff, height & 0x3fff
+    if chunk == b'VP8L' and len(head) >= 25:
+        bits = struct.unpack('<I', head[21:25])[0]
+        return (bits & 0x3fff) + 1, ((bits >> 14) & 0x3fff) + 1
+    if chunk == b'VP8X' and len(head) >= 30:
+        return (1 + int.from_bytes(head[24:27], 'little'), 1 + int.from_bytes(head[27:30], 'little'))
+    return None
+
+
+def image_size(head, fmt):
+    """``(width, height)`` from the start of a file, or ``None`` if more is needed."""
+    if fmt == 'WEBP':
+        return _webp_size(head)
+    try:
+        try:
+            with Image.open(BytesIO(head), formats=[fmt]) as image:
+                return image.size
+        except Image.DecompressionBombError:
+            # Far past MAX_PIXELS too: read the size with the format's plugin,
+            # which skips Pillow's check, so the upload is rejected with it
+            Image.preinit()
+            with Image.OPEN[fmt][0](BytesIO(head)) as image:
+                return image.size
+    except (OSError, SyntaxError, struct.error):
+        return None
+
+
+@lru_cache(maxsize=None)
+def _resize_pool():
+    return ThreadPoolExecutor(max_workers=RESIZE_WORKERS, thread_name_prefix='pet-image-resize')
+
+
+def _downscale(file, fmt, max_dimension):
+    file.seek(0)
+    with Image.open(file) as image:
+        if getattr(image, 'n_frames', 1) > 1:
+            return  # Leave animations alone
+        image.draft(None, (max_dimension, max_dimension))
+        image = ImageOps.exif_transpose(image)
+        image.thumbnail((max_dimension, max_dimension), Image.LANCZOS)
+    file.seek(0)
+    file.truncate()
+    image.save(file, fmt, **SAVE_OPTIONS.get(fmt, {}))
+    file.flush()
+
+
+class RejectedUpload(UploadedFile):
+    """Stand-in for an upload the handler refused; ``upload_error`` says why."""
+
+    def __init__(self, name, content_type, size, upload_error):
+        super().__init__(BytesIO(), name, content_type, size)
+        self.upload_error = upload_error
+
+
+class PetImageUploadHandler(FileUploadHandler):
+    """Streams pet photo fields to disk, validating them as they arrive."""
+
+    field_names = ('image',)
+
+    def new_file(self, field_name, file_name, content_type, content_length, *args, **kwargs):
+        super().new_file(field_name, file_name, content_type, content_length, *args, **kwargs)
+        self.active = field_name in self.field_names
+        if not self.active:
+            return
+        self.head, self.format, self.error = b'', None, None
+        self.file = TemporaryUploadedFile(file_name, content_type, 0, self.charset, self.content_type_extra)
+        if content_length and content_length > MAX_UPLOAD_BYTES:
+            self.reject(self.too_large())
+        raise StopFutureHandlers()
+
+    def too_large(self):
+        return f'Photos can be at most {filesizeformat(MAX_UPLOAD_BYTES)}.'
+
+    def reject(self, error):
+        self.error = error
+        self.file.close()
+
+    def check_header(self, complete=False):
+        """Validate the start of the file; ``True`` once it has been accepted."""
+        if self.format is None:
+            self.format = sniff_format(self.head)
+            if self.format is None:
+                if len(self.head) >= 12 or complete:
+                    self.reject('Upload a JPEG, PNG, GIF or WebP image.')
+                return False
+        self.dimensions = image_size(self.head, self.format)
+        if self.dimensions is None:
+            if len(self.head) >= HEADER_LIMIT or complete:
+                self.reject('The image could not be read.')
+            return False
+        if self.dimensions[0] * self.dimensions[1] > MAX_PIXELS:
+            self.reject(f'The image is too large ({self.dimensions[0]}x{self.dimensions[1]} pixels).')
+            return False
+        self.file.content_type = Image.MIME[self.format]
+        self.head = None
+        return True
+
+    def receive_data_chunk(self, raw_data, start):
+        if not self.active:
+            return raw_data
+        if self.error:
+            return None
+        if start + len(raw_data) > MAX_UPLOAD_BYTES:
+            self.reject(self.too_large())
+            return None
+        if self.head is not None:
+            self.head += raw_data
+            self.check_header()
+            if self.error:
+                return None
+        self.file.write(raw_data)
+        return None
+
+    def file_complete(self, file_size):
+        if not self.active:
+            return None
+        if not self.error and self.head is not None:
+            self.check_header(complete=True)
+        if self.error:
+            return RejectedUpload(self.file_name, self.content_type, file_size, self.error)
+        self.file.flush()
+        if max(self.dimensions) > MAX_DIMENSION:
+            _resize_pool().submit(_downscale, self.file.file, self.format, MAX_DIMENSION).result()
+            self.file.seek(0, 2)
+            file_size = self.file.tell()
+        self.file.seek(0)
+        self.file.size = file_size
+        return self.file
+
+    def upload_interrupted(self):
+        if getattr(self, 'active', False):
+            self.file.close()
+
+
+def pet_image_uploads(view):
+    """Parse the view's uploads with ``PetImageUploadHandler``.
+
+    Upload handlers must be installed before anything reads ``request.POST``,
+    which the CSRF middleware does; so the check runs here, after it.
+    """
+    protected = csrf_protect(view)
+
+    @csrf_exempt
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        request.upload_handlers.insert(0, PetImageUploadHandler(request))
+        return protected(request, *args, **kwargs)
+    return wrapper
@@ -10,6 +10,7 @@ urlpatterns = [
     path('adoption/', views.adoption_list, name='adoption_list'),
     path('lost/', views.lost_list, name='lost_list'),
     path('found/', views.found_list, name='found_list'),
+    path('search/', views.search, name='search'),
     path('pet/<int:pet_id>/', views.pet_detail, name='pet_detail'),
     path('pet/<int:pet_id>/edit/', views.edit_pet, name='edit_pet'),
     
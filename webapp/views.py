@@ -1,5 +1,5 @@
 from django.shortcuts import render, get_object_or_404
-from .models import Pet, AdoptionRequest, UserProfile, AdminProfile, PetRegistrationRequest
+from .models import Pet, AdoptionRequest, UserProfile, AdminProfile, PetRegistrationRequest, PetMatch
 from django.db.models import Count
 from django.template import engines # Updated import for debugging
 from django.template.exceptions import TemplateDoesNotExist
@@ -23,11 +23,19 @@ from django.core.mail import send_mail
 from django.conf import settings
 from django.views.decorators.http import require_http_methods
 from .models import Notification
+from .listing import get_page_size, pet_list_context
+from .search import search_pets
+from .facets import pet_facets
+from .scheduler import sweep_found_pets
+from .notifications import mark_read, notify_many
 from django.contrib.auth.decorators import login_required
 from django.db.models import Count
 from django.shortcuts import redirect
 
-from chat.models import Conversation, ChatMember
+from chat.models import Conversation
+from chat.membership import add_members
+from .admin_directory import admin_directory
+from .uploads import pet_image_uploads
 
 
 def about(request):
@@ -40,9 +48,6 @@ def contact(request):
 
     On POST this will create a Notification for all admin users.
     """
-    from django.contrib.auth import get_user_model
-    UserModel = get_user_model()
-    admins = UserModel.objects.filter(is_staff=True) | UserModel.objects.filter(is_superuser=True)
     if request.method == 'POST':
         name = request.POST.get('name') or (request.user.get_full_name() if request.user.is_authenticated else 'Anonymous')
         email = request.POST.get('email') or (request.user.email if request.user.is_authenticated else '')
@@ -50,14 +55,13 @@ def contact(request):
         if not message:
             return render(request, 'webapp/contact_modern.html', {'error': 'Please enter a message.', 'page_title': 'Contact', 'name': name, 'email': email})
         # Notify admins
-        for admin in admins:
-            Notification.objects.create(
-                user=admin,
-                actor=(request.user if request.user.is_authenticated else None),
-                verb='Contact form message',
-                message=f'Contact form from {name} ({email}): {message[:300]}',
-                url=''
-            )
+        notify_many(
+            admin_directory.staff_ids(),
+            verb='Contact form message',
+            message=f'Contact form from {name} ({email}): {message[:300]}',
+            url='',
+            actor=(request.user if request.user.is_authenticated else None),
+        )
         return render(request, 'webapp/contact_modern.html', {'success': True, 'page_title': 'Contact'})
     return render(request, 'webapp/contact_modern.html', {'page_title': 'Contact'})
 
@@ -76,15 +80,14 @@ def admin_start_chat(request, user_id):
     """Admin-only: start or return a conversation between admin team and the selected user."""
     from django.http import HttpResponseForbidden
     # Simple inline admin check to avoid decorator ordering issues
-    if not (request.user.is_authenticated and (hasattr(request.user, 'adminprofile') or request.user.is_staff or request.user.is_superuser)):
+    if not (admin_directory.has_profile(request.user, fresh=True) or request.user.is_staff or request.user.is_superuser):
         return HttpResponseForbidden('Admin access required')
     from django.contrib.auth import get_user_model
     UserModel = get_user_model()
     target = get_object_or_404(UserModel, id=user_id)
 
     # Collect admin ids (staff or superuser) and ensure the requesting admin is included
-    admin_qs = UserModel.objects.filter(is_staff=True) | UserModel.objects.filter(is_superuser=True)
-    admin_ids = list(admin_qs.values_list('id', flat=True))
+    admin_ids = list(admin_directory.staff_ids())
     # Ensure current admin included
     if request.user.id not in admin_ids:
         admin_ids.append(request.user.id)
@@ -98,70 +101,85 @@ def admin_start_chat(request, user_id):
     # include a timestamp suffix so subject is unique and easy to search
     convo = Conversation.objects.using(chat_db).create(subject=f'Admin chat with {target.username} - {timezone.now().isoformat()}')
 
-    # Ensure ChatMember rows exist for all participants (use get_or_create to avoid UNIQUE errors)
-    for uid in participant_ids:
-        ChatMember.objects.using(chat_db).get_or_create(conversation_id=convo.id, user_id=uid)
+    # Add all participants in a single insert
+    add_members(convo.id, participant_ids)
 
     return redirect('chat:conversation', convo_id=convo.id)
 
 def adoption_list(request):
-    # Auto-move found pets to adoption after 15 days
-    found_pets = Pet.objects.filter(status='found', found_date__isnull=False)
-    moved_count = 0
-    for pet in found_pets:
-        if pet.auto_move_to_adoption():
-            moved_count += 1
-    
-    if moved_count > 0:
-        messages.info(request, f'{moved_count} found pet(s) have been automatically moved to adoption after 15 days.')
-    
-    # Fetch only pets that are 'for_adoption'
-    pets = Pet.objects.filter(status='for_adoption').order_by('-date_added')
-    context = {
-        'pets': pets,
-        'page_title': 'Pets Available for Adoption'
-    }
+    # Found pets are moved to adoption by the background sweep (webapp.scheduler)
+    # Fetch only pets that are 'for_adoption', one keyset page at a time
+    filters = {'status': 'for_adoption'}
+    pets = Pet.objects.filter(**filters)
+    context = pet_list_context(request, pets, 'Pets Available for Adoption', filters)
     # Render the pet_list.html template with the filtered pets
     return render(request, 'webapp/pet_list_modern.html', context)
 
 
-def home(request):
-    """Home view that shows all pets regardless of status."""
-    pets = Pet.objects.select_related('owner').order_by('-date_added')
+def search(request):
+    """Ranked full-text search over all pets (see webapp.search)."""
+    query = request.GET.get('q', '').strip()
+    species = request.GET.get('species', '')
+    status = request.GET.get('status', '')
+    location = request.GET.get('location', '').strip()
+    # Ignore filter values that aren't real choices
+    species = species if species in dict(Pet.SPECIES_CHOICES) else ''
+    status = status if status in dict(Pet.STATUS_CHOICES) else ''
+    try:
+        page = int(request.GET.get('page', 1))
+    except ValueError:
+        page = 1
+
+    results = None
+    if query or species or status or location:
+        results = search_pets(query, species=species or None, status=status or None, location=location,
+                              page=page, page_size=get_page_size(request))
+    params = request.GET.copy()
+    params.pop('page', None)
     context = {
-        'pets': pets,
-        'page_title': 'All Pets'
+        'results': results,
+        'q': query,
+        'species': species,
+        'status': status,
+        'location': location,
+        'species_choices': Pet.SPECIES_CHOICES,
+        'status_choices': Pet.STATUS_CHOICES,
+        'base_query': params.urlencode(),
+        'page_title': 'Search Pets',
     }
+    return render(request, 'webapp/search_modern.html', context)
+
+
+def home(request):
+    """Home view that shows all pets regardless of status."""
+    pets = Pet.objects.select_related('owner')
+    context = pet_list_context(request, pets, 'All Pets')
     return render(request, 'webapp/pet_list_modern.html', context)
 
 # View for the Lost Pets page
 def lost_list(request):
     # Fetch only pets that are 'lost'
-    pets = Pet.objects.filter(status='lost').order_by('-date_added')
-    context = {
-        'pets': pets,
-        'page_title': 'Lost Pets'
-    }
+    filters = {'status': 'lost'}
+    pets = Pet.objects.filter(**filters)
+    context = pet_list_context(request, pets, 'Lost Pets', filters)
     # Reuse the same template
     return render(request, 'webapp/pet_list_modern.html', context)
 
 # View for the Found Pets page
 def found_list(request):
     # Fetch only pets that are 'found'
-    pets = Pet.objects.filter(status='found').order_by('-date_added')
+    filters = {'status': 'found'}
+    pets = Pet.objects.filter(**filters)
+    context = pet_list_context(request, pets, 'Found Pets', filters)
     
-    # Add days remaining info for each pet
-    for pet in pets:
+    # Add days remaining info for each pet on this page
+    for pet in context['pets']:
         if pet.found_date:
             days_passed = (timezone.now() - pet.found_date).days
             pet.days_remaining = max(0, 15 - days_passed)
         else:
             pet.days_remaining = 15
     
-    context = {
-        'pets': pets,
-        'page_title': 'Found Pets'
-    }
     # Reuse the same template
     return render(request, 'webapp/pet_list_modern.html', context)
 
@@ -180,6 +198,15 @@ def pet_detail(request, pet_id):
         'similar_pets': similar_pets
     }
 
+    # Lost pets: found reports nearby, and vice versa
+    opposite = {'lost': 'found', 'found': 'lost'}.get(pet.status)
+    if opposite:
+        # Scored by the match engine (webapp.matching); one joined query
+        context['matched_pets'] = PetMatch.for_pet(pet)
+        matched_ids = {p.id for p in context['matched_pets']}
+        context['nearby_pets'] = [p for p in pet.nearby_pets(opposite) if p.id not in matched_ids]
+        context['nearby_status'] = opposite
+
     # Add days remaining info for found pets
     if pet.status == 'found' and pet.found_date:
         days_passed = (timezone.now() - pet.found_date).days
@@ -218,6 +245,7 @@ def logout_view(request):
     return redirect('webapp:login')
 
 @login_required
+@pet_image_uploads
 def add_pet(request):
     if request.method == 'POST':
         form = PetForm(request.POST, request.FILES)
@@ -238,12 +266,13 @@ def add_pet(request):
 
 
 @login_required
+@pet_image_uploads
 def edit_pet(request, pet_id):
     """Allow a pet owner (or admin) to edit their pet listing."""
     pet = get_object_or_404(Pet, id=pet_id)
 
     # Only owner or admin can edit
-    if pet.owner != request.user and not (hasattr(request.user, 'adminprofile') or request.user.is_staff):
+    if pet.owner != request.user and not (admin_directory.has_profile(request.user, fresh=True) or request.user.is_staff):
         messages.error(request, 'You do not have permission to edit this pet.')
         return redirect('webapp:dashboard')
 
@@ -361,20 +390,21 @@ def admin_register_view(request):
     return render(request, 'webapp/admin_register_modern.html', {'form': form})
 
 def is_admin(user):
-    return user.is_authenticated and hasattr(user, 'adminprofile')
+    return admin_directory.has_profile(user, fresh=True)
 
 @user_passes_test(is_admin)
 def admin_dashboard(request):
     # Check if user is admin
-    if not (request.user.is_authenticated and hasattr(request.user, 'adminprofile')):
+    if not admin_directory.has_profile(request.user, fresh=True):
         messages.error(request, 'Access denied. Admin privileges required.')
         return redirect('webapp:dashboard')
     
-    # Statistics
-    total_pets = Pet.objects.count()
-    adoption_pets = Pet.objects.filter(status='for_adoption').count()
-    lost_pets = Pet.objects.filter(status='lost').count()
-    found_pets = Pet.objects.filter(status='found').count()
+    # Statistics: pet totals per status/species/location from one grouped query
+    facets = pet_facets()
+    total_pets = facets.total
+    adoption_pets = facets.count('status', 'for_adoption')
+    lost_pets = facets.count('status', 'lost')
+    found_pets = facets.count('status', 'found')
     total_users = User.objects.count()
     pending_requests = AdoptionRequest.objects.filter(status='pending').count()
     pending_registration_requests = PetRegistrationRequest.objects.filter(status='pending').count()
@@ -391,13 +421,14 @@ def admin_dashboard(request):
         'pending_requests': pending_requests,
         'pending_registration_requests': pending_registration_requests,
         'recent_pets': recent_pets,
+        'facets': facets,
     }
     return render(request, 'webapp/admin_dashboard_modern.html', context)
 
 @user_passes_test(is_admin)
 def admin_pet_management(request):
     # Check if user is admin
-    if not (request.user.is_authenticated and hasattr(request.user, 'adminprofile')):
+    if not admin_directory.has_profile(request.user, fresh=True):
         messages.error(request, 'Access denied. Admin privileges required.')
         return redirect('webapp:dashboard')
     
@@ -410,7 +441,7 @@ def admin_user_management(request):
     all_users = UserProfile.objects.select_related('user').all()
     
     # Count admin users
-    admin_count = AdminProfile.objects.count()
+    admin_count = len(admin_directory.profile_ids())
     
     # Count users with pets
     active_owners = UserProfile.objects.annotate(
@@ -527,8 +558,7 @@ def notifications_list(request):
 @require_http_methods(["POST"])
 def mark_notification_read(request, notification_id):
     notif = get_object_or_404(Notification, id=notification_id, user=request.user)
-    notif.unread = False
-    notif.save()
+    mark_read(notif)
     return JsonResponse({'success': True})
 
 @login_required
@@ -538,6 +568,7 @@ def redirect_to_register_pet(request):
     return redirect('webapp:register_pet_request')
 
 @login_required
+@pet_image_uploads
 def register_pet_request(request):
     """View for users to submit pet registration requests"""
     if request.method == 'POST':
@@ -561,7 +592,7 @@ def registration_status(request):
 
 def is_admin(user):
     """Helper function to check if user is an admin"""
-    return user.is_authenticated and (user.is_staff or AdminProfile.objects.filter(user=user).exists())
+    return user.is_staff or admin_directory.has_profile(user, fresh=True)
 
 @user_passes_test(is_admin)
 def admin_registration_requests(request):
@@ -580,13 +611,8 @@ def admin_registration_requests(request):
 @require_POST
 def run_auto_move_command(request):
     """Admin endpoint to trigger the auto-move logic and return JSON."""
-    moved = 0
-    found_pets = Pet.objects.filter(status='found', found_date__isnull=False)
-    for pet in found_pets:
-        if pet.auto_move_to_adoption():
-            moved += 1
-
-    return JsonResponse({'success': True, 'moved': moved})
+    moved_ids = sweep_found_pets()
+    return JsonResponse({'success': True, 'moved': len(moved_ids), 'moved_ids': moved_ids})
 
 @user_passes_test(is_admin)
 @require_POST